@@ -0,0 +1,325 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import numpy as np
+from aiohttp import web, WSMsgType
+
+from resample import INTERVAL_MILLISECONDS
+from storage import find_dataset, load_klines
+
+# A local stand-in for the Binance endpoints the fetchers use, serving stored klines:
+# GET /api/v3/klines, GET /api/v3/exchangeInfo, GET /api/v3/ping and the kline websocket
+# streams (/ws/<stream> and combined /stream?streams=<stream>/<stream>...).
+# Point http_client.BASE_URL / STREAM_URL (or the base_url / stream_url arguments) at it.
+FAKE_EXCHANGE_HOST = "127.0.0.1"
+FAKE_EXCHANGE_PORT = 8765
+
+KLINES_MAX_LIMIT = 1000
+# Frames queued per websocket connection; a client that falls further behind is disconnected
+CONNECTION_QUEUE_SIZE = 10_000
+
+
+def _number(value):
+    # Prices and volumes are sent as strings, like the exchange does, without losing precision
+    return repr(float(value))
+
+
+class FakeMarket:
+    """
+    Stored klines replayed on a clock: bar `start_index` of every dataset is the bar open when
+    the market starts, earlier bars are history and later ones open as the clock advances.
+    Kline times are shifted so the server clock is the wall clock, which keeps close times and
+    latencies realistic and agrees with the clients on which bars have closed. To replay faster,
+    serve the klines as shorter bars (load_market's `interval`).
+
+    Args:
+    - datasets: {(symbol, interval): klines DataFrame}, intervals of a fixed length only (not 1M).
+    - start_index: Bars already closed when the market starts (available over REST).
+    """
+    def __init__(self, datasets, start_index=1000):
+        self.started = time.time()
+        self.streams = {}  # stream name -> dict with symbol, interval, arrays
+        for (symbol, interval), df in datasets.items():
+            interval_ms = INTERVAL_MILLISECONDS[interval]
+            index = min(start_index, len(df) - 1)
+            times = df['time'].to_numpy().astype(np.int64)
+            current_bar = int(self.started * 1000) // interval_ms * interval_ms
+            self.streams[f"{symbol.lower()}@kline_{interval}"] = {
+                'symbol': symbol,
+                'interval': interval,
+                'interval_ms': interval_ms,
+                'time': times - times[index] + current_bar,
+                'values': {column: df[column].to_numpy(dtype=np.float64) for column in ('open', 'high', 'low', 'close', 'volume')},
+            }
+
+    def now(self):
+        """
+        Server clock in epoch milliseconds.
+        """
+        return int(time.time() * 1000)
+
+    def find(self, symbol, interval):
+        return self.streams.get(f"{symbol.lower()}@kline_{interval}")
+
+    def closed_count(self, stream, now=None):
+        """
+        Number of bars of the stream closed at `now` (bars past the end of the dataset never close).
+        """
+        now = self.now() if now is None else now
+        return int(np.searchsorted(stream['time'] + stream['interval_ms'], now, side='right'))
+
+    def rest_klines(self, stream, limit, start_time=None, end_time=None):
+        """
+        Closed klines the way /api/v3/klines selects them, as REST rows.
+        """
+        times = stream['time'][:self.closed_count(stream)]
+        if start_time is not None:
+            first = int(np.searchsorted(times, start_time, side='left'))
+            last = len(times) if end_time is None else int(np.searchsorted(times, end_time, side='right'))
+            selected = range(first, min(last, first + limit))
+        else:
+            last = len(times) if end_time is None else int(np.searchsorted(times, end_time, side='right'))
+            selected = range(max(0, last - limit), last)
+        values = stream['values']
+        interval_ms = stream['interval_ms']
+        return [
+            [int(times[i]), _number(values['open'][i]), _number(values['high'][i]), _number(values['low'][i]),
+             _number(values['close'][i]), _number(values['volume'][i]), int(times[i]) + interval_ms - 1,
+             "0", 0, "0", "0", "0"]
+            for i in selected
+        ]
+
+    def kline_event(self, stream, index, progress=1.0):
+        """
+        Kline event of bar `index`; with progress < 1 the bar is unclosed and only partly formed.
+        """
+        values = stream['values']
+        open_ = values['open'][index]
+        if progress >= 1.0:
+            high, low, close, volume = values['high'][index], values['low'][index], values['close'][index], values['volume'][index]
+        else:
+            close = open_ + (values['close'][index] - open_) * progress
+            high, low, volume = max(open_, close), min(open_, close), values['volume'][index] * progress
+        open_time = int(stream['time'][index])
+        # Same field order as Binance
+        return {
+            "e": "kline", "E": self.now(), "s": stream['symbol'],
+            "k": {
+                "t": open_time, "T": open_time + stream['interval_ms'] - 1, "s": stream['symbol'], "i": stream['interval'],
+                "f": 0, "L": 0, "o": _number(open_), "c": _number(close), "h": _number(high), "l": _number(low), "v": _number(volume),
+                "n": 0, "x": bool(progress >= 1.0), "q": "0", "V": "0", "Q": "0", "B": "0"
+            }
+        }
+
+
+class FakeExchange:
+    """
+    aiohttp application serving a FakeMarket, with fault injection.
+
+    Args:
+    - market: The FakeMarket.
+    - frames_per_second: Websocket frames sent per stream and second: the unclosed kline as it
+      forms, plus a closed frame whenever a bar closes.
+    - rate_limit_probability: Share of REST requests answered 429 with a Retry-After header.
+    - error_probability: Share of REST requests answered 500.
+    - disconnect_probability: Chance per frame that the connection is dropped.
+    - delay_probability, delay_seconds: Share of frames held back before being sent, and for how long.
+    - seed: Random seed of the fault injection.
+    """
+    def __init__(self, market, frames_per_second=1.0, rate_limit_probability=0.0, error_probability=0.0,
+                 disconnect_probability=0.0, delay_probability=0.0, delay_seconds=1.0, seed=None):
+        self.market = market
+        self.frames_per_second = frames_per_second
+        self.rate_limit_probability = rate_limit_probability
+        self.error_probability = error_probability
+        self.disconnect_probability = disconnect_probability
+        self.delay_probability = delay_probability
+        self.delay_seconds = delay_seconds
+        self.random = random.Random(seed)
+        self.connections = {}  # websocket -> (stream names, combined, frame queue)
+        self.stats = {'requests': 0, 'rate_limited': 0, 'errors': 0, 'frames': 0, 'disconnects': 0, 'delayed': 0}
+
+    def application(self):
+        app = web.Application()
+        app.router.add_get('/api/v3/ping', self.ping)
+        app.router.add_get('/api/v3/exchangeInfo', self.exchange_info)
+        app.router.add_get('/api/v3/klines', self.klines)
+        app.router.add_get('/ws/{stream}', self.websocket)
+        app.router.add_get('/stream', self.websocket)
+        app.on_startup.append(self.start_clock)
+        app.on_cleanup.append(self.stop_clock)
+        return app
+
+    async def start_clock(self, app):
+        # Started with the server so bars closing before the first subscription are not sent late
+        self.clock = asyncio.create_task(self.run_clock())
+
+    async def stop_clock(self, app):
+        self.clock.cancel()
+        for ws in list(self.connections):
+            await ws.close()
+
+    def fault(self):
+        """
+        Injected REST failure, or None.
+        """
+        if self.random.random() < self.rate_limit_probability:
+            self.stats['rate_limited'] += 1
+            return web.json_response({'code': -1003, 'msg': 'Too many requests.'}, status=429, headers={'Retry-After': '1'})
+        if self.random.random() < self.error_probability:
+            self.stats['errors'] += 1
+            return web.json_response({'code': -1000, 'msg': 'Internal error.'}, status=500)
+        return None
+
+    async def ping(self, request):
+        return web.json_response({})
+
+    async def exchange_info(self, request):
+        symbols = sorted({stream['symbol'] for stream in self.market.streams.values()})
+        return web.json_response({'symbols': [
+            {'symbol': symbol, 'status': 'TRADING', 'quoteAsset': 'USDT' if symbol.endswith('USDT') else symbol[-3:]}
+            for symbol in symbols
+        ]})
+
+    async def klines(self, request):
+        self.stats['requests'] += 1
+        fault = self.fault()
+        if fault is not None:
+            return fault
+        query = request.query
+        stream = self.market.find(query.get('symbol', ''), query.get('interval', ''))
+        if stream is None:
+            return web.json_response({'code': -1121, 'msg': 'Invalid symbol.'}, status=400)
+        limit = min(int(query.get('limit', 500)), KLINES_MAX_LIMIT)
+        start_time = int(query['startTime']) if 'startTime' in query else None
+        end_time = int(query['endTime']) if 'endTime' in query else None
+        body = json.dumps(self.market.rest_klines(stream, limit, start_time, end_time), separators=(',', ':'))
+        return web.Response(text=body, content_type='application/json', headers={'X-MBX-USED-WEIGHT-1M': '0'})
+
+    async def websocket(self, request):
+        if 'stream' in request.match_info:
+            names, combined = [request.match_info['stream']], False
+        else:
+            names, combined = request.query.get('streams', '').split('/'), True
+        names = [name for name in names if name in self.market.streams]
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        queue = asyncio.Queue(maxsize=CONNECTION_QUEUE_SIZE)
+        self.connections[ws] = (set(names), combined, queue)
+        sender = asyncio.create_task(self.send_frames(ws, queue))
+        try:
+            async for message in ws:
+                if message.type == WSMsgType.ERROR:
+                    break
+        finally:
+            sender.cancel()
+            self.connections.pop(ws, None)
+        return ws
+
+    async def send_frames(self, ws, queue):
+        while True:
+            frame = await queue.get()
+            if self.random.random() < self.delay_probability:
+                self.stats['delayed'] += 1
+                await asyncio.sleep(self.delay_seconds)
+            if self.random.random() < self.disconnect_probability:
+                self.stats['disconnects'] += 1
+                await ws.close()
+                return
+            await ws.send_str(frame)
+            self.stats['frames'] += 1
+
+    async def run_clock(self):
+        """
+        Every 1 / frames_per_second: for each stream with subscribers, a closed frame for every
+        bar that closed since the last step, then a frame of the bar currently forming.
+        """
+        market = self.market
+        sent = {name: market.closed_count(stream) for name, stream in market.streams.items()}
+        while True:
+            await asyncio.sleep(1 / self.frames_per_second)
+            subscribed = set()
+            for names, _, _ in self.connections.values():
+                subscribed |= names
+            now = market.now()
+            for name, stream in market.streams.items():
+                closed = market.closed_count(stream, now)
+                first, sent[name] = sent[name], closed
+                if name not in subscribed:
+                    continue
+                events = [market.kline_event(stream, index) for index in range(first, closed)]
+                if closed < len(stream['time']):
+                    progress = float(now - stream['time'][closed]) / stream['interval_ms']
+                    events.append(market.kline_event(stream, closed, min(max(progress, 0.0), 0.999)))
+                self.publish(name, events)
+
+    def publish(self, name, events):
+        raw = [json.dumps(event, separators=(',', ':')) for event in events]
+        combined = [json.dumps({'stream': name, 'data': event}, separators=(',', ':')) for event in events]
+        for ws, (names, is_combined, queue) in list(self.connections.items()):
+            if name not in names:
+                continue
+            for frame in (combined if is_combined else raw):
+                if queue.full():
+                    # Like the exchange, a client that cannot keep up is disconnected
+                    self.stats['disconnects'] += 1
+                    self.connections.pop(ws, None)
+                    asyncio.create_task(ws.close())
+                    break
+                queue.put_nowait(frame)
+
+
+def load_market(stems, clones=1, start_index=1000, interval=None):
+    """
+    Build a FakeMarket from stored datasets named <symbol>_<interval>_klines.
+    With clones > 1 every dataset is also served under clones - 1 made up symbols, for load tests.
+    With `interval` every dataset is served as bars of that interval instead of its own, e.g.
+    '1s' replays a 1m dataset 60 times faster (the clock itself always runs in real time).
+    """
+    datasets = {}
+    for stem in stems:
+        symbol, source_interval = stem.replace('\\', '/').split('/')[-1].split('_')[:2]
+        df = load_klines(find_dataset(stem), columns=['time', 'open', 'high', 'low', 'close', 'volume'])
+        served_interval = interval or source_interval
+        if served_interval != source_interval:
+            # Same bars (and gaps) on the grid of the served interval
+            times = df['time'].to_numpy().astype(np.int64)
+            bars = (times - times[0]) // INTERVAL_MILLISECONDS[source_interval]
+            df = df.assign(time=times[0] + bars * INTERVAL_MILLISECONDS[served_interval])
+        datasets[(symbol, served_interval)] = df
+        for clone in range(1, clones):
+            datasets[(f"{symbol[:-4]}{clone:04d}{symbol[-4:]}", served_interval)] = df
+    return FakeMarket(datasets, start_index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve stored klines as a local stand-in for the Binance REST and websocket endpoints.")
+    parser.add_argument('--dataset', nargs='+', default=['./historical/data/BTCUSDT_1m_klines'],
+                        help="Dataset paths without extension, named <symbol>_<interval>_klines")
+    parser.add_argument('--host', default=FAKE_EXCHANGE_HOST)
+    parser.add_argument('--port', type=int, default=FAKE_EXCHANGE_PORT)
+    parser.add_argument('--clones', type=int, default=1, help="Serve every dataset under this many symbols")
+    parser.add_argument('--start-index', type=int, default=1000, help="Bars already closed at startup")
+    parser.add_argument('--interval', help="Serve every dataset as bars of this interval, e.g. 1s to replay 1m klines 60 times faster")
+    parser.add_argument('--frames-per-second', type=float, default=1.0, help="Websocket frames per stream and second")
+    parser.add_argument('--rate-limit-probability', type=float, default=0.0)
+    parser.add_argument('--error-probability', type=float, default=0.0)
+    parser.add_argument('--disconnect-probability', type=float, default=0.0)
+    parser.add_argument('--delay-probability', type=float, default=0.0)
+    parser.add_argument('--delay-seconds', type=float, default=1.0)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    market = load_market(args.dataset, args.clones, args.start_index, args.interval)
+    exchange = FakeExchange(market, args.frames_per_second, args.rate_limit_probability, args.error_probability,
+                            args.disconnect_probability, args.delay_probability, args.delay_seconds, args.seed)
+    print(f"Serving {len(market.streams)} streams, REST at http://{args.host}:{args.port} "
+          f"and websocket at ws://{args.host}:{args.port}")
+    web.run_app(exchange.application(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,19 @@
-import pandas as pd
+import numpy as np
 import datetime
+import sys
+from pathlib import Path
+from strategies import STRATEGY_COLUMNS, next_level_hit, previous
 
-# Load the CSV file
-df = pd.read_csv('./historical/data_with_indicators/BTCUSDT_15m_klines.csv')
+sys.path.append(str(Path(__file__).parent.parent))
+
+from storage import find_dataset, load_klines
+
+# Compact mode loads indicators as float32 and the date as a categorical, see historical/memory_report.py
+COMPACT_DATA = False
+
+# Load the dataset (memory-mapped .npy, Parquet or CSV), only the columns this strategy reads
+df = load_klines(find_dataset('./historical/data_with_indicators/BTCUSDT_15m_klines'), columns=STRATEGY_COLUMNS['backtest'],
+                 compact=COMPACT_DATA)
 
 # Drop rows with null values
 df.dropna(inplace=True)
@@ -145,30 +156,35 @@ def print_monthly_results(monthly_results):
 #                   cci_confirmation and roc_confirmation)
     
 #     return buy_signal
-def check_buy_signal(df):
-    global open_positions
-    row = df.iloc[index]
-    previous_row = df.iloc[index - 1]
-    previous2_row = df.iloc[index - 2]
-    previous3_row = df.iloc[index - 3]
-
+def buy_signals(df):
+    """
+    Entry conditions of every bar at once, as boolean arrays over whole columns (previous_row,
+    previous2_row and previous3_row are the columns shifted by 1, 2 and 3 bars).
+
+    Returns:
+    - Boolean array, True at the bars where the buy signal fires.
+    """
+    row = {column: df[column].to_numpy() for column in df.columns if column != 'date'}
+    previous_row = {column: previous(row[column]) for column in ('5_EMA', '10_SMA', 'OBV', 'open', 'close', 'bull_power', 'bear_power', 'ppo')}
+    previous2_row = {column: previous(row[column], 2) for column in ('bull_power', 'bear_power', 'ppo')}
+    previous3_row = {column: previous(row[column], 3) for column in ('bull_power', 'bear_power')}
 
     # Trend confirmation
     trend_confirmation = row['5_EMA'] > row['10_SMA']
-    trend_confirmation2 = row['5_EMA'] > row['10_SMA'] and previous_row['5_EMA'] <= previous_row['10_SMA']
+    trend_confirmation2 = (row['5_EMA'] > row['10_SMA']) & (previous_row['5_EMA'] <= previous_row['10_SMA'])
 
     # RSI confirmation
-    rsi_confirmation = row['RSI'] > 30 and row['RSI'] < 50
+    rsi_confirmation = (row['RSI'] > 30) & (row['RSI'] < 50)
 
     # Bull power
-    bull_power = previous3_row['bull_power'] < previous2_row['bull_power'] < previous_row['bull_power']
+    bull_power = (previous3_row['bull_power'] < previous2_row['bull_power']) & (previous2_row['bull_power'] < previous_row['bull_power'])
 
     # Bear power
-    bear_power = previous3_row['bear_power'] > previous2_row['bear_power'] > previous_row['bear_power']
+    bear_power = (previous3_row['bear_power'] > previous2_row['bear_power']) & (previous2_row['bear_power'] > previous_row['bear_power'])
     
     # Momentum confirmation
-    momentum_confirmation = (row['Momentum'] > 0) and (row['MACD'] > row['MACD_Signal'])
-    momentum_confirmation2 = row['RSI'] > 50 and row['MACD'] > row['MACD_Signal']
+    momentum_confirmation = (row['Momentum'] > 0) & (row['MACD'] > row['MACD_Signal'])
+    momentum_confirmation2 = (row['RSI'] > 50) & (row['MACD'] > row['MACD_Signal'])
 
     # PPO check
     ppo_confirmation = previous2_row['ppo'] > previous_row['ppo']
@@ -176,21 +192,21 @@ def check_buy_signal(df):
     # Volume confirmation
     avg_volume = row['cum_volume'] / 7  # Assuming a 14-day period for average calculation
     volume_confirmation = row['volume'] > avg_volume
-    volume_confirmation2 = row['close'] > row['VWAP'] and row['OBV'] > previous_row['OBV']
+    volume_confirmation2 = (row['close'] > row['VWAP']) & (row['OBV'] > previous_row['OBV'])
 
     
     # Bollinger Band bounce
     bollinger_bounce = row['close'] > row['Lower_BB']
     
     # RSI and Stochastic confirmation
-    rsi_stochastic_confirmation = (row['RSI'] < 70) and (row['%K'] > row['%D'])
+    rsi_stochastic_confirmation = (row['RSI'] < 70) & (row['%K'] > row['%D'])
     
     # ATR and CCI confirmation
     volatility_confirmation = row['ATR'] > 0  # Simplified check, can be enhanced based on strategy
-    cci_confirmation = -100 < row['CCI'] < 100
+    cci_confirmation = (-100 < row['CCI']) & (row['CCI'] < 100)
 
     # Volatility Conditions
-    volatility_confirmation = row['close'] > row['Lower_BB'] and row['close'] < row['Upper_BB']
+    volatility_confirmation = (row['close'] > row['Lower_BB']) & (row['close'] < row['Upper_BB'])
 
     
     # Rate of Change confirmation
@@ -198,28 +214,32 @@ def check_buy_signal(df):
 
     roc_ppo_conf = row['ROC'] > row['ppo']
 
-    bullish_engulfing = row['open'] < previous_row['close'] and row['close'] > previous_row['open']
+    bullish_engulfing = (row['open'] < previous_row['close']) & (row['close'] > previous_row['open'])
     
     # All conditions must be met for a buy signal
-    # buy_signal = (trend_confirmation and momentum_confirmation and volume_confirmation and 
-    #               bollinger_bounce and rsi_stochastic_confirmation and volatility_confirmation and 
-    #               cci_confirmation and roc_confirmation)
+    # buy_signal = (trend_confirmation & momentum_confirmation & volume_confirmation & 
+    #               bollinger_bounce & rsi_stochastic_confirmation & volatility_confirmation & 
+    #               cci_confirmation & roc_confirmation)
 
     #47%
-    # buy_signal = (trend_confirmation and momentum_confirmation and 
-    #               bull_power and bear_power and ppo_confirmation)
+    # buy_signal = (trend_confirmation & momentum_confirmation & 
+    #               bull_power & bear_power & ppo_confirmation)
+
+    buy_signal = (bullish_engulfing & trend_confirmation2 & momentum_confirmation2 & volatility_confirmation & volume_confirmation2)
+
+    return buy_signal
 
-    buy_signal = (bullish_engulfing and trend_confirmation2 and momentum_confirmation2 and volatility_confirmation and volume_confirmation2)
+def check_buy_signal(row):
+    # Only called on the bars where buy_signals() fired: skip entries too close to an open position
+    global open_positions
+    if open_positions.__len__() > 0:
+      for position in open_positions:
+        if position['entry_price'] % row['open'] < 100:
+            return False
+        
+        return True
     
-    if buy_signal:
-      if open_positions.__len__() > 0:
-        for position in open_positions:
-          if position['entry_price'] % row['open'] < 100:
-              return False
-          
-          return True
-      
-      return True
+    return True
       
 
 def check_current_positions(row):
@@ -247,9 +267,23 @@ def check_current_positions(row):
             create_monthly_result(position, True)
             continue
 
-for index in range(1, len(df)):
+# Signals of every bar at once, the loop below only visits the bars where something happens:
+# a signal fires or an open position's stop loss or take profit is hit
+signals = buy_signals(df)
+signals[0] = False  # the first bar has no previous bar
+signal_bars = np.flatnonzero(signals)
+body_low = np.minimum(df['open'].to_numpy(), df['close'].to_numpy())
+body_high = np.maximum(df['open'].to_numpy(), df['close'].to_numpy())
+next_hits = {}  # position id -> first bar where its stop loss or take profit can be hit
+next_signal = 0
+
+while True:
+    next_signal_bar = signal_bars[next_signal] if next_signal < len(signal_bars) else len(df)
+    index = min(next_signal_bar, min(next_hits.values(), default=len(df)))
+    if index >= len(df):
+        break
+
     current_row = df.iloc[index]
-    previous_row = df.iloc[index - 1]
 
     current_price = current_row['close']
 
@@ -257,7 +291,9 @@ for index in range(1, len(df)):
        break
 
     # Entry Signal
-    if check_buy_signal(df) and balance > initial_balance - balance * 0.5:
+    if index == next_signal_bar:
+        next_signal += 1
+    if signals[index] and check_buy_signal(current_row) and balance > initial_balance - balance * 0.5:
         usdt = balance * risk_per_trade
         position_value = usdt * leverage  
         balance -= usdt
@@ -267,7 +303,7 @@ for index in range(1, len(df)):
         id_positions += 1
         current_position = {
             'id': id_positions,
-            'date': current_row['date'],
+            'date': str(current_row['date'])[:10],  # YYYY-MM-DD whatever the storage format
             'usdt': usdt,
             'entry_price': entry_price,
             'stop_loss': stop_loss,
@@ -277,8 +313,15 @@ for index in range(1, len(df)):
         open_positions.append(current_position)
         total_trades += 1
         print(f"Opened Position Id: {id_positions}: Entry price = {entry_price}, Stop Loss = {stop_loss}, Take Profit = {take_profit}, Position Value = {position_value}")
+        next_hits[id_positions] = next_level_hit(body_low, body_high, (stop_loss, take_profit), index)
 
     check_current_positions(current_row)
+
+    # Positions still open after this bar are looked for again from the next one
+    for position in open_positions:
+        if next_hits[position['id']] <= index:
+            next_hits[position['id']] = next_level_hit(body_low, body_high, (position['stop_loss'], position['take_profit']), index + 1)
+    next_hits = {position['id']: next_hits[position['id']] for position in open_positions}
     
 
 # Ensure balance does not go below zero
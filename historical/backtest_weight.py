@@ -1,8 +1,19 @@
-import pandas as pd
+import numpy as np
 import datetime
+import sys
+from pathlib import Path
+from strategies import STRATEGY_COLUMNS, next_level_hit, previous
 
-# Load the CSV file
-df = pd.read_csv('./historical/data_with_indicators/BTCUSDT_15m_klines.csv')
+sys.path.append(str(Path(__file__).parent.parent))
+
+from storage import find_dataset, load_klines
+
+# Compact mode loads indicators as float32 and the date as a categorical, see historical/memory_report.py
+COMPACT_DATA = False
+
+# Load the dataset (memory-mapped .npy, Parquet or CSV), only the columns this strategy reads
+df = load_klines(find_dataset('./historical/data_with_indicators/BTCUSDT_15m_klines'), columns=STRATEGY_COLUMNS['backtest_weight'],
+                 compact=COMPACT_DATA)
 
 # Drop rows with null values
 df.dropna(inplace=True)
@@ -85,45 +96,49 @@ weights = {
     'Volatility_Risk': 0.25,  # Risk management via ATR
 }
 
-def calculate_signal_strength(row, previous_row):
-    signal_strength = 0
+def calculate_signal_strength(df):
+    """
+    Weighted signal strength of every bar at once (previous_row is the columns shifted by one bar).
+
+    Returns:
+    - Float array of signal strengths.
+    """
+    row = {column: df[column].to_numpy() for column in ('RSI', 'MACD', 'MACD_Signal', '5_EMA', '10_SMA', 'ATR', 'close')}
+    previous_row = {column: previous(row[column]) for column in ('MACD', 'MACD_Signal', '5_EMA', '10_SMA')}
+    signal_strength = np.zeros(len(df))
 
     # Tightening bullish conditions
-    if 30 <= row['RSI'] < 70:  # RSI in a neutral zone, avoiding overbought conditions
-        signal_strength += weights['RSI_Condition']
-    if row['MACD'] > row['MACD_Signal'] and previous_row['MACD'] <= previous_row['MACD_Signal']:
-        signal_strength += weights['MACD_Momentum']
-    if row['5_EMA'] > row['10_SMA'] and previous_row['5_EMA'] <= previous_row['10_SMA']:
-        signal_strength += weights['EMA_SMA_Trend']
+    # RSI in a neutral zone, avoiding overbought conditions
+    signal_strength += np.where((30 <= row['RSI']) & (row['RSI'] < 70), weights['RSI_Condition'], 0)
+    macd_cross = (row['MACD'] > row['MACD_Signal']) & (previous_row['MACD'] <= previous_row['MACD_Signal'])
+    signal_strength += np.where(macd_cross, weights['MACD_Momentum'], 0)
+    trend_cross = (row['5_EMA'] > row['10_SMA']) & (previous_row['5_EMA'] <= previous_row['10_SMA'])
+    signal_strength += np.where(trend_cross, weights['EMA_SMA_Trend'], 0)
 
     # Incorporating risk management via volatility
-    if row['ATR'] / row['close'] < 0.01:  # Assuming a low ATR compared to price as lower risk
-        signal_strength += weights['Volatility_Risk']
-    else:
-        signal_strength -= weights['Volatility_Risk']  # High volatility decreases signal strength
+    # Assuming a low ATR compared to price as lower risk, high volatility decreases signal strength
+    signal_strength += np.where(row['ATR'] / row['close'] < 0.01, weights['Volatility_Risk'], -weights['Volatility_Risk'])
 
     return signal_strength
 
-def check_buy_signal(df):
-    global open_positions
-    row = df.iloc[index]
-    previous_row = df.iloc[index - 1]
-    previous2_row = df.iloc[index - 2]
-    previous3_row = df.iloc[index - 3]
-
-    signal_strength = calculate_signal_strength(row, previous_row)
+def buy_signals(df):
+    """
+    Returns:
+    - Boolean array, True at the bars where the buy signal fires.
+    """
+    return calculate_signal_strength(df) > 0.5
 
-    buy_signal = signal_strength > 0.5
+def check_buy_signal(row):
+    # Only called on the bars where buy_signals() fired: skip entries too close to an open position
+    global open_positions
+    if open_positions.__len__() > 0:
+      for position in open_positions:
+        if position['entry_price'] % row['open'] < 100:
+            return False
+        
+        return True
     
-    if buy_signal:
-      if open_positions.__len__() > 0:
-        for position in open_positions:
-          if position['entry_price'] % row['open'] < 100:
-              return False
-          
-          return True
-      
-      return True
+    return True
       
 
 def check_current_positions(row):
@@ -151,9 +166,23 @@ def check_current_positions(row):
             create_monthly_result(position, True)
             continue
 
-for index in range(1, len(df)):
+# Signals of every bar at once, the loop below only visits the bars where something happens:
+# a signal fires or an open position's stop loss or take profit is hit
+signals = buy_signals(df)
+signals[0] = False  # the first bar has no previous bar
+signal_bars = np.flatnonzero(signals)
+body_low = np.minimum(df['open'].to_numpy(), df['close'].to_numpy())
+body_high = np.maximum(df['open'].to_numpy(), df['close'].to_numpy())
+next_hits = {}  # position id -> first bar where its stop loss or take profit can be hit
+next_signal = 0
+
+while True:
+    next_signal_bar = signal_bars[next_signal] if next_signal < len(signal_bars) else len(df)
+    index = min(next_signal_bar, min(next_hits.values(), default=len(df)))
+    if index >= len(df):
+        break
+
     current_row = df.iloc[index]
-    previous_row = df.iloc[index - 1]
 
     current_price = current_row['close']
 
@@ -161,7 +190,9 @@ for index in range(1, len(df)):
        break
 
     # Entry Signal
-    if check_buy_signal(df) and balance > initial_balance - balance * 0.5:
+    if index == next_signal_bar:
+        next_signal += 1
+    if signals[index] and check_buy_signal(current_row) and balance > initial_balance - balance * 0.5:
         usdt = balance * risk_per_trade
         position_value = usdt * leverage  
         balance -= usdt
@@ -171,7 +202,7 @@ for index in range(1, len(df)):
         id_positions += 1
         current_position = {
             'id': id_positions,
-            'date': current_row['date'],
+            'date': str(current_row['date'])[:10],  # YYYY-MM-DD whatever the storage format
             'usdt': usdt,
             'entry_price': entry_price,
             'stop_loss': stop_loss,
@@ -181,8 +212,15 @@ for index in range(1, len(df)):
         open_positions.append(current_position)
         total_trades += 1
         print(f"Opened Position Id: {id_positions}: Entry price = {entry_price}, Stop Loss = {stop_loss}, Take Profit = {take_profit}, Position Value = {position_value}")
+        next_hits[id_positions] = next_level_hit(body_low, body_high, (stop_loss, take_profit), index)
 
     check_current_positions(current_row)
+
+    # Positions still open after this bar are looked for again from the next one
+    for position in open_positions:
+        if next_hits[position['id']] <= index:
+            next_hits[position['id']] = next_level_hit(body_low, body_high, (position['stop_loss'], position['take_profit']), index + 1)
+    next_hits = {position['id']: next_hits[position['id']] for position in open_positions}
     
 
 # Ensure balance does not go below zero
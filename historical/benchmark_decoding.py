@@ -0,0 +1,86 @@
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from kline_decoding import decode_klines, KLINE_DTYPE
+
+PAGE_SIZE = 1000
+PAGES = 50
+# The old path appends one DataFrame per kline (quadratic), so it only gets a couple of pages
+OLD_PATH_PAGES = 2
+
+
+def make_page(start_time, rng):
+    klines = []
+    for i in range(PAGE_SIZE):
+        open_time = start_time + i * 60_000
+        price = rng.uniform(20_000, 70_000)
+        klines.append([open_time, f"{price:.8f}", f"{price + 10:.8f}", f"{price - 10:.8f}", f"{price + 1:.8f}",
+                       f"{rng.uniform(0, 100):.8f}", open_time + 59_999, f"{rng.uniform(0, 1e6):.8f}",
+                       rng.randint(1, 5000), f"{rng.uniform(0, 50):.8f}", f"{rng.uniform(0, 1e6):.8f}", "0"])
+    return json.dumps(klines, separators=(',', ':')).encode()
+
+
+def old_path(pages):
+    # What fetch_historical_klines_to_df used to do with every response
+    df = pd.DataFrame(columns=['time', 'open', 'high', 'low', 'close', 'volume'])
+    for page in pages:
+        for kline in json.loads(page):
+            new_row = {
+                'time': kline[0],
+                'open': float(kline[1]),
+                'high': float(kline[2]),
+                'low': float(kline[3]),
+                'close': float(kline[4]),
+                'volume': float(kline[5])
+            }
+            df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
+    return df
+
+
+def json_lists_path(pages):
+    # json.loads into lists of strings, then one numpy conversion per page
+    out = np.empty(len(pages) * PAGE_SIZE, dtype=KLINE_DTYPE)
+    for index, page in enumerate(pages):
+        block = np.array([kline[:6] for kline in json.loads(page)], dtype=np.float64)
+        rows = out[index * PAGE_SIZE:index * PAGE_SIZE + len(block)]
+        rows['time'] = block[:, 0]
+        for column, field in enumerate(KLINE_DTYPE.names[1:], start=1):
+            rows[field] = block[:, column]
+    return out
+
+
+def decoded_path(pages):
+    out = np.empty(len(pages) * PAGE_SIZE, dtype=KLINE_DTYPE)
+    for index, page in enumerate(pages):
+        decode_klines(page, out=out[index * PAGE_SIZE:(index + 1) * PAGE_SIZE])
+    return out
+
+
+def rows_per_second(function, data, rows):
+    started = time.perf_counter()
+    function(data)
+    return rows / (time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    rng = random.Random(42)
+    pages = [make_page(1_500_000_000_000 + page * PAGE_SIZE * 60_000, rng) for page in range(PAGES)]
+
+    decoded = decoded_path(pages)
+    assert np.array_equal(decoded, json_lists_path(pages))
+    old = old_path(pages[:OLD_PATH_PAGES])
+    assert np.array_equal(old['close'].to_numpy(dtype=np.float64), decoded['close'][:len(old)])
+
+    print(f"{'REST page decoding':<40} | {'rows/s':>12}")
+    print(f"{'dict + one-row pd.concat per kline':<40} | "
+          f"{rows_per_second(old_path, pages[:OLD_PATH_PAGES], OLD_PATH_PAGES * PAGE_SIZE):>12,.0f}")
+    print(f"{'json.loads + np.array per page':<40} | {rows_per_second(json_lists_path, pages, PAGES * PAGE_SIZE):>12,.0f}")
+    print(f"{'decode_klines':<40} | {rows_per_second(decoded_path, pages, PAGES * PAGE_SIZE):>12,.0f}")
@@ -1,53 +1,348 @@
 import pandas as pd
 import os
+import pickle
 from pathlib import Path
 import sys
+import argparse
+import time
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 script_dir = Path(__file__).parent  # Directory of the script
 parent_dir = script_dir.parent  # Parent directory
 sys.path.append(str(parent_dir))
 
-# Now you can import from utils.py
-from utils import (add_date_column, calculate_5_ema, calculate_10_sma, calculate_rsi, calculate_macd, calculate_bollinger_bands, calculate_vwap, calculate_obv, calculate_stochastic_oscillator, calculate_atr, calculate_ad_line, calculate_cci, calculate_pivot_points, calculate_momentum, calculate_standard_deviation, calculate_fibonacci_retracement, calculate_roc, calculate_support_resistance, calculate_vwma, calculate_ppo, calculate_ichimoku_cloud, add_heikin_ashi_columns, calculate_elder_ray_index, calculate_zig_zag)
+# Now you can import from the project root
+from indicator_graph import (compute_indicators, split_indicators, indicators_for_columns, ALL_INDICATORS,
+                             BASE_COLUMNS, NODES)
+from indicator_engine import IndicatorEngine, iter_bars
+from storage import (load_klines, save_klines, write_tail, iter_klines, KlinesWriter, dataset_format, dataset_path,
+                     dataset_size, dataset_columns, FORMAT_SUFFIXES)
+from strategies import STRATEGY_COLUMNS
 
-def read_and_process_files(source_dir, target_dir):
+# Files bigger than this are split into indicator groups computed by several workers,
+# and only a limited number of them are processed at the same time to bound peak memory
+LARGE_FILE_BYTES = 512 * 1024 * 1024
+
+# Rows per block in the chunked pipeline; peak memory grows with this, not with the file size
+CHUNK_ROWS = 20_000
+
+# Extend mode keeps the streaming indicator state of each dataset in this file next to it
+STATE_SUFFIX = '.state.pkl'
+
+def process_file(source_path, target_path, columns=None):
+    """
+    Compute the indicators of one klines dataset and save the result.
+
+    Returns:
+    - (rows, seconds) for throughput reporting.
+    """
+    started = time.perf_counter()
+    klines_df = load_klines(source_path)
+
+    # Shared intermediates (EWMs, rolling extrema, rolling std, ...) are computed once
+    klines_df = compute_indicators(klines_df, ALL_INDICATORS, columns=columns)
+
+    save_klines(klines_df, target_path)
+    return len(klines_df), time.perf_counter() - started
+
+def process_file_chunked(source_path, target_path, columns=None, chunk_rows=CHUNK_ROWS):
+    """
+    Same output as process_file(), reading and writing the dataset in blocks of chunk_rows rows.
+
+    Every indicator runs on an IndicatorEngine, so its state (EMAs, rolling windows, cumulative
+    sums, ...) carries over from one block to the next and the values are identical to the
+    whole-file computation. Rows that later klines may still change (support/resistance pivots,
+    chikou span) are held back until they are final.
+
+    Returns:
+    - (rows, seconds) for throughput reporting.
+    """
+    started = time.perf_counter()
+    engine = IndicatorEngine(ALL_INDICATORS if columns is None else indicators_for_columns(columns))
+    source_columns = dataset_columns(source_path)
+    output_columns = source_columns + [column for column in compute_order(columns) if column not in source_columns]
+    extra_columns = [column for column in source_columns if column not in BASE_COLUMNS]
+
+    pending = []  # rows not written yet, the first one is row number `written`
+    written = 0
+    with KlinesWriter(target_path) as writer:
+        for chunk in iter_klines(source_path, chunk_rows):
+            # Source columns the engine does not use are copied through
+            extras = zip(*(chunk[column].tolist() for column in extra_columns)) if extra_columns else repeat(())
+            for bar, extra in zip(iter_bars(chunk), extras):
+                row = engine.update(bar)
+                row.update(zip(extra_columns, extra))
+                pending.append(row)
+                for position, column, value in engine.revisions:
+                    pending[position - written][column] = value
+            final_rows = len(pending) - engine.lookahead
+            if final_rows > 0:
+                writer.write(pd.DataFrame(pending[:final_rows], columns=output_columns))
+                del pending[:final_rows]
+                written += final_rows
+        if pending or not writer.rows:
+            writer.write(pd.DataFrame(pending, columns=output_columns))
+            written += len(pending)
+    return written, time.perf_counter() - started
+
+def compute_indicator_group(source_path, columns):
+    """
+    Compute a group of output columns of one klines dataset, returning only those columns.
+    """
+    klines_df = load_klines(source_path, columns=BASE_COLUMNS)
+    klines_df = compute_indicators(klines_df, columns=columns)
+    return klines_df[columns]
+
+def output_column_groups(columns, groups):
+    """
+    Split the output columns (all indicator columns if None) into independent groups.
+    """
+    indicators = ALL_INDICATORS if columns is None else indicators_for_columns(columns)
+    column_groups = []
+    for group in split_indicators(indicators, groups):
+        group_columns = [column for name in group for column in NODES[name].columns
+                         if columns is None or column in columns]
+        if group_columns:
+            column_groups.append(group_columns)
+    return column_groups
+
+def compute_order(columns):
+    """
+    Indicator columns in the order compute_indicators adds them.
+    """
+    indicators = ALL_INDICATORS if columns is None else indicators_for_columns(columns)
+    return [column for name in indicators for column in NODES[name].columns if columns is None or column in columns]
+
+def print_throughput(filename, rows, seconds):
+    print(f"Saved processed data for {filename}: {rows} rows in {seconds:.1f}s ({rows / max(seconds, 1e-9):,.0f} rows/s)")
+
+def state_path(target_path):
+    return f"{target_path}{STATE_SUFFIX}"
+
+def load_state(target_path):
+    try:
+        with open(state_path(target_path), 'rb') as state_file:
+            return pickle.load(state_file)
+    except FileNotFoundError:
+        return None
+
+def save_state(target_path, state):
+    # Written to a temporary file first, a crash never leaves a truncated state behind
+    tmp_path = f"{state_path(target_path)}.tmp"
+    with open(tmp_path, 'wb') as state_file:
+        pickle.dump(state, state_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, state_path(target_path))
+
+def seed_state(source_path, target_path, columns=None):
+    """
+    Compute a dataset from scratch and record the indicator state at its last row.
+
+    The dataset itself is computed with the batch functions; the history is then streamed once
+    through an IndicatorEngine so that later extend runs continue with exactly the same values.
+    """
+    indicators = ALL_INDICATORS if columns is None else indicators_for_columns(columns)
+    rows, _ = process_file(source_path, target_path, columns)
+
+    engine = IndicatorEngine(indicators)
+    tail = []
+    for bar in iter_bars(load_klines(source_path, columns=BASE_COLUMNS)):
+        tail.append(engine.update(bar))
+        for position, column, value in engine.revisions:
+            tail[position - engine.count + len(tail)][column] = value
+        if len(tail) > engine.lookahead + 1:
+            del tail[0]
+
+    state = {
+        'indicators': indicators,
+        'columns': dataset_columns(target_path),
+        'engine': engine,
+        'tail': tail[-engine.lookahead:] if engine.lookahead else [],
+        'rows': rows,
+        'last_time': tail[-1]['time'] if tail else None,
+    }
+    save_state(target_path, state)
+    return rows
+
+def extend_file(source_path, target_path, columns=None):
+    """
+    Append the indicators of the klines added to source_path since the last run to target_path.
+
+    Only the new klines are computed: the state of every indicator (EMAs, rolling windows,
+    cumulative OBV and A/D, the zig-zag pivot, the Heikin-Ashi open, ...) is restored from the
+    state file saved next to the dataset. Rows whose values depend on later klines (support and
+    resistance pivots, chikou span) are rewritten with the rest of the tail, so the dataset always
+    equals a full recompute. Without a usable state the dataset is computed from scratch once.
+
+    Returns:
+    - (rows appended, seconds) for throughput reporting.
+    """
+    started = time.perf_counter()
+    indicators = ALL_INDICATORS if columns is None else indicators_for_columns(columns)
+    state = load_state(target_path) if os.path.exists(target_path) else None
+    if state is not None and state['indicators'] != indicators:
+        print(f"Indicator selection changed for {target_path}, recomputing it")
+        state = None
+
+    new_klines = None
+    if state is not None and state['rows']:
+        # Re-read the last processed kline to check the source still continues the dataset
+        new_klines = load_klines(source_path, columns=BASE_COLUMNS, start=state['rows'] - 1)
+        if new_klines.empty or new_klines['time'].iloc[0] != state['last_time']:
+            print(f"{source_path} no longer matches {target_path}, recomputing it")
+            state = None
+        else:
+            new_klines = new_klines.iloc[1:]
+
+    if state is None:
+        rows = seed_state(source_path, target_path, columns)
+        return rows, time.perf_counter() - started
+    if new_klines is None:
+        new_klines = load_klines(source_path, columns=BASE_COLUMNS)
+    if new_klines.empty:
+        return 0, time.perf_counter() - started
+
+    engine = state['engine']
+    rows = state['tail']
+    first_position = state['rows'] - len(rows)
+    for bar in iter_bars(new_klines):
+        rows.append(engine.update(bar))
+        for position, column, value in engine.revisions:
+            rows[position - first_position][column] = value
+
+    write_tail(pd.DataFrame(rows, columns=engine.columns)[state['columns']], target_path, first_position)
+
+    state['rows'] = first_position + len(rows)
+    state['last_time'] = rows[-1]['time']
+    state['tail'] = rows[-engine.lookahead:] if engine.lookahead else []
+    save_state(target_path, state)
+    return len(new_klines), time.perf_counter() - started
+
+def read_and_process_files(source_dir, target_dir, columns=None, workers=1, max_large_files=1,
+                           large_file_bytes=LARGE_FILE_BYTES, output_format='csv', extend=False,
+                           chunk_rows=0):
+    """
+    Precompute indicators for every dataset in source_dir and save the results to target_dir.
+
+    Args:
+    - source_dir: directory with the raw klines datasets (.csv, .parquet or .npy).
+    - target_dir: directory the processed datasets are written to.
+    - columns: output columns to compute and store next to the raw klines; all indicators if None.
+    - workers: number of worker processes. 1 processes the files one by one in this process.
+    - max_large_files: how many files above large_file_bytes may be in memory at once.
+    - large_file_bytes: size above which a file counts as large and its independent indicator
+      groups are spread across the workers.
+    - output_format: 'csv', 'parquet' or 'npy'.
+    - extend: only compute the klines added since the previous run and append them (see extend_file).
+    - chunk_rows: if set, process files one by one in blocks of this many rows (see process_file_chunked),
+      for datasets that do not fit in memory.
+    """
     Path(target_dir).mkdir(parents=True, exist_ok=True)
-    
-    for filename in os.listdir(source_dir):
-        if filename.endswith(".csv"):
+    filenames = [filename for filename in os.listdir(source_dir) if filename.endswith(tuple(FORMAT_SUFFIXES.values()))]
+
+    def target_path(filename):
+        stem = filename[:-len(FORMAT_SUFFIXES[dataset_format(filename)])]
+        return dataset_path(os.path.join(target_dir, stem), output_format)
+
+    if extend:
+        for filename in filenames:
+            print(f"Extending {filename}")
+            rows, seconds = extend_file(os.path.join(source_dir, filename), target_path(filename), columns)
+            print_throughput(filename, rows, seconds)
+        return
+
+    if chunk_rows:
+        for filename in filenames:
+            print(f"Processing {filename} in blocks of {chunk_rows} rows")
+            rows, seconds = process_file_chunked(os.path.join(source_dir, filename), target_path(filename),
+                                                 columns, chunk_rows)
+            print_throughput(filename, rows, seconds)
+        return
+
+    if workers <= 1:
+        for filename in filenames:
+            print(f"Processing {filename}")
+            rows, seconds = process_file(os.path.join(source_dir, filename), target_path(filename), columns)
+            print_throughput(filename, rows, seconds)
+        return
+
+    # Biggest files first so the long ones do not end up running alone at the end
+    filenames.sort(key=lambda filename: dataset_size(os.path.join(source_dir, filename)), reverse=True)
+    large_files = [f for f in filenames if dataset_size(os.path.join(source_dir, f)) > large_file_bytes]
+    small_files = [f for f in filenames if f not in large_files]
+    column_groups = output_column_groups(columns, workers)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        running = {}  # future -> (filename, group index or None)
+        split_results = {}  # filename -> {group index: DataFrame}
+        started = {}
+
+        def submit_large_files():
+            while large_files and len(split_results) < max_large_files:
+                filename = large_files.pop(0)
+                print(f"Processing {filename} in {len(column_groups)} indicator groups")
+                started[filename] = time.perf_counter()
+                split_results[filename] = {}
+                for index, group_columns in enumerate(column_groups):
+                    future = executor.submit(compute_indicator_group, os.path.join(source_dir, filename), group_columns)
+                    running[future] = (filename, index)
+
+        submit_large_files()
+        for filename in small_files:
             print(f"Processing {filename}")
-            klines_df = pd.read_csv(os.path.join(source_dir, filename))
-            
-            klines_df = add_date_column(klines_df)
-            klines_df = calculate_5_ema(klines_df)
-            klines_df = calculate_10_sma(klines_df)
-            klines_df = calculate_rsi(klines_df)
-            klines_df = calculate_macd(klines_df)
-            klines_df = calculate_bollinger_bands(klines_df)
-            klines_df = calculate_vwap(klines_df)
-            klines_df = calculate_obv(klines_df)
-            klines_df = calculate_stochastic_oscillator(klines_df)
-            klines_df = calculate_atr(klines_df)
-            klines_df = calculate_ad_line(klines_df)
-            klines_df = calculate_cci(klines_df)
-            klines_df = calculate_pivot_points(klines_df)
-            klines_df = calculate_momentum(klines_df)
-            klines_df = calculate_standard_deviation(klines_df)
-            klines_df = calculate_fibonacci_retracement(klines_df)
-            klines_df = calculate_roc(klines_df, period=14) 
-            klines_df = calculate_support_resistance(klines_df)
-            klines_df = calculate_vwma(klines_df, period=20)
-            klines_df = calculate_ppo(klines_df)
-            klines_df = calculate_ichimoku_cloud(klines_df)
-            klines_df = add_heikin_ashi_columns(klines_df)
-            klines_df = calculate_elder_ray_index(klines_df)
-            klines_df['zig_zag'] = calculate_zig_zag(klines_df, percentage=5)
-            klines_df['zig_zag'] = klines_df['zig_zag'].ffill()
-
-            klines_df.to_csv(os.path.join(target_dir, filename), index=False)
-            print(f"Saved processed data for {filename}")
-
-source_directory = "historical/data"  # Original files directory
-target_directory = "historical/data_with_indicators"  # New directory for processed files
-
-read_and_process_files(source_directory, target_directory)
+            future = executor.submit(process_file, os.path.join(source_dir, filename), target_path(filename), columns)
+            running[future] = (filename, None)
+
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                filename, index = running.pop(future)
+                if index is None:
+                    rows, seconds = future.result()
+                    print_throughput(filename, rows, seconds)
+                    continue
+
+                split_results[filename][index] = future.result()
+                if len(split_results[filename]) == len(column_groups):
+                    # Every group is back: join them in the usual column order and save
+                    klines_df = load_klines(os.path.join(source_dir, filename))
+                    groups = split_results.pop(filename)
+                    klines_df = pd.concat([klines_df] + [groups[i] for i in range(len(column_groups))], axis=1)
+                    ordered_columns = [c for c in compute_order(columns) if c in klines_df.columns]
+                    klines_df = klines_df[[c for c in klines_df.columns if c not in ordered_columns] + ordered_columns]
+                    save_klines(klines_df, target_path(filename))
+                    print_throughput(filename, len(klines_df), time.perf_counter() - started.pop(filename))
+                    del klines_df, groups
+                    submit_large_files()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute indicators for the historical klines.")
+    parser.add_argument('--strategy', choices=sorted(STRATEGY_COLUMNS),
+                        help="Only compute the columns this backtest reads (default: every indicator)")
+    parser.add_argument('--columns', help="Comma-separated output columns to compute, instead of a strategy")
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes (default: 1, no pool)")
+    parser.add_argument('--max-large-files', type=int, default=1,
+                        help="Large files processed at the same time, bounds peak memory (default: 1)")
+    parser.add_argument('--large-file-mb', type=int, default=LARGE_FILE_BYTES // (1024 * 1024),
+                        help="Size above which a file is split into indicator groups across workers")
+    parser.add_argument('--format', choices=sorted(FORMAT_SUFFIXES), default='csv',
+                        help="Output format: csv for export, parquet or npy (memory-mapped) for fast backtests")
+    parser.add_argument('--chunk-rows', type=int, default=0,
+                        help=f"Process files in blocks of this many rows to bound memory (e.g. {CHUNK_ROWS}; "
+                             "default: whole files)")
+    parser.add_argument('--extend', action='store_true',
+                        help="Only compute klines added since the last run and append them to the existing datasets")
+    args = parser.parse_args()
+
+    source_directory = "historical/data"  # Original files directory
+    target_directory = "historical/data_with_indicators"  # New directory for processed files
+
+    columns = None
+    if args.strategy:
+        columns = STRATEGY_COLUMNS[args.strategy]
+    elif args.columns:
+        columns = args.columns.split(',')
+    read_and_process_files(source_directory, target_directory, columns=columns, workers=args.workers,
+                           max_large_files=args.max_large_files, large_file_bytes=args.large_file_mb * 1024 * 1024,
+                           output_format=args.format, extend=args.extend,
+                           chunk_rows=args.chunk_rows)
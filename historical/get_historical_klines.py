@@ -1,62 +1,289 @@
-import aiohttp
 import asyncio
+import numpy as np
 import pandas as pd
 from datetime import datetime
+import json
 import os  
+import sys
+import time
+from pathlib import Path
 
-async def fetch_historical_klines_to_df(symbol, interval, start_str, end_str=None, limit=1000):
-    df = pd.DataFrame(columns=['time', 'open', 'high', 'low', 'close', 'volume'])
-    url = "https://api.binance.com/api/v3/klines"
-    async with aiohttp.ClientSession() as session:
-        while True:
+sys.path.append(str(Path(__file__).parent.parent))
+
+from storage import save_klines, append_klines, load_klines, dataset_path, find_dataset
+from resample import resample_klines, bucket_starts, INTERVAL_MILLISECONDS
+from kline_decoding import decode_klines, KLINE_DTYPE
+from http_client import get_client, close_clients, fetch_klines_window, BASE_URL
+
+# Format of the downloaded klines: csv, parquet or npy
+OUTPUT_FORMAT = "csv"
+
+# Requests in flight at the same time, all on the shared client's connection pool
+MAX_CONCURRENT_REQUESTS = 8
+
+DATA_DIRECTORY = "historical/data"
+
+# Sync mode: the manifest of already fetched time ranges lives in the data directory, and
+# progress is saved after every batch of this many requests
+MANIFEST_FILE = "manifest.json"
+SYNC_BATCH_WINDOWS = 100
+
+KLINE_COLUMNS = ['time', 'open', 'high', 'low', 'close', 'volume']
+
+async def fetch_historical_klines_to_df(symbol, interval, start_str, end_str=None, limit=1000, base_url=BASE_URL,
+                                        max_concurrency=MAX_CONCURRENT_REQUESTS, client=None):
+    """
+    Download the klines of a time range.
+
+    The range is split into windows of `limit` intervals, each fetched with a single request;
+    up to max_concurrency requests run at the same time on the shared client (keep-alive pool,
+    request weight limit, disk cache for closed ranges). Rows go straight into preallocated arrays at their window's
+    offset, so they come out in time order whatever order the responses arrive in.
+
+    Args:
+    - symbol: e.g. "BTCUSDT".
+    - interval: kline interval, one of INTERVAL_MILLISECONDS.
+    - start_str, end_str: open time range in epoch milliseconds, end_str defaults to now.
+    - limit: klines per request (at most 1000).
+    - base_url: exchange REST endpoint, e.g. a local stub server for testing.
+    - client: http_client.KlinesClient to use instead of the shared one for base_url.
+
+    Returns:
+    - pd.DataFrame with 'time' (int64) and 'open', 'high', 'low', 'close', 'volume' (float64).
+    """
+    if interval not in INTERVAL_MILLISECONDS:
+        raise ValueError(f"Unsupported interval {interval}, expected one of {', '.join(INTERVAL_MILLISECONDS)}")
+    if end_str is None:
+        end_str = int(time.time() * 1000)
+    window_ms = INTERVAL_MILLISECONDS[interval] * limit
+    window_starts = range(start_str, end_str + 1, window_ms)
+
+    klines = np.empty(len(window_starts) * limit, dtype=KLINE_DTYPE)
+    counts = np.zeros(len(window_starts), dtype=np.int64)
+
+    client = client or get_client(base_url)
+    pending = iter(range(len(window_starts)))
+
+    async def worker():
+        for index in pending:
+            window_start = window_starts[index]
             params = {
                 'symbol': symbol,
                 'interval': interval,
-                'startTime': start_str,
+                'startTime': window_start,
+                'endTime': min(window_start + window_ms - 1, end_str),
                 'limit': limit
             }
-            if end_str:
-                params['endTime'] = end_str
-            
-            async with session.get(url, params=params) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if not data:
-                        break
-                    for kline in data:
-                        new_row = {
-                            'time': kline[0],  # Open time
-                            'open': float(kline[1]),  # Open
-                            'high': float(kline[2]),  # High
-                            'low': float(kline[3]),  # Low
-                            'close': float(kline[4]),  # Close
-                            'volume': float(kline[5])  # Volume
-                        }
-                        df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-                    start_str = data[-1][0] + 1
-                else:
-                    print("Failed to fetch historical klines")
-                    break
-    return df
-
-async def save_df_to_csv(df, filename):
-    directory = "historical/data"  # Define the directory path
+            body = await fetch_klines_window(client, params)
+            # A window never holds more than `limit` open times, so it fits in its slot
+            offset = index * limit
+            counts[index] = len(decode_klines(body, out=klines[offset:offset + limit]))
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(min(max_concurrency, len(window_starts)))]
+    try:
+        await asyncio.gather(*workers)
+    except BaseException:
+        for task in workers:
+            task.cancel()
+        raise
+
+    # Keep the filled part of every window slot, in window order
+    filled = np.arange(limit) < counts[:, None]
+    return pd.DataFrame(klines[filled.ravel()])
+
+async def save_df(df, name, output_format=OUTPUT_FORMAT):
+    directory = DATA_DIRECTORY  # Define the directory path
     if not os.path.exists(directory):  # Check if the directory exists
         os.makedirs(directory)  # Create the directory if it does not exist
-    filepath = os.path.join(directory, filename)  # Construct the filepath
-    df.to_csv(filepath, index=False)  # Save the DataFrame to CSV in the specified path
+    filepath = dataset_path(os.path.join(directory, name), output_format)  # Construct the filepath
+    save_klines(df, filepath)  # Save the DataFrame in the requested format
+
+def load_manifest(directory=DATA_DIRECTORY):
+    """
+    Covered open-time ranges per dataset: {name: [[first, last], ...]}, in epoch milliseconds.
+
+    A covered range has been fetched from the exchange, so klines missing inside it are gaps
+    on the exchange side (listing date, maintenance) and are not requested again.
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE)) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return {}
+
+def save_manifest(manifest, directory=DATA_DIRECTORY):
+    # Written to a temporary file first, a crash never leaves a truncated manifest behind
+    path = os.path.join(directory, MANIFEST_FILE)
+    with open(f"{path}.tmp", 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    os.replace(f"{path}.tmp", path)
+
+def merge_ranges(ranges):
+    """
+    Sort and merge overlapping or adjacent [first, last] ranges.
+    """
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return merged
+
+def missing_ranges(covered, first, last):
+    """
+    Parts of [first, last] that are not in the (merged) covered ranges.
+    """
+    missing = []
+    for covered_first, covered_last in covered:
+        if covered_first > first:
+            missing.append([first, min(covered_first - 1, last)])
+        first = max(first, covered_last + 1)
+        if first > last:
+            return missing
+    missing.append([first, last])
+    return missing
+
+def find_holes(times, interval_ms):
+    """
+    [first, last] open-time ranges missing between consecutive klines of a sorted time array.
+    """
+    gaps = np.flatnonzero(np.diff(times) > interval_ms)
+    return [[int(times[i]) + interval_ms, int(times[i + 1]) - 1] for i in gaps]
+
+def check_existing_klines(df, interval_ms):
+    """
+    Sort an existing dataset, drop duplicate timestamps and list its holes.
+
+    Returns:
+    - (clean DataFrame, number of duplicates dropped, holes as [first, last] ranges).
+    """
+    times = df['time'].to_numpy(dtype=np.int64)
+    if len(times) and not (np.diff(times) > 0).all():
+        df = df.sort_values('time', kind='stable')
+        clean = df.drop_duplicates('time', keep='last').reset_index(drop=True)
+        duplicates = len(df) - len(clean)
+        df = clean
+    else:
+        duplicates = 0
+    return df, duplicates, find_holes(df['time'].to_numpy(dtype=np.int64), interval_ms)
+
+async def sync_klines(symbol, interval, start_str, end_str=None, directory=DATA_DIRECTORY, output_format=OUTPUT_FORMAT,
+                      base_url=BASE_URL, limit=1000, batch_windows=SYNC_BATCH_WINDOWS):
+    """
+    Bring the stored klines of a symbol and interval up to date, fetching only what is missing.
+
+    The manifest in `directory` records which open-time ranges have already been fetched. Ranges
+    not covered yet (new klines, holes or duplicates found in a file without a manifest entry)
+    are downloaded in batches of batch_windows requests; the dataset and the manifest are saved
+    after every batch, so an interrupted sync resumes where it stopped and loses at most one batch.
+
+    Args:
+    - start_str, end_str: open time range to cover, in epoch milliseconds. end_str defaults to the
+      last closed kline, the kline still in progress is never stored.
+
+    Returns:
+    - number of klines added.
+    """
+    if interval not in INTERVAL_MILLISECONDS:
+        # 1M klines are resampled locally instead, see save_resampled_klines
+        raise ValueError(f"Unsupported interval {interval}, expected one of {', '.join(INTERVAL_MILLISECONDS)}")
+    interval_ms = INTERVAL_MILLISECONDS[interval]
+    if end_str is None:
+        # Open time of the kline before the one in progress, on the exchange's grid (weeks open on Monday)
+        in_progress = int(bucket_starts([int(time.time() * 1000)], interval)[0])
+        end_str = int(bucket_starts([in_progress - 1], interval)[0])
+    name = f"{symbol}_{interval}_klines"
+    stem = os.path.join(directory, name)
+    try:
+        path = find_dataset(stem)
+    except FileNotFoundError:
+        path = dataset_path(stem, output_format)
+    os.makedirs(directory, exist_ok=True)
+
+    manifest = load_manifest(directory)
+    if os.path.exists(path):
+        df = load_klines(path, columns=KLINE_COLUMNS)
+        df, duplicates, holes = check_existing_klines(df, interval_ms)
+        if duplicates:
+            print(f"{name}: dropped {duplicates} duplicate klines")
+            save_klines(df, path)
+        if name not in manifest and len(df):
+            # File from before the manifest: trust the klines it has but fetch its holes once,
+            # and the last kline again in case it was saved while still in progress
+            first, last = int(df['time'].iloc[0]), int(df['time'].iloc[-1])
+            manifest[name] = missing_ranges(merge_ranges(holes), first, last - 1)
+            print(f"{name}: {len(holes)} holes in the existing file")
+    else:
+        df = pd.DataFrame({column: pd.Series(dtype=np.int64 if column == 'time' else np.float64)
+                           for column in KLINE_COLUMNS})
+        manifest.pop(name, None)
+
+    covered = merge_ranges(manifest.get(name, []))
+    window_ms = interval_ms * limit
+    windows = [[first, min(first + window_ms - 1, last)]
+               for first, last in missing_ranges(covered, start_str, end_str)
+               for first in range(first, last + 1, window_ms)]
+    if not windows:
+        print(f"{name}: up to date")
+        return 0
+
+    added = 0
+    client = get_client(base_url)
+    for batch_start in range(0, len(windows), batch_windows):
+        batch = windows[batch_start:batch_start + batch_windows]
+        frames = [await fetch_historical_klines_to_df(symbol, interval, first, last, limit, client=client)
+                  for first, last in merge_ranges(batch)]
+        new_df = pd.concat(frames, ignore_index=True)
+        new_df = new_df[~new_df['time'].isin(df['time'])]
+
+        if len(new_df) and (df.empty or new_df['time'].iloc[0] > df['time'].iloc[-1]):
+            append_klines(new_df, path)
+            df = pd.concat([df, new_df], ignore_index=True)
+        elif len(new_df):
+            # Filling holes in the middle of the file: rewrite it in time order
+            df = pd.concat([df, new_df], ignore_index=True).sort_values('time', kind='stable').reset_index(drop=True)
+            save_klines(df, path)
+        elif not os.path.exists(path):
+            save_klines(df, path)
+        added += len(new_df)
+
+        # The dataset is saved before the manifest, a crash in between only means refetching this batch
+        covered = merge_ranges(covered + batch)
+        manifest[name] = covered
+        save_manifest(manifest, directory)
+        print(f"{name}: {min(batch_start + batch_windows, len(windows))}/{len(windows)} requests, {added} klines added")
+    return added
+
+def save_resampled_klines(symbol, source_interval, intervals, directory=DATA_DIRECTORY, output_format=OUTPUT_FORMAT):
+    """
+    Derive higher interval datasets from the stored klines of source_interval.
+
+    Only complete buckets are kept, so the kline in progress and a first bucket the source does
+    not fully cover are left out. The derived files land next to the downloaded ones and are
+    picked up by calculate_historical_klines.py like any other dataset.
+    """
+    source_df = load_klines(find_dataset(os.path.join(directory, f"{symbol}_{source_interval}_klines")),
+                            columns=KLINE_COLUMNS)
+    for interval in intervals:
+        df = resample_klines(source_df, interval, source_interval=source_interval)
+        save_klines(df, dataset_path(os.path.join(directory, f"{symbol}_{interval}_klines"), output_format))
+        print(f"Saved {interval} data resampled from {source_interval} ({len(df)} klines)")
 
 async def main():
     symbol = "BTCUSDT"
-    # intervals = ["1d", "12h", "8h", "6h", "4h", "2h", "1h", "30m", "15m", "5m", "3m", "1m"] 
-    intervals = ["5m", "3m", "1m"] 
+    # Only the lowest interval is downloaded, every other one is resampled from it locally
+    source_interval = "1m"
+    # intervals = ["1d", "12h", "8h", "6h", "4h", "2h", "1h", "30m", "15m", "5m", "3m"]
+    intervals = ["5m", "3m"]
     start_str = int(datetime(2017, 7, 17).timestamp() * 1000)  # Adjust start date as needed
     
-    for interval in intervals:
-        print(f"Fetching {interval} data for {symbol}")
-        df = await fetch_historical_klines_to_df(symbol, interval, start_str)
-        await save_df_to_csv(df, f"{symbol}_{interval}_klines.csv")  # The filename now includes the desired directory
-        print(f"Saved {interval} data to CSV")
+    print(f"Syncing {source_interval} data for {symbol}")
+    # Resumes from the manifest: only ranges not downloaded yet are fetched
+    await sync_klines(symbol, source_interval, start_str)
+    print(f"Saved {source_interval} data as {OUTPUT_FORMAT}")
+    save_resampled_klines(symbol, source_interval, intervals)
+    await close_clients()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,30 @@
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from storage import find_dataset, load_klines, compact_klines, bytes_per_row
+from strategies import STRATEGY_COLUMNS
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the memory used by a dataset in full and compact mode.")
+    parser.add_argument('--dataset', default='./historical/data_with_indicators/BTCUSDT_15m_klines',
+                        help="Dataset path without suffix (the .npy, .parquet or .csv version is used)")
+    parser.add_argument('--strategy', choices=sorted(STRATEGY_COLUMNS), help="Only load the columns this backtest reads")
+    args = parser.parse_args()
+
+    path = find_dataset(args.dataset)
+    columns = STRATEGY_COLUMNS[args.strategy] if args.strategy else None
+    df = load_klines(path, columns=columns)
+    compact_df, errors = compact_klines(df)
+
+    print(f"{path}: {len(df)} rows")
+    print(f"{'Column':<20} | {'Max abs error':>14} | {'Max rel error':>14}")
+    for column, (absolute_error, relative_error) in errors.items():
+        print(f"{column:<20} | {absolute_error:>14.6g} | {relative_error:>14.3g}")
+    kept = [c for c in df.columns if df[c].dtype == 'float64' and c not in errors]
+    if kept:
+        print(f"Kept as float64: {', '.join(kept)}")
+    before, after = bytes_per_row(df), bytes_per_row(compact_df)
+    print(f"Bytes per row: {before:.1f} -> {after:.1f} ({after / before:.0%})")
@@ -0,0 +1,93 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from storage import find_dataset
+from indicator_engine import LIVE_INDICATORS
+from live_streams import StreamRouter, StreamCompute, COMPUTE_EXECUTORS
+from metrics import LatencyMetrics
+from positions.positions import calculate_positions
+from replay import replay_klines
+from utils import datetime_to_milliseconds
+
+RETAINED_ROWS = 500
+
+
+def run_strategy(state):
+    # The live strategy, run on every replayed kline with the stream's own positions
+    calculate_positions(klines_df=state.frame(), open_positions=state.positions)
+
+
+def parse_date(value):
+    # Dates and times without a timezone are UTC, like the kline open times
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return datetime_to_milliseconds(moment)
+
+
+def parse_stem(stem):
+    # Datasets are stored as <symbol>_<interval>_klines
+    symbol, interval = Path(stem).name.split('_')[:2]
+    return symbol, interval
+
+
+async def replay(args):
+    sources = {parse_stem(stem): find_dataset(stem) for stem in args.dataset}
+    compute = StreamCompute(args.executor, args.workers)
+    latency = LatencyMetrics()
+    # Replay waits for the pipeline instead of dropping klines
+    router = StreamRouter(args.retained_rows, LIVE_INDICATORS, overflow='block', compute=compute, metrics=latency,
+                          on_kline=None if args.no_strategy else run_strategy)
+    for symbol, interval in sources:
+        router.add(symbol, interval)
+
+    consumers = router.start_consumers()
+    try:
+        replayed, elapsed = await replay_klines(sources, router, speed=args.speed, start=args.start, end=args.end)
+    finally:
+        for consumer in consumers:
+            consumer.cancel()
+        compute.shutdown()
+
+    print(f"Replayed {replayed} klines in {elapsed:.2f} s ({replayed / elapsed:.0f} klines/s)")
+    stages = latency.summary()['stages']
+    print(json.dumps({stage: stages[stage] for stage in ('queue', 'indicators', 'strategy', 'compute') if stage in stages},
+                     indent=2))
+
+    if args.output:
+        # Final retained rows of every stream, to diff regression runs
+        os.makedirs(args.output, exist_ok=True)
+        for stream in router.streams.values():
+            path = os.path.join(args.output, f"{stream.symbol}_{stream.interval}_replay.csv")
+            stream.frame().to_csv(path, index=False)
+            print(f"Saved {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay stored klines through the live pipeline.")
+    parser.add_argument('--dataset', nargs='+', default=['./historical/data/BTCUSDT_1m_klines'],
+                        help="Dataset paths without extension, named <symbol>_<interval>_klines")
+    parser.add_argument('--speed', type=float, help="Replay this many times faster than real time (as fast as possible if omitted)")
+    parser.add_argument('--start', type=parse_date,
+                        help="Replay klines opened from this UTC date or time on, e.g. 2024-03-01 or 2024-03-01T12:00")
+    parser.add_argument('--end', type=parse_date, help="Replay klines opened before this UTC date or time")
+    parser.add_argument('--executor', choices=COMPUTE_EXECUTORS, default='thread')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--retained-rows', type=int, default=RETAINED_ROWS)
+    parser.add_argument('--no-strategy', action='store_true', help="Only compute the indicators")
+    parser.add_argument('--output', help="Directory to save the final retained rows of every stream (thread executor)")
+    args = parser.parse_args()
+    if args.output and args.executor != 'thread':
+        parser.error("--output needs the thread executor, stream state stays in the workers otherwise")
+    asyncio.run(replay(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import numpy as np
+
+# Columns each backtest reads from historical/data_with_indicators.
+# calculate_historical_klines.py --strategy <name> precomputes only these (plus the raw klines).
+STRATEGY_COLUMNS = {
+    'backtest': [
+        'date', 'open', 'close', 'volume', '5_EMA', '10_SMA', 'RSI', 'bull_power', 'bear_power', 'Momentum',
+        'MACD', 'MACD_Signal', 'ppo', 'cum_volume', 'VWAP', 'OBV', 'Lower_BB', 'Upper_BB', '%K', '%D',
+        'ATR', 'CCI', 'ROC',
+    ],
+    'backtest_weight': ['date', 'open', 'close', 'RSI', 'MACD', 'MACD_Signal', '5_EMA', '10_SMA', 'ATR'],
+}
+
+
+def previous(values, periods=1):
+    """
+    The values of a column `periods` bars earlier (previous_row, previous2_row, ... as one array),
+    NaN for the first bars.
+
+    Args:
+    - values: 1D NumPy array or Series.
+    - periods: How many bars back.
+    """
+    values = np.asarray(values, dtype='float64')
+    shifted = np.full(len(values), np.nan)
+    shifted[periods:] = values[:len(values) - periods]
+    return shifted
+
+
+def next_level_hit(low, high, levels, start):
+    """
+    First bar from `start` whose body range [low, high] contains one of `levels` (a stop loss or
+    take profit being hit), len(low) if none does. Searches in doubling chunks, so the cost is
+    proportional to how long the position stays open rather than to the dataset.
+
+    Args:
+    - low, high: min(open, close) and max(open, close) of every bar, NumPy arrays.
+    - levels: Prices to look for.
+    - start: First bar checked.
+    """
+    size = 64
+    while start < len(low):
+        end = min(start + size, len(low))
+        hits = np.zeros(end - start, dtype=bool)
+        for level in levels:
+            hits |= (low[start:end] <= level) & (level <= high[start:end])
+        found = np.flatnonzero(hits)
+        if len(found):
+            return start + int(found[0])
+        start = end
+        size *= 2
+    return len(low)
@@ -0,0 +1,236 @@
+import asyncio
+import hashlib
+import os
+import time
+from urllib.parse import urlencode
+
+import aiohttp
+
+from resample import bucket_starts, bucket_ends
+
+BASE_URL = "https://api.binance.com"  # Point this to a local server to test without the exchange
+STREAM_URL = "wss://stream.binance.com:9443"  # Websocket streams, e.g. "ws://127.0.0.1:8765" for fake_exchange.py
+KLINES_PATH = "/api/v3/klines"
+EXCHANGE_INFO_PATH = "/api/v3/exchangeInfo"
+
+# Keep-alive connection pool shared by every REST request of the process
+MAX_CONNECTIONS = 16
+KEEPALIVE_SECONDS = 60
+
+# Binance allows 6000 request weight per minute and IP; one klines request (limit <= 1000) weighs 2
+REQUEST_WEIGHT_LIMIT = 6000
+KLINES_REQUEST_WEIGHT = 2
+EXCHANGE_INFO_REQUEST_WEIGHT = 20
+
+# Failed requests are retried this many times, waiting RETRY_BACKOFF_SECONDS * 2**attempt in between
+MAX_RETRIES = 5
+RETRY_BACKOFF_SECONDS = 1.0
+
+# Responses for fully closed kline ranges never change, they are kept here (relative to the working directory)
+CACHE_DIRECTORY = "historical/cache"
+
+
+class RequestWeightLimiter:
+    """
+    Keeps the request weight used per minute under the exchange limit, shared by every request.
+
+    The used weight is counted locally and corrected with the X-MBX-USED-WEIGHT-1M header the
+    exchange sends back. After a 429 (rate limited) or 418 (IP banned) answer every request
+    waits until the Retry-After delay has passed.
+    """
+    def __init__(self, limit=REQUEST_WEIGHT_LIMIT):
+        self.limit = limit
+        self.used = 0
+        self.minute = None
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, weight):
+        async with self.lock:
+            while True:
+                now = time.time()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                minute = int(now // 60)
+                if minute != self.minute:
+                    self.minute = minute
+                    self.used = 0
+                if self.used + weight <= self.limit:
+                    self.used += weight
+                    return
+                await asyncio.sleep((minute + 1) * 60 - now)
+
+    def update(self, headers):
+        used = headers.get('X-MBX-USED-WEIGHT-1M')
+        if used is not None:
+            self.used = max(self.used, int(used))
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.time() + seconds)
+
+
+class KlinesClient:
+    """
+    One pooled aiohttp session for every REST request, plus a disk cache for kline requests.
+
+    A klines request is cacheable when its endTime lies in a kline that has already closed:
+    the exchange answers it the same way forever. Its response is only stored once the last
+    kline it holds has closed too, which also catches intervals the exchange puts on another
+    grid than resample's (a 3d kline still forming past endTime). Cached bodies are stored under the SHA-256 of
+    the canonical request (path and sorted parameters), so reruns, replays and concurrent
+    scripts asking for the same range share one file. `hits` and `misses` count the lookups of
+    cacheable requests. Requests that do go out share one RequestWeightLimiter.
+    """
+    def __init__(self, base_url=BASE_URL, cache_directory=CACHE_DIRECTORY, use_cache=True,
+                 max_connections=MAX_CONNECTIONS):
+        self.base_url = base_url
+        self.cache_directory = cache_directory
+        self.use_cache = use_cache
+        self.max_connections = max_connections
+        self._session = None
+        self.limiter = RequestWeightLimiter()
+        self.hits = 0
+        self.misses = 0
+        self.requests = 0
+
+    @property
+    def session(self):
+        # Created on first use, inside the running event loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=KEEPALIVE_SECONDS)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def stats(self):
+        return {'requests': self.requests, 'cache_hits': self.hits, 'cache_misses': self.misses}
+
+    def cacheable(self, path, params):
+        if not self.use_cache or path != KLINES_PATH or 'endTime' not in params:
+            return False
+        end_time = int(params['endTime'])
+        try:
+            closes_at = bucket_ends(bucket_starts([end_time], params['interval']), params['interval'])[0]
+        except KeyError:
+            return False
+        return closes_at <= time.time() * 1000
+
+    def complete(self, body):
+        """
+        Whether every kline of a klines response body has closed (the last one's close time has passed).
+        """
+        if body.strip() == b'[]':
+            return True
+        try:
+            # Close time is field 6 of the last kline, no need to parse the whole body
+            close_time = int(body[body.rindex(b'[') + 1:].split(b',')[6])
+        except (ValueError, IndexError):
+            return False
+        return close_time < time.time() * 1000
+
+    def cache_path(self, path, params):
+        request = f"{self.base_url}{path}?{urlencode(sorted(params.items()))}"
+        key = hashlib.sha256(request.encode()).hexdigest()
+        return os.path.join(self.cache_directory, key[:2], f"{key}.json")
+
+    def cache_lookup(self, path, params):
+        """
+        Cached body of a cacheable request, or None.
+        """
+        if not self.cacheable(path, params):
+            return None
+        try:
+            with open(self.cache_path(path, params), 'rb') as cache_file:
+                body = cache_file.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return body
+
+    def cache_store(self, path, params, body):
+        if not self.cacheable(path, params) or not self.complete(body):
+            return
+        cache_path = self.cache_path(path, params)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # Written to a temporary file first, a crash never leaves a truncated entry behind
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as cache_file:
+            cache_file.write(body)
+        os.replace(tmp_path, cache_path)
+
+    async def get(self, path, params, weight=1):
+        """
+        GET a REST endpoint through the cache, within the request weight limit.
+
+        Returns:
+        - (status, headers, body). Cache hits come back as (200, {}, body) without any request.
+        """
+        body = self.cache_lookup(path, params)
+        if body is not None:
+            return 200, {}, body
+        await self.limiter.acquire(weight)
+        self.requests += 1
+        async with self.session.get(self.base_url + path, params=params) as response:
+            self.limiter.update(response.headers)
+            body = await response.read()
+            if response.status == 200:
+                self.cache_store(path, params, body)
+            return response.status, response.headers, body
+
+
+async def fetch_klines_window(client, params):
+    """
+    Fetch one page of klines, retrying on rate limits, server errors and connection problems.
+    Closed ranges already fetched once come from the client's disk cache.
+
+    Args:
+    - client: The KlinesClient (get_client()).
+    - params: klines request parameters.
+
+    Returns:
+    - the raw response body, a JSON array of klines (see kline_decoding.decode_klines).
+    """
+    error = None
+    for attempt in range(MAX_RETRIES + 1):
+        backoff = RETRY_BACKOFF_SECONDS * 2 ** attempt
+        try:
+            status, headers, body = await client.get(KLINES_PATH, params, weight=KLINES_REQUEST_WEIGHT)
+            if status == 200:
+                return body
+            error = f"HTTP {status}: {body.decode(errors='replace')}"
+            if status in (429, 418):
+                retry_after = float(headers.get('Retry-After', backoff))
+                print(f"Rate limited (HTTP {status}), pausing requests for {retry_after:g}s")
+                client.limiter.pause(retry_after)
+                continue
+            if status < 500:
+                # Bad symbol, interval or time range: retrying will not help
+                break
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = repr(e)
+        await asyncio.sleep(backoff)
+    raise RuntimeError(f"Failed to fetch historical klines {params}: {error}")
+
+
+_clients = {}
+
+
+def get_client(base_url=BASE_URL):
+    """
+    The process-wide client for base_url, so every caller reuses the same connection pool.
+    """
+    if base_url not in _clients:
+        _clients[base_url] = KlinesClient(base_url)
+    return _clients[base_url]
+
+
+async def close_clients():
+    for client in _clients.values():
+        await client.close()
+    _clients.clear()
@@ -0,0 +1,958 @@
+import datetime
+import math
+import time
+from collections import deque
+
+import numpy as np
+
+from indicator_graph import resolve_indicators
+
+NAN = math.nan
+MILLISECONDS_PER_DAY = 86_400_000
+EPOCH_DATE = datetime.date(1970, 1, 1)
+
+
+def _div(a, b):
+    """
+    Divide like numpy float64 does: division by zero gives +-inf or NaN instead of raising.
+    """
+    if b == 0.0:
+        if a == 0.0 or a != a:
+            return NAN
+        return math.copysign(math.inf, a) * math.copysign(1.0, b)
+    return a / b
+
+
+# ---------------------------------------------------------------------------
+# Online building blocks.
+#
+# Each one mirrors the algorithm pandas uses internally for the matching batch
+# operation (Kahan-compensated sums for rolling/groupby sums, Welford updates for
+# rolling variance, the adjust=False recurrence for ewm), so feeding values one by
+# one yields exactly the same floats as the vectorized call on the full history.
+# ---------------------------------------------------------------------------
+
+class RollingMean:
+    """
+    Streaming equivalent of Series.rolling(window).mean().
+    """
+    def __init__(self, window):
+        self.window = window
+        self.values = deque()
+        self.nobs = 0
+        self.sum_x = 0.0
+        self.compensation_add = 0.0
+        self.compensation_remove = 0.0
+        self.neg_ct = 0
+        self.prev_value = NAN
+        self.num_consecutive_same_value = 0
+
+    def _add(self, val):
+        if val == val:
+            self.nobs += 1
+            y = val - self.compensation_add
+            t = self.sum_x + y
+            self.compensation_add = t - self.sum_x - y
+            self.sum_x = t
+            if math.copysign(1.0, val) < 0:
+                self.neg_ct += 1
+            if val == self.prev_value:
+                self.num_consecutive_same_value += 1
+            else:
+                self.num_consecutive_same_value = 1
+                self.prev_value = val
+
+    def _remove(self, val):
+        if val == val:
+            self.nobs -= 1
+            y = -val - self.compensation_remove
+            t = self.sum_x + y
+            self.compensation_remove = t - self.sum_x - y
+            self.sum_x = t
+            if math.copysign(1.0, val) < 0:
+                self.neg_ct -= 1
+
+    def value(self):
+        if self.nobs >= self.window and self.nobs > 0:
+            if self.num_consecutive_same_value >= self.nobs:
+                return self.prev_value
+            result = self.sum_x / self.nobs
+            if self.neg_ct == 0 and result < 0:
+                return 0.0
+            if self.neg_ct == self.nobs and result > 0:
+                return 0.0
+            return result
+        return NAN
+
+    def update(self, val):
+        if len(self.values) == self.window:
+            self._remove(self.values.popleft())
+        self.values.append(val)
+        self._add(val)
+        return self.value()
+
+    def peek(self, val):
+        return _peek_window(self, val)
+
+
+class RollingSum(RollingMean):
+    """
+    Streaming equivalent of Series.rolling(window).sum().
+    """
+    def value(self):
+        if self.nobs >= self.window and self.nobs > 0:
+            if self.num_consecutive_same_value >= self.nobs:
+                return self.prev_value * self.nobs
+            return self.sum_x
+        return NAN
+
+
+class RollingStd:
+    """
+    Streaming equivalent of Series.rolling(window).std() (ddof=1).
+    """
+    # pandas recomputes the window from scratch when an update looks ill-conditioned
+    INV_COND_TOL = np.finfo(np.float64).eps * 1e3
+
+    def __init__(self, window, ddof=1):
+        self.window = window
+        self.ddof = ddof
+        self.values = deque()
+        self._reset()
+
+    def _reset(self):
+        self.nobs = 0
+        self.mean_x = 0.0
+        self.ssqdm_x = 0.0
+        self.compensation_add = 0.0
+        self.compensation_remove = 0.0
+        self.numerically_unstable = False
+
+    def _add(self, val):
+        if val == val:
+            prev_m2 = self.ssqdm_x
+            self.nobs += 1
+            prev_mean = self.mean_x - self.compensation_add
+            y = val - self.compensation_add
+            t = y - self.mean_x
+            self.compensation_add = t + self.mean_x - y
+            self.mean_x += t / self.nobs
+            self.ssqdm_x += (val - prev_mean) * (val - self.mean_x)
+            if prev_m2 * self.INV_COND_TOL > self.ssqdm_x:
+                self.numerically_unstable = True
+
+    def _remove(self, val):
+        if val == val:
+            prev_m2 = self.ssqdm_x
+            self.nobs -= 1
+            if self.nobs:
+                prev_mean = self.mean_x - self.compensation_remove
+                y = val - self.compensation_remove
+                t = y - self.mean_x
+                self.compensation_remove = t + self.mean_x - y
+                self.mean_x -= t / self.nobs
+                self.ssqdm_x -= (val - prev_mean) * (val - self.mean_x)
+                if prev_m2 * self.INV_COND_TOL > self.ssqdm_x:
+                    self.numerically_unstable = True
+            else:
+                self.mean_x = 0.0
+                self.ssqdm_x = 0.0
+                self.numerically_unstable = False
+
+    def value(self):
+        if self.nobs >= self.window and self.nobs > self.ddof:
+            result = self.ssqdm_x / (self.nobs - self.ddof)
+            return 0.0 if result < 0 else math.sqrt(result)
+        return NAN
+
+    def update(self, val):
+        if len(self.values) == self.window:
+            self._remove(self.values.popleft())
+        self.values.append(val)
+        self._add(val)
+        if self.numerically_unstable:
+            self._reset()
+            for value in self.values:
+                self._add(value)
+            self.numerically_unstable = False
+        return self.value()
+
+    def peek(self, val):
+        return _peek_window(self, val)
+
+
+def _peek_window(rolling, val):
+    """
+    What rolling.update(val) returns, leaving the rolling window unchanged: the update runs
+    and is then undone (window deque put back, scalar state restored), O(1).
+    """
+    saved = rolling.__dict__.copy()
+    full = len(rolling.values) == rolling.window
+    oldest = rolling.values[0] if full else None
+    try:
+        return rolling.update(val)
+    finally:
+        rolling.values.pop()
+        if full:
+            rolling.values.appendleft(oldest)
+        rolling.__dict__.update(saved)
+
+
+class RollingExtremum:
+    """
+    Streaming equivalent of Series.rolling(window).max() / .min(), using a monotonic deque.
+    """
+    def __init__(self, window, find_max=True):
+        self.window = window
+        self.find_max = find_max
+        self.count = 0
+        self.candidates = deque()  # (position, value), values monotonic from the front
+        self.nan_positions = deque()
+
+    def update(self, val):
+        position = self.count
+        self.count += 1
+        oldest = position - self.window + 1
+
+        while self.candidates and self.candidates[0][0] < oldest:
+            self.candidates.popleft()
+        while self.nan_positions and self.nan_positions[0] < oldest:
+            self.nan_positions.popleft()
+
+        if val != val:
+            self.nan_positions.append(position)
+        elif self.find_max:
+            while self.candidates and self.candidates[-1][1] <= val:
+                self.candidates.pop()
+            self.candidates.append((position, val))
+        else:
+            while self.candidates and self.candidates[-1][1] >= val:
+                self.candidates.pop()
+            self.candidates.append((position, val))
+
+        if self.count < self.window or self.nan_positions:
+            return NAN
+        return self.candidates[0][1]
+
+    def peek(self, val):
+        """
+        What update(val) returns, without changing the state.
+        """
+        oldest = self.count - self.window + 1
+        if self.count + 1 < self.window or val != val:
+            return NAN
+        # Entries older than the window are dropped lazily, at most the first one is stale
+        if any(position >= oldest for position in self.nan_positions):
+            return NAN
+        for position, candidate in self.candidates:
+            if position >= oldest:
+                return _fmax(candidate, val) if self.find_max else _fmin(candidate, val)
+        return val
+
+
+class EWM:
+    """
+    Streaming equivalent of Series.ewm(span=span, adjust=False).mean(), or of
+    Series.ewm(alpha=alpha, adjust=False).mean() when alpha is given.
+    """
+    def __init__(self, span=None, alpha=None):
+        # pandas converts both parametrizations to a center of mass first
+        self.com = 1.0 / alpha - 1.0 if alpha is not None else (span - 1) / 2.0
+        self.alpha = 1.0 / (1.0 + self.com)
+        self.old_wt_factor = 1.0 - self.alpha
+        self.old_wt = 1.0
+        self.weighted = NAN
+
+    def update(self, cur):
+        is_observation = cur == cur
+        if self.weighted == self.weighted:
+            self.old_wt *= self.old_wt_factor
+            if is_observation:
+                # Same guard pandas uses to avoid numerical noise on constant series
+                if self.weighted != cur:
+                    # With com == 1 pandas reweights after gaps of missing values
+                    new_wt = 1.0 - self.old_wt if self.com == 1 else self.alpha
+                    self.weighted = (self.old_wt * self.weighted + new_wt * cur) / (self.old_wt + new_wt)
+                self.old_wt = 1.0
+        elif is_observation:
+            self.weighted = cur
+        return self.weighted
+
+    def peek(self, cur):
+        return _peek_scalars(self, cur)
+
+
+class KahanCumSum:
+    """
+    Streaming equivalent of Series.cumsum() / groupby(...).cumsum() within one group.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.total = 0.0
+        self.compensation = 0.0
+
+    def update(self, val):
+        if val != val:
+            return NAN
+        y = val - self.compensation
+        t = self.total + y
+        self.compensation = t - self.total - y
+        self.total = t
+        return self.total
+
+    def peek(self, val):
+        return _peek_scalars(self, val)
+
+
+def _peek_scalars(primitive, val):
+    """
+    What primitive.update(val) returns for a primitive whose state is only scalars, without changing it.
+    """
+    saved = primitive.__dict__.copy()
+    try:
+        return primitive.update(val)
+    finally:
+        primitive.__dict__.update(saved)
+
+
+class Lag:
+    """
+    Returns the value seen `period` updates ago (Series.shift(period)).
+    """
+    def __init__(self, period):
+        self.period = period
+        self.values = deque(maxlen=period + 1)
+
+    def update(self, val):
+        self.values.append(val)
+        if len(self.values) <= self.period:
+            return NAN
+        return self.values[0]
+
+    def peek(self, val):
+        if len(self.values) < self.period:
+            return NAN
+        return self.values[1] if len(self.values) > self.period else self.values[0]
+
+
+# ---------------------------------------------------------------------------
+# Indicators. Each class mirrors the function of the same name in utils.py and
+# returns the columns that function adds, for one new bar at a time.
+# ---------------------------------------------------------------------------
+
+class DateColumn:
+    columns = ['date']
+
+    def update(self, bar):
+        return {'date': EPOCH_DATE + datetime.timedelta(days=int(bar['time'] // MILLISECONDS_PER_DAY))}
+
+
+class EMA5:
+    columns = ['5_EMA']
+
+    def __init__(self):
+        self.ema = EWM(5)
+
+    def update(self, bar):
+        return {'5_EMA': self.ema.update(bar['close'])}
+
+
+class SMA10:
+    columns = ['10_SMA']
+
+    def __init__(self):
+        self.sma = RollingMean(10)
+
+    def update(self, bar):
+        return {'10_SMA': self.sma.update(bar['close'])}
+
+
+class RSI:
+    columns = ['RSI']
+
+    def __init__(self, period=14):
+        self.prev_close = NAN
+        self.gain = RollingMean(period)
+        self.loss = RollingMean(period)
+
+    def update(self, bar):
+        delta = bar['close'] - self.prev_close
+        self.prev_close = bar['close']
+        gain = self.gain.update(delta if delta > 0 else 0.0)
+        loss = self.loss.update(-delta if delta < 0 else -0.0)
+        rs = _div(gain, loss)
+        return {'RSI': 100 - _div(100, 1 + rs)}
+
+
+class MACD:
+    columns = ['MACD', 'MACD_Signal']
+
+    def __init__(self, short_period=12, long_period=26, signal_period=9):
+        self.short = EWM(short_period)
+        self.long = EWM(long_period)
+        self.signal = EWM(signal_period)
+
+    def update(self, bar):
+        macd = self.short.update(bar['close']) - self.long.update(bar['close'])
+        return {'MACD': macd, 'MACD_Signal': self.signal.update(macd)}
+
+
+class BollingerBands:
+    columns = ['Upper_BB', 'Lower_BB']
+
+    def __init__(self, period=20):
+        self.sma = RollingMean(period)
+        self.std = RollingStd(period)
+
+    def update(self, bar):
+        sma = self.sma.update(bar['close'])
+        std = self.std.update(bar['close'])
+        return {'Upper_BB': sma + (std * 2), 'Lower_BB': sma - (std * 2)}
+
+
+class VWAP:
+    columns = ['cum_volume', 'cum_price_volume', 'VWAP']
+
+    def __init__(self):
+        self.day = None
+        self.cum_volume = KahanCumSum()
+        self.cum_price_volume = KahanCumSum()
+
+    def update(self, bar):
+        day = int(bar['time'] // MILLISECONDS_PER_DAY)
+        if day != self.day:
+            self.day = day
+            self.cum_volume.reset()
+            self.cum_price_volume.reset()
+        cum_volume = self.cum_volume.update(bar['volume'])
+        cum_price_volume = self.cum_price_volume.update(bar['close'] * bar['volume'])
+        return {
+            'cum_volume': cum_volume,
+            'cum_price_volume': cum_price_volume,
+            'VWAP': _div(cum_price_volume, cum_volume),
+        }
+
+
+class OBV:
+    columns = ['OBV']
+
+    def __init__(self):
+        self.prev_close = None
+        self.obv = 0.0
+
+    def update(self, bar):
+        if self.prev_close is not None:
+            if bar['close'] > self.prev_close:
+                self.obv = self.obv + bar['volume']
+            elif bar['close'] < self.prev_close:
+                self.obv = self.obv - bar['volume']
+        self.prev_close = bar['close']
+        return {'OBV': self.obv}
+
+
+class StochasticOscillator:
+    columns = ['%K', '%D']
+
+    def __init__(self, k_period=14, d_period=3):
+        self.low_min = RollingExtremum(k_period, find_max=False)
+        self.high_max = RollingExtremum(k_period, find_max=True)
+        self.d = RollingMean(d_period)
+
+    def update(self, bar):
+        low_min = self.low_min.update(bar['low'])
+        high_max = self.high_max.update(bar['high'])
+        k = _div(bar['close'] - low_min, high_max - low_min) * 100
+        return {'%K': k, '%D': self.d.update(k)}
+
+
+class ATR:
+    columns = ['ATR']
+
+    def __init__(self, period=14):
+        self.prev_close = NAN
+        self.atr = RollingMean(period)
+
+    def update(self, bar):
+        high_low = bar['high'] - bar['low']
+        high_close = abs(bar['high'] - self.prev_close)
+        low_close = abs(bar['low'] - self.prev_close)
+        self.prev_close = bar['close']
+        # DataFrame.max(axis=1) skips NaN, which only matters on the very first bar
+        true_range = max((v for v in (high_low, high_close, low_close) if v == v), default=NAN)
+        return {'ATR': self.atr.update(true_range)}
+
+
+class ADLine:
+    columns = ['AD_Line']
+
+    def __init__(self):
+        self.first = True
+        self.ad_line = 0.0
+
+    def update(self, bar):
+        if self.first:
+            self.first = False
+            return {'AD_Line': self.ad_line}
+        high, low, close = bar['high'], bar['low'], bar['close']
+        clv = ((close - low) - (high - close)) / (high - low) if (high - low) != 0 else 0
+        self.ad_line = self.ad_line + (clv * bar['volume'])
+        return {'AD_Line': self.ad_line}
+
+
+class CCI:
+    columns = ['CCI']
+
+    def __init__(self, period=20):
+        self.period = period
+        self.tp_sma = RollingMean(period)
+        self.window = deque(maxlen=period)
+
+    def update(self, bar):
+        tp = (bar['high'] + bar['low'] + bar['close']) / 3
+        tp_sma = self.tp_sma.update(tp)
+        self.window.append(tp)
+        if len(self.window) < self.period:
+            return {'CCI': NAN}
+        # Mean deviation is evaluated on the window itself, exactly like the batch version
+        x = np.fromiter(self.window, dtype=np.float64, count=self.period)
+        md = float(np.abs(x - x.mean()).mean())
+        return {'CCI': _div(tp - tp_sma, 0.015 * md)}
+
+    def peek(self, bar):
+        tp = (bar['high'] + bar['low'] + bar['close']) / 3
+        tp_sma = self.tp_sma.peek(tp)
+        if len(self.window) + 1 < self.period:
+            return {'CCI': NAN}
+        x = np.fromiter(self.window, dtype=np.float64, count=len(self.window))
+        x = np.append(x[len(x) + 1 - self.period:], tp)
+        md = float(np.abs(x - x.mean()).mean())
+        return {'CCI': _div(tp - tp_sma, 0.015 * md)}
+
+
+class PivotPoints:
+    columns = ['PP', 'R1', 'S1', 'R2', 'S2']
+
+    def __init__(self):
+        self.prev_bar = None
+
+    def update(self, bar):
+        prev_bar, self.prev_bar = self.prev_bar, bar
+        if prev_bar is None:
+            return dict.fromkeys(self.columns, NAN)
+        high_prev, low_prev, close_prev = prev_bar['high'], prev_bar['low'], prev_bar['close']
+        pp = (high_prev + low_prev + close_prev) / 3
+        return {
+            'PP': pp,
+            'R1': (2 * pp) - low_prev,
+            'S1': (2 * pp) - high_prev,
+            'R2': pp + (high_prev - low_prev),
+            'S2': pp - (high_prev - low_prev),
+        }
+
+
+class Momentum:
+    columns = ['Momentum']
+
+    def __init__(self, period=14):
+        self.lag = Lag(period)
+
+    def update(self, bar):
+        return {'Momentum': bar['close'] - self.lag.update(bar['close'])}
+
+
+class StandardDeviation:
+    columns = ['Std_Dev']
+
+    def __init__(self, period=20):
+        self.std = RollingStd(period)
+
+    def update(self, bar):
+        return {'Std_Dev': self.std.update(bar['close'])}
+
+
+class FibonacciRetracement:
+    columns = ['Fib_23_6', 'Fib_38_2', 'Fib_50', 'Fib_61_8', 'Fib_78_6']
+
+    def __init__(self, period=14):
+        self.highest = RollingExtremum(period, find_max=True)
+        self.lowest = RollingExtremum(period, find_max=False)
+
+    def update(self, bar):
+        highest_price = self.highest.update(bar['high'])
+        lowest_price = self.lowest.update(bar['low'])
+        price_range = highest_price - lowest_price
+        return {
+            'Fib_23_6': highest_price - (price_range * 0.236),
+            'Fib_38_2': highest_price - (price_range * 0.382),
+            'Fib_50': highest_price - (price_range * 0.5),
+            'Fib_61_8': highest_price - (price_range * 0.618),
+            'Fib_78_6': highest_price - (price_range * 0.786),
+        }
+
+
+class ROC:
+    columns = ['ROC']
+
+    def __init__(self, period=14):
+        self.lag = Lag(period)
+
+    def update(self, bar):
+        close_prev = self.lag.update(bar['close'])
+        return {'ROC': _div(bar['close'] - close_prev, close_prev) * 100}
+
+
+def _fmax(a, b):
+    """
+    max() that ignores NaN like np.fmax.
+    """
+    if a != a:
+        return b
+    if b != b:
+        return a
+    return a if a >= b else b
+
+
+def _fmin(a, b):
+    if a != a:
+        return b
+    if b != b:
+        return a
+    return a if a <= b else b
+
+
+# ---------------------------------------------------------------------------
+# Indicators that look ahead. Their batch value for a row depends on later
+# bars, so besides the row for the new bar they report `revisions`: a list of
+# (rows_back, column, value) corrections for rows already emitted, never more
+# than `lookahead` rows back. Applying them gives exactly the batch values.
+# ---------------------------------------------------------------------------
+
+class SupportResistance:
+    columns = ['Resistance', 'Support']
+
+    def __init__(self, window=14):
+        self.window = window
+        self.middle = window // 2
+        self.lookahead = window - 1 - self.middle
+        self.highs = deque(maxlen=window)
+        self.lows = deque(maxlen=window)
+        self.resistance = NAN
+        self.support = NAN
+        self.revisions = []
+
+    def _centered_extremum(self, values, find_max):
+        # Value of the window center if it is the first occurrence of the window's max/min
+        if any(value != value for value in values):
+            return NAN
+        extremum = max(values) if find_max else min(values)
+        center = values[self.middle]
+        if center == extremum and extremum not in list(values)[:self.middle]:
+            return center
+        return NAN
+
+    def update(self, bar):
+        self.revisions = []
+        self.highs.append(bar['high'])
+        self.lows.append(bar['low'])
+        if len(self.highs) == self.window:
+            # The window ending at this bar confirms (or not) a pivot `lookahead` rows back;
+            # the rows after a pivot are forward filled with it
+            resistance = self._centered_extremum(self.highs, True)
+            if resistance == resistance:
+                self.resistance = resistance
+                self.revisions += [(back, 'Resistance', resistance) for back in range(1, self.lookahead + 1)]
+            support = self._centered_extremum(self.lows, False)
+            if support == support:
+                self.support = support
+                self.revisions += [(back, 'Support', support) for back in range(1, self.lookahead + 1)]
+        return {'Resistance': self.resistance, 'Support': self.support}
+
+    def peek(self, bar):
+        # Provisional values only, the revisions a closing bar makes are not reported
+        highs = (list(self.highs) + [bar['high']])[-self.window:]
+        lows = (list(self.lows) + [bar['low']])[-self.window:]
+        resistance, support = self.resistance, self.support
+        if len(highs) == self.window:
+            pivot = self._centered_extremum(highs, True)
+            if pivot == pivot:
+                resistance = pivot
+            pivot = self._centered_extremum(lows, False)
+            if pivot == pivot:
+                support = pivot
+        return {'Resistance': resistance, 'Support': support}
+
+
+class VWMA:
+    columns = ['vwma']
+
+    def __init__(self, period=20):
+        self.sum_price_volume = RollingSum(period)
+        self.sum_volume = RollingSum(period)
+
+    def update(self, bar):
+        sum_price_volume = self.sum_price_volume.update(bar['close'] * bar['volume'])
+        sum_volume = self.sum_volume.update(bar['volume'])
+        return {'vwma': _div(sum_price_volume, sum_volume)}
+
+
+class PPO:
+    columns = ['ppo', 'ppo_signal']
+
+    def __init__(self, short_period=12, long_period=26, signal_period=9):
+        self.short = EWM(short_period)
+        self.long = EWM(long_period)
+        self.signal = EWM(signal_period)
+
+    def update(self, bar):
+        ema_short = self.short.update(bar['close'])
+        ema_long = self.long.update(bar['close'])
+        ppo = _div(ema_short - ema_long, ema_long) * 100
+        return {'ppo': ppo, 'ppo_signal': self.signal.update(ppo)}
+
+
+class IchimokuCloud:
+    columns = ['tenkan_sen', 'kijun_sen', 'senkou_span_a', 'senkou_span_b', 'chikou_span']
+
+    def __init__(self, shift=26):
+        self.lookahead = shift
+        self.high_9 = RollingExtremum(9, find_max=True)
+        self.low_9 = RollingExtremum(9, find_max=False)
+        self.high_26 = RollingExtremum(26, find_max=True)
+        self.low_26 = RollingExtremum(26, find_max=False)
+        self.high_52 = RollingExtremum(52, find_max=True)
+        self.low_52 = RollingExtremum(52, find_max=False)
+        self.senkou_span_a = Lag(shift)
+        self.senkou_span_b = Lag(shift)
+        self.count = 0
+        self.revisions = []
+
+    def update(self, bar):
+        tenkan_sen = (self.high_9.update(bar['high']) + self.low_9.update(bar['low'])) / 2
+        kijun_sen = (self.high_26.update(bar['high']) + self.low_26.update(bar['low'])) / 2
+        high_52 = self.high_52.update(bar['high'])
+        low_52 = self.low_52.update(bar['low'])
+        self.count += 1
+        # The chikou span of a row is the close `shift` bars later
+        self.revisions = [(self.lookahead, 'chikou_span', bar['close'])] if self.count > self.lookahead else []
+        return {
+            'tenkan_sen': tenkan_sen,
+            'kijun_sen': kijun_sen,
+            'senkou_span_a': self.senkou_span_a.update((tenkan_sen + kijun_sen) / 2),
+            'senkou_span_b': self.senkou_span_b.update((high_52 + low_52) / 2),
+            'chikou_span': NAN,
+        }
+
+
+class HeikinAshi:
+    columns = ['ha_close', 'ha_open', 'ha_high', 'ha_low']
+
+    def __init__(self):
+        self.prev_bar = None
+        self.prev_ha_close = NAN
+        self.ha_open = EWM(alpha=0.5)
+
+    def update(self, bar):
+        ha_close = (bar['open'] + bar['high'] + bar['low'] + bar['close']) / 4
+        if self.prev_bar is None:
+            preliminary_open = previous_ha_close = bar['open']
+        else:
+            # ha_high/ha_low use the midpoint of the previous raw candle, as in utils.py
+            preliminary_open = (self.prev_bar['open'] + self.prev_bar['close']) / 2
+            previous_ha_close = self.prev_ha_close
+        self.prev_bar = bar
+        self.prev_ha_close = ha_close
+        return {
+            'ha_close': ha_close,
+            'ha_open': self.ha_open.update(previous_ha_close),
+            'ha_high': _fmax(_fmax(bar['high'], preliminary_open), ha_close),
+            'ha_low': _fmin(_fmin(bar['low'], preliminary_open), ha_close),
+        }
+
+
+class ElderRayIndex:
+    columns = ['bull_power', 'bear_power']
+
+    def __init__(self, period=13):
+        self.ema = EWM(period)
+
+    def update(self, bar):
+        ema_close = self.ema.update(bar['close'])
+        return {'bull_power': bar['high'] - ema_close, 'bear_power': bar['low'] - ema_close}
+
+
+class ZigZag:
+    columns = ['zig_zag']
+
+    def __init__(self, percentage=5):
+        self.percentage = percentage
+        self.last_zig_zag = None
+        self.direction = 0
+
+    def update(self, bar):
+        close = bar['close']
+        if self.last_zig_zag is None:
+            self.last_zig_zag = close
+        else:
+            move_perc = _div(close - self.last_zig_zag, self.last_zig_zag) * 100
+            if abs(move_perc) >= self.percentage:
+                if move_perc > 0 and self.direction != 1:
+                    self.direction = 1
+                    self.last_zig_zag = close
+                elif move_perc < 0 and self.direction != -1:
+                    self.direction = -1
+                    self.last_zig_zag = close
+        # The batch column is forward filled from the last zig zag point
+        return {'zig_zag': self.last_zig_zag}
+
+
+class _Peeking:
+    """
+    Stands in for a primitive while an indicator is peeked: update() returns the primitive's
+    peek() and leaves it untouched.
+    """
+    def __init__(self, primitive):
+        self.primitive = primitive
+
+    def update(self, val):
+        return self.primitive.peek(val)
+
+    def reset(self):
+        # Peek from a fresh primitive, e.g. VWAP's cumulative sums at a new day
+        self.primitive = type(self.primitive)()
+
+
+def peek_indicator(indicator, bar):
+    """
+    The columns indicator.update(bar) would return, without changing the indicator.
+
+    Indicators keeping raw windows define their own peek(); for the others the update runs with
+    their primitives replaced by _Peeking stand-ins and their scalar state restored afterwards.
+    """
+    if hasattr(indicator, 'peek'):
+        return indicator.peek(bar)
+    saved = indicator.__dict__.copy()
+    for name, value in saved.items():
+        if hasattr(value, 'peek'):
+            setattr(indicator, name, _Peeking(value))
+    try:
+        return indicator.update(bar)
+    finally:
+        indicator.__dict__.update(saved)
+
+
+# Streaming implementations, keyed by the indicator names of indicator_graph.INDICATORS
+STREAMING_INDICATORS = {
+    'date': DateColumn,
+    '5_ema': EMA5,
+    '10_sma': SMA10,
+    'rsi': RSI,
+    'macd': MACD,
+    'bollinger_bands': BollingerBands,
+    'vwap': VWAP,
+    'obv': OBV,
+    'stochastic_oscillator': StochasticOscillator,
+    'atr': ATR,
+    'ad_line': ADLine,
+    'cci': CCI,
+    'pivot_points': PivotPoints,
+    'momentum': Momentum,
+    'standard_deviation': StandardDeviation,
+    'fibonacci_retracement': FibonacciRetracement,
+    'roc': ROC,
+    'support_resistance': SupportResistance,
+    'vwma': VWMA,
+    'ppo': PPO,
+    'ichimoku_cloud': IchimokuCloud,
+    'heikin_ashi': HeikinAshi,
+    'elder_ray_index': ElderRayIndex,
+    'zig_zag': ZigZag,
+}
+
+# What main.py has always computed for every closed kline
+LIVE_INDICATORS = ['date', '5_ema', '10_sma', 'rsi', 'macd', 'bollinger_bands', 'vwap', 'obv', 'stochastic_oscillator',
+                   'atr', 'ad_line', 'cci', 'pivot_points', 'momentum', 'standard_deviation', 'fibonacci_retracement',
+                   'roc']
+
+BASE_COLUMNS = ['time', 'open', 'high', 'low', 'close', 'volume']
+
+
+class IndicatorEngine:
+    """
+    Keeps running state for every indicator and produces one row of values per closed kline.
+
+    The cost of update() depends only on the indicator windows, never on how many klines
+    have been processed before, and the values match the batch utils.py functions exactly.
+    The engine only holds plain Python state, so it can be pickled and resumed later.
+    """
+    def __init__(self, indicators=LIVE_INDICATORS):
+        # The indicator graph adds dependencies (e.g. 'date' for 'vwap') and fixes the column order
+        names = resolve_indicators(indicators)
+        missing = [name for name in names if name not in STREAMING_INDICATORS]
+        if missing:
+            raise ValueError(f"No streaming implementation for indicators: {', '.join(missing)}")
+        self.names = names
+        self.indicators = [STREAMING_INDICATORS[name]() for name in names]
+        self.columns = BASE_COLUMNS + [column for indicator in self.indicators for column in indicator.columns]
+        # How many already emitted rows a new bar may still change (support/resistance, chikou span)
+        self.lookahead = max((getattr(indicator, 'lookahead', 0) for indicator in self.indicators), default=0)
+        self.revisions = []
+        self.count = 0
+
+    def update(self, bar, timings=None):
+        """
+        Advance every indicator with a new closed bar.
+
+        Args:
+        - bar: dict with 'time', 'open', 'high', 'low', 'close' and 'volume' as floats.
+        - timings: Optional dict filled with {indicator name: seconds spent updating it}.
+
+        Returns:
+        - dict with the bar's base columns plus every indicator column.
+
+        After the call, `revisions` lists the (row position, column, value) updates this bar
+        makes to earlier rows; it is always empty unless a look-ahead indicator is enabled.
+        """
+        row = {column: bar[column] for column in BASE_COLUMNS}
+        self.revisions = []
+        for name, indicator in zip(self.names, self.indicators):
+            if timings is not None:
+                start = time.perf_counter()
+            row.update(indicator.update(bar))
+            if timings is not None:
+                timings[name] = time.perf_counter() - start
+            for back, column, value in getattr(indicator, 'revisions', ()):
+                self.revisions.append((self.count - back, column, value))
+        self.count += 1
+        return row
+
+    def peek(self, bar, timings=None):
+        """
+        Provisional row for a bar that has not closed yet (an intrabar tick): the values update()
+        would return if the bar closed now, computed from the committed state without changing it.
+        O(1) per indicator like update(), nothing is copied; revisions are not reported.
+
+        Args:
+        - bar: dict with 'time', 'open', 'high', 'low', 'close' and 'volume' of the bar so far.
+        - timings: Optional dict filled with {indicator name: seconds spent}.
+
+        Returns:
+        - dict with the bar's base columns plus every indicator column.
+        """
+        row = {column: bar[column] for column in BASE_COLUMNS}
+        for name, indicator in zip(self.names, self.indicators):
+            if timings is not None:
+                start = time.perf_counter()
+            row.update(peek_indicator(indicator, bar))
+            if timings is not None:
+                timings[name] = time.perf_counter() - start
+        return row
+
+
+def iter_bars(df):
+    """
+    Yield the rows of a klines DataFrame as the bar dicts IndicatorEngine.update() expects.
+    """
+    for values in zip(*(df[column].tolist() for column in BASE_COLUMNS)):
+        yield dict(zip(BASE_COLUMNS, values))
@@ -0,0 +1,332 @@
+import numpy as np
+import pandas as pd
+
+from utils import (calculate_obv, calculate_ad_line, calculate_cci, calculate_support_resistance,
+                   add_heikin_ashi_columns, calculate_zig_zag)
+
+BASE_COLUMNS = ['time', 'open', 'high', 'low', 'close', 'volume']
+
+
+class Node:
+    """
+    One kernel of the indicator graph.
+
+    Args:
+    - name: unique key. Intermediates built from the same operation and parameters get the same
+      name, so they are registered and computed only once however many indicators read them.
+    - inputs: names of the nodes whose results are passed to compute, in order.
+    - compute: function of the input results. Intermediates return a Series, indicators return a
+      dict of output column -> values. None for the base columns, which are read from the DataFrame.
+    - columns: output columns of an indicator, None for intermediates.
+    """
+    def __init__(self, name, inputs, compute, columns=None):
+        self.name = name
+        self.inputs = inputs
+        self.compute = compute
+        self.columns = columns
+
+
+NODES = {}
+
+# Indicators in the order read_and_process_files has always added them to the DataFrame
+INDICATORS = {}
+
+
+def _register(name, inputs, compute, columns=None):
+    if name not in NODES:
+        NODES[name] = Node(name, inputs, compute, columns)
+    return name
+
+
+for _column in BASE_COLUMNS:
+    _register(_column, [], None)
+
+
+# Shared intermediates
+
+def _ewm(source, span):
+    return _register(f'ewm({source},{span})', [source], lambda s: s.ewm(span=span, adjust=False).mean())
+
+def _rolling_mean(source, window):
+    return _register(f'rolling_mean({source},{window})', [source], lambda s: s.rolling(window=window).mean())
+
+def _rolling_sum(source, window):
+    return _register(f'rolling_sum({source},{window})', [source], lambda s: s.rolling(window=window).sum())
+
+def _rolling_std(source, window):
+    return _register(f'rolling_std({source},{window})', [source], lambda s: s.rolling(window=window).std())
+
+def _rolling_max(source, window):
+    return _register(f'rolling_max({source},{window})', [source], lambda s: s.rolling(window=window).max())
+
+def _rolling_min(source, window):
+    return _register(f'rolling_min({source},{window})', [source], lambda s: s.rolling(window=window).min())
+
+def _shift(source, periods):
+    return _register(f'shift({source},{periods})', [source], lambda s: s.shift(periods))
+
+def _diff(source):
+    return _register(f'diff({source})', [source], lambda s: s.diff())
+
+def _product(left, right):
+    return _register(f'product({left},{right})', [left, right], lambda a, b: a * b)
+
+
+def _indicator(name, columns, inputs, compute):
+    INDICATORS[name] = _register(name, inputs, compute, columns)
+
+
+def _from_utils(function, inputs, columns, **kwargs):
+    """
+    Use a utils.py function as the kernel of an indicator that shares nothing with the others.
+    """
+    def compute(*series):
+        frame = function(pd.DataFrame(dict(zip(inputs, series))), **kwargs)
+        return {column: frame[column] for column in columns}
+    return compute
+
+
+# Indicators, mirroring the calculate_* functions in utils.py
+
+def _date(time):
+    return {'date': pd.to_datetime(time, unit='ms').dt.date}
+
+def _rsi(delta):
+    gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
+    loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
+    rs = gain / loss
+    return {'RSI': 100 - (100 / (1 + rs))}
+
+def _macd(ema_short, ema_long):
+    macd = ema_short - ema_long
+    return {'MACD': macd, 'MACD_Signal': macd.ewm(span=9, adjust=False).mean()}
+
+def _bollinger_bands(sma, std):
+    return {'Upper_BB': sma + (std * 2), 'Lower_BB': sma - (std * 2)}
+
+def _vwap(date, volume, price_volume):
+    cum_volume = volume.groupby(date['date']).cumsum()
+    cum_price_volume = price_volume.groupby(date['date']).cumsum()
+    return {'cum_volume': cum_volume, 'cum_price_volume': cum_price_volume, 'VWAP': cum_price_volume / cum_volume}
+
+def _stochastic_oscillator(close, low_min, high_max):
+    k = ((close - low_min) / (high_max - low_min)) * 100
+    return {'%K': k, '%D': k.rolling(window=3).mean()}
+
+def _atr(high, low, close_prev):
+    high_low = high - low
+    high_close = (high - close_prev).abs()
+    low_close = (low - close_prev).abs()
+    # fmax skips NaN exactly like DataFrame.max(axis=1) does on the first row
+    true_range = np.fmax(np.fmax(high_low, high_close), low_close)
+    return {'ATR': true_range.rolling(window=14).mean()}
+
+def _pivot_points(high_prev, low_prev, close_prev):
+    pp = (high_prev + low_prev + close_prev) / 3
+    return {
+        'PP': pp,
+        'R1': (2 * pp) - low_prev,
+        'S1': (2 * pp) - high_prev,
+        'R2': pp + (high_prev - low_prev),
+        'S2': pp - (high_prev - low_prev),
+    }
+
+def _fibonacci_retracement(highest_price, lowest_price):
+    price_range = highest_price - lowest_price
+    return {
+        'Fib_23_6': highest_price - (price_range * 0.236),
+        'Fib_38_2': highest_price - (price_range * 0.382),
+        'Fib_50': highest_price - (price_range * 0.5),
+        'Fib_61_8': highest_price - (price_range * 0.618),
+        'Fib_78_6': highest_price - (price_range * 0.786),
+    }
+
+def _ppo(ema_short, ema_long):
+    ppo = ((ema_short - ema_long) / ema_long) * 100
+    return {'ppo': ppo, 'ppo_signal': ppo.ewm(span=9, adjust=False).mean()}
+
+def _ichimoku_cloud(close, high_9, low_9, high_26, low_26, high_52, low_52):
+    tenkan_sen = (high_9 + low_9) / 2
+    kijun_sen = (high_26 + low_26) / 2
+    return {
+        'tenkan_sen': tenkan_sen,
+        'kijun_sen': kijun_sen,
+        'senkou_span_a': ((tenkan_sen + kijun_sen) / 2).shift(26),
+        'senkou_span_b': ((high_52 + low_52) / 2).shift(26),
+        'chikou_span': close.shift(-26),
+    }
+
+def _zig_zag(close):
+    return {'zig_zag': calculate_zig_zag(pd.DataFrame({'close': close}), percentage=5).ffill()}
+
+
+_indicator('date', ['date'], ['time'], _date)
+_indicator('5_ema', ['5_EMA'], [_ewm('close', 5)], lambda ema: {'5_EMA': ema})
+_indicator('10_sma', ['10_SMA'], [_rolling_mean('close', 10)], lambda sma: {'10_SMA': sma})
+_indicator('rsi', ['RSI'], [_diff('close')], _rsi)
+_indicator('macd', ['MACD', 'MACD_Signal'], [_ewm('close', 12), _ewm('close', 26)], _macd)
+_indicator('bollinger_bands', ['Upper_BB', 'Lower_BB'],
+           [_rolling_mean('close', 20), _rolling_std('close', 20)], _bollinger_bands)
+_indicator('vwap', ['cum_volume', 'cum_price_volume', 'VWAP'],
+           ['date', 'volume', _product('close', 'volume')], _vwap)
+_indicator('obv', ['OBV'], ['close', 'volume'], _from_utils(calculate_obv, ['close', 'volume'], ['OBV']))
+_indicator('stochastic_oscillator', ['%K', '%D'],
+           ['close', _rolling_min('low', 14), _rolling_max('high', 14)], _stochastic_oscillator)
+_indicator('atr', ['ATR'], ['high', 'low', _shift('close', 1)], _atr)
+_indicator('ad_line', ['AD_Line'], ['high', 'low', 'close', 'volume'],
+           _from_utils(calculate_ad_line, ['high', 'low', 'close', 'volume'], ['AD_Line']))
+_indicator('cci', ['CCI'], ['high', 'low', 'close'],
+           _from_utils(calculate_cci, ['high', 'low', 'close'], ['CCI']))
+_indicator('pivot_points', ['PP', 'R1', 'S1', 'R2', 'S2'],
+           [_shift('high', 1), _shift('low', 1), _shift('close', 1)], _pivot_points)
+_indicator('momentum', ['Momentum'], ['close', _shift('close', 14)],
+           lambda close, close_prev: {'Momentum': close - close_prev})
+_indicator('standard_deviation', ['Std_Dev'], [_rolling_std('close', 20)], lambda std: {'Std_Dev': std})
+_indicator('fibonacci_retracement', ['Fib_23_6', 'Fib_38_2', 'Fib_50', 'Fib_61_8', 'Fib_78_6'],
+           [_rolling_max('high', 14), _rolling_min('low', 14)], _fibonacci_retracement)
+_indicator('roc', ['ROC'], ['close', _shift('close', 14)],
+           lambda close, close_prev: {'ROC': ((close - close_prev) / close_prev) * 100})
+_indicator('support_resistance', ['Resistance', 'Support'], ['high', 'low'],
+           _from_utils(calculate_support_resistance, ['high', 'low'], ['Resistance', 'Support']))
+_indicator('vwma', ['vwma'], [_rolling_sum(_product('close', 'volume'), 20), _rolling_sum('volume', 20)],
+           lambda sum_price_volume, sum_volume: {'vwma': sum_price_volume / sum_volume})
+_indicator('ppo', ['ppo', 'ppo_signal'], [_ewm('close', 12), _ewm('close', 26)], _ppo)
+_indicator('ichimoku_cloud', ['tenkan_sen', 'kijun_sen', 'senkou_span_a', 'senkou_span_b', 'chikou_span'],
+           ['close', _rolling_max('high', 9), _rolling_min('low', 9), _rolling_max('high', 26),
+            _rolling_min('low', 26), _rolling_max('high', 52), _rolling_min('low', 52)], _ichimoku_cloud)
+_indicator('heikin_ashi', ['ha_close', 'ha_open', 'ha_high', 'ha_low'], ['open', 'high', 'low', 'close'],
+           _from_utils(add_heikin_ashi_columns, ['open', 'high', 'low', 'close'],
+                       ['ha_close', 'ha_open', 'ha_high', 'ha_low']))
+_indicator('elder_ray_index', ['bull_power', 'bear_power'], ['high', 'low', _ewm('close', 13)],
+           lambda high, low, ema_close: {'bull_power': high - ema_close, 'bear_power': low - ema_close})
+_indicator('zig_zag', ['zig_zag'], ['close'], _zig_zag)
+
+ALL_INDICATORS = list(INDICATORS)
+
+# Relative cost of indicators that are much slower than one vectorized kernel
+INDICATOR_COSTS = {'zig_zag': 40}
+
+# Output column -> indicator producing it
+COLUMN_INDICATORS = {column: name for name in INDICATORS for column in NODES[name].columns}
+
+
+def plan_indicators(indicators):
+    """
+    Resolve the kernels needed for the requested indicators.
+
+    Args:
+    - indicators: indicator names (keys of INDICATORS).
+
+    Returns:
+    - node names in execution order: every dependency appears once, before the nodes reading it.
+    """
+    order = []
+    seen = set()
+
+    def visit(name):
+        if name in seen:
+            return
+        if name not in NODES:
+            raise KeyError(f"Unknown indicator or node: {name}")
+        seen.add(name)
+        for dependency in NODES[name].inputs:
+            visit(dependency)
+        order.append(name)
+
+    for name in indicators:
+        visit(name)
+    return order
+
+
+def resolve_indicators(indicators):
+    """
+    Requested indicators plus the indicators they depend on, in INDICATORS order.
+    """
+    planned = set(plan_indicators(indicators))
+    return [name for name in INDICATORS if name in planned]
+
+
+def split_indicators(indicators, groups):
+    """
+    Split indicators into at most `groups` lists that share no kernels, so each list can be
+    computed independently (e.g. in another process) without computing anything twice.
+
+    Indicators reading a common intermediate always land in the same list; the lists are then
+    balanced by their number of kernels (INDICATOR_COSTS for the ones that are Python loops).
+    """
+    names = resolve_indicators(indicators)
+    parent = {name: name for name in names}
+
+    def find(name):
+        while parent[name] != name:
+            name = parent[name]
+        return name
+
+    owner = {}
+    for name in names:
+        for node in plan_indicators([name]):
+            if node in BASE_COLUMNS:
+                continue
+            if node in owner:
+                parent[find(name)] = find(owner[node])
+            else:
+                owner[node] = name
+
+    components = {}
+    for name in names:
+        components.setdefault(find(name), []).append(name)
+
+    def cost(component):
+        return sum(INDICATOR_COSTS.get(node, 1) for node in plan_indicators(component) if node not in BASE_COLUMNS)
+
+    buckets = [[] for _ in range(max(1, min(groups, len(components))))]
+    loads = [0] * len(buckets)
+    for component in sorted(components.values(), key=cost, reverse=True):
+        lightest = loads.index(min(loads))
+        buckets[lightest].extend(component)
+        loads[lightest] += cost(component)
+    return [[name for name in INDICATORS if name in bucket] for bucket in buckets if bucket]
+
+
+def indicators_for_columns(columns):
+    """
+    Indicators that produce the requested output columns. Base columns need no indicator.
+    """
+    unknown = [column for column in columns if column not in COLUMN_INDICATORS and column not in BASE_COLUMNS]
+    if unknown:
+        raise KeyError(f"No indicator produces columns: {', '.join(unknown)}")
+    requested = {COLUMN_INDICATORS[column] for column in columns if column in COLUMN_INDICATORS}
+    return [name for name in INDICATORS if name in requested]
+
+
+def compute_indicators(df, indicators=ALL_INDICATORS, columns=None):
+    """
+    Add the columns of the requested indicators to the DataFrame, running each shared kernel once.
+
+    Args:
+    - df (pd.DataFrame): klines with the BASE_COLUMNS.
+    - indicators: indicator names to compute, all of them by default.
+    - columns: if given, only these output columns are stored. The indicators producing them and
+      everything they depend on are computed, and the `indicators` argument is ignored.
+
+    Returns:
+    - df (pd.DataFrame): the same DataFrame with the indicator columns added, in the same order
+      the calculate_* functions would have added them.
+    """
+    if columns is not None:
+        indicators = indicators_for_columns(columns)
+
+    results = {}
+    for name in plan_indicators(indicators):
+        node = NODES[name]
+        if node.compute is None:
+            results[name] = df[name]
+        else:
+            results[name] = node.compute(*(results[dependency] for dependency in node.inputs))
+
+    for name in INDICATORS:
+        if name in results:
+            for column, values in results[name].items():
+                if columns is None or column in columns:
+                    df[column] = values
+    return df
@@ -0,0 +1,51 @@
+import numpy as np
+
+# One row per kline: open time in epoch milliseconds and OHLCV prices/volume
+KLINE_DTYPE = np.dtype([
+    ('time', np.int64),
+    ('open', np.float64),
+    ('high', np.float64),
+    ('low', np.float64),
+    ('close', np.float64),
+    ('volume', np.float64),
+])
+
+# Fields per kline in a REST klines response:
+# [open time, open, high, low, close, volume, close time, quote volume, trades, taker base, taker quote, ignore]
+REST_KLINE_FIELDS = 12
+
+# Removing brackets and quotes turns a klines response into a flat comma-separated list of numbers
+_REST_STRIP = b'[]"'
+
+
+def decode_klines(payload, out=None):
+    """
+    Decode a REST klines response straight into a structured array, without building Python
+    objects per kline: the numbers are parsed by numpy from the raw bytes.
+
+    Args:
+    - payload: response body (bytes or str), a JSON array of klines.
+    - out: optional preallocated KLINE_DTYPE array (or slice of one) to write into; it must
+      have room for every kline of the response.
+
+    Returns:
+    - KLINE_DTYPE array with the decoded klines (a view of `out` when given).
+    """
+    if isinstance(payload, str):
+        payload = payload.encode()
+    numbers = payload.translate(None, _REST_STRIP).strip()
+    values = np.fromstring(numbers, dtype=np.float64, sep=',') if numbers else np.empty(0)
+    if len(values) % REST_KLINE_FIELDS:
+        raise ValueError(f"Klines payload has {len(values)} numbers, not a multiple of {REST_KLINE_FIELDS}")
+    values = values.reshape(-1, REST_KLINE_FIELDS)
+
+    if out is None:
+        out = np.empty(len(values), dtype=KLINE_DTYPE)
+    elif len(out) < len(values):
+        raise ValueError(f"Output array has room for {len(out)} klines, the payload has {len(values)}")
+    out = out[:len(values)]
+    # Open times are below 2**53 and therefore exact as float64
+    out['time'] = values[:, 0]
+    for index, field in enumerate(KLINE_DTYPE.names[1:], start=1):
+        out[field] = values[:, index]
+    return out
@@ -1,8 +1,30 @@
 from binance import AsyncClient, BinanceSocketManager
 import asyncio
+import json
+import random
+import time
+
 import aiohttp
 
-async def fetch_historical_klines(symbol, interval, limit=1000):
+from kline_decoding import decode_klines
+from metrics import SampledLogger
+from http_client import (get_client, fetch_klines_window, BASE_URL, STREAM_URL, EXCHANGE_INFO_PATH,
+                         EXCHANGE_INFO_REQUEST_WEIGHT)
+
+# Streams subscribed per websocket connection (Binance allows up to 1024, the URL gets long)
+STREAMS_PER_CONNECTION = 200
+
+# Dropped websocket connections are reopened after a random delay of up to a backoff that
+# doubles from RECONNECT_BACKOFF_SECONDS to RECONNECT_MAX_BACKOFF_SECONDS while attempts fail
+RECONNECT_BACKOFF_SECONDS = 1
+RECONNECT_MAX_BACKOFF_SECONDS = 60
+# Ping interval, a connection that does not answer is considered dropped
+HEARTBEAT_SECONDS = 30
+
+# Sampled structured log of the websocket messages, instead of printing each one
+message_log = SampledLogger()
+
+async def fetch_historical_klines(symbol, interval, limit=1000, end_time=None, start_time=None, base_url=BASE_URL):
     """
     Fetch historical klines for a given symbol and interval up to the current moment.
     
@@ -10,24 +32,61 @@ async def fetch_historical_klines(symbol, interval, limit=1000):
     - symbol: The symbol to fetch klines for (e.g., "BTCUSDT").
     - interval: The kline interval (e.g., "1m").
     - limit: The maximum number of data points to fetch. Defaults to 1000 or the maximum allowed by the API.
+    - end_time: Optional open time (epoch ms) of the last kline to fetch instead of the current moment.
+      Requests ending in a closed kline are served from the disk cache when repeated.
+    - start_time: Optional open time (epoch ms) of the first kline to fetch; the `limit` klines from
+      there are returned instead of the last `limit` ones.
+    - base_url: Exchange REST endpoint, e.g. a local fake_exchange.py server.
     
     Returns:
-    - A list of kline data.
+    - A list of kline data. A request still failing after the retries (rate limits, server
+      errors, see http_client.fetch_klines_window) raises RuntimeError.
+    """
+    body = await fetch_historical_klines_body(symbol, interval, limit, end_time, start_time, base_url)
+    return json.loads(body)
+
+async def fetch_historical_klines_array(symbol, interval, limit=1000, end_time=None, start_time=None, base_url=BASE_URL):
     """
-    url = "https://api.binance.com/api/v3/klines"  # Adjust based on your data source
+    Same request as fetch_historical_klines, decoded straight into a kline_decoding.KLINE_DTYPE
+    structured array (int64 open time, float64 OHLCV) instead of lists of strings.
+    """
+    return decode_klines(await fetch_historical_klines_body(symbol, interval, limit, end_time, start_time, base_url))
+
+async def fetch_historical_klines_body(symbol, interval, limit=1000, end_time=None, start_time=None, base_url=BASE_URL):
+    # Every REST call goes through the shared client: pooled keep-alive connections and disk cache
     params = {
         'symbol': symbol,
         'interval': interval,
         'limit': limit
     }
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, params=params) as response:
-            if response.status == 200:
-                data = await response.json()
-                return data
-            else:
-                print("Failed to fetch historical klines")
-                return []
+    if start_time is not None:
+        params['startTime'] = start_time
+    if end_time is not None:
+        params['endTime'] = end_time
+    # Retried on rate limits (pausing the shared limiter for Retry-After) and server errors,
+    # raises RuntimeError once the retries are used up instead of returning no klines
+    return await fetch_klines_window(get_client(base_url), params)
+
+async def fetch_symbols(quote_asset='USDT', base_url=BASE_URL):
+    """
+    Fetch every symbol currently trading against a quote asset.
+
+    Args:
+    - quote_asset: The quote asset (e.g., "USDT").
+    - base_url: Exchange REST endpoint.
+
+    Returns:
+    - A sorted list of symbols (e.g., ["BTCUSDT", "ETHUSDT", ...]).
+    """
+    client = get_client(base_url)
+    status, _, body = await client.get(EXCHANGE_INFO_PATH, {}, weight=EXCHANGE_INFO_REQUEST_WEIGHT)
+    if status != 200:
+        print("Failed to fetch exchange info")
+        return []
+    return sorted(
+        info['symbol'] for info in json.loads(body)['symbols']
+        if info['quoteAsset'] == quote_asset and info['status'] == 'TRADING'
+    )
 
 # Usage example (omitting start_str since we're fetching the maximum data allowed):
 # historical_klines = await fetch_historical_klines("BTCUSDT", "1m", 1000)
@@ -40,9 +99,75 @@ async def fetch_klines(symbol, interval, queue):
     async with bm.kline_socket(symbol=symbol, interval=interval) as stream:
         while True:
             res = await stream.recv()
-            print(res)
             kline = res['k']
+            message_log.log('kline', symbol=kline['s'], interval=kline['i'], open_time=kline['t'], closed=kline['x'])
             if kline['x']:  # If the kline is closed
                 await queue.put(kline)  # Emit the kline data to the queue
 
     await client.close_connection()
+
+
+async def fetch_multiplexed_klines(streams, router, streams_per_connection=STREAMS_PER_CONNECTION, stream_url=STREAM_URL):
+    """
+    Subscribe to many kline streams over a few combined-stream connections and hand every
+    kline update to the router (closed klines are committed, unclosed ones are intrabar ticks).
+
+    Args:
+    - streams: Stream names (see live_streams.stream_name).
+    - router: live_streams.StreamRouter the klines are routed to.
+    - streams_per_connection: Maximum streams multiplexed over one websocket connection.
+    - stream_url: Websocket endpoint, e.g. a local fake_exchange.py server.
+    """
+    streams = list(streams)
+    # Websockets get their own session, they would hold connections of the REST pool forever
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(
+            read_combined_stream(session, stream_url, streams[start:start + streams_per_connection], router)
+            for start in range(0, len(streams), streams_per_connection)
+        ))
+
+
+async def read_combined_stream(session, stream_url, streams, router):
+    """
+    Keep one combined-stream connection open for good. When it drops it is reopened with jittered
+    exponential backoff, and the closed klines missed meanwhile are fetched over REST and queued
+    (router.backfill) ahead of the live klines of the new connection.
+    """
+    url = f"{stream_url}/stream?streams={'/'.join(streams)}"
+    failures = 0
+    connected = False
+    while True:
+        try:
+            async with session.ws_connect(url, max_msg_size=0, heartbeat=HEARTBEAT_SECONDS) as ws:
+                if connected:
+                    # Live klines are held back by the router until the missed ones are queued
+                    repairing = router.backfill(streams)
+                    print(f"Reconnected {len(streams)} streams, backfilling {repairing}")
+                connected = True
+                async for message in ws:
+                    if message.type != aiohttp.WSMsgType.TEXT:
+                        break
+                    failures = 0
+                    received = time.time()
+                    try:
+                        res = json.loads(message.data)
+                        # Combined stream messages are {"stream": "<symbol>@kline_<interval>", "data": <kline event>}
+                        if 'data' not in res:
+                            continue
+                        name = res['stream']
+                        kline = res['data']['k']
+                        message_log.log('kline', stream=name, open_time=kline['t'], closed=kline['x'])
+                    except (ValueError, KeyError, TypeError) as error:
+                        # One malformed frame must not take the connection down, a kline it held is
+                        # backfilled when the next one of its stream arrives after the gap
+                        print(f"Skipping malformed websocket message: {error!r}")
+                        continue
+                    # Unclosed klines too, the router evaluates them provisionally when asked to
+                    await router.route(name, kline, received)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            print(f"Websocket error: {error!r}")
+        failures += 1
+        backoff = min(RECONNECT_MAX_BACKOFF_SECONDS, RECONNECT_BACKOFF_SECONDS * 2 ** (failures - 1))
+        delay = random.uniform(0, backoff)
+        print(f"Websocket closed, reconnecting in {delay:.1f}s")
+        await asyncio.sleep(delay)
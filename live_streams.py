@@ -0,0 +1,766 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import os
+import pickle
+import random
+import time
+
+from indicator_engine import IndicatorEngine, LIVE_INDICATORS
+from resample import bucket_ends
+from ring_buffer import KlineRingBuffer
+
+# Closed klines waiting to be processed, per stream
+STREAM_QUEUE_SIZE = 64
+# What routing does when a stream's queue is full:
+# 'block' waits for room (slows down the whole connection), 'drop_oldest' discards the oldest queued
+# tick marker to make room and waits like 'block' when only closed klines are queued: a closed kline
+# is never dropped, the indicators would run across the missing bar
+QUEUE_FULL_POLICY = 'block'
+QUEUE_FULL_POLICIES = ('block', 'drop_oldest')
+
+# Where indicators and strategies run, off the event loop:
+# 'thread' keeps stream state in this process (limited by the GIL),
+# 'process' keeps each stream's state in one worker process so symbols compute in parallel
+COMPUTE_EXECUTOR = 'thread'
+COMPUTE_EXECUTORS = ('thread', 'process')
+COMPUTE_WORKERS = os.cpu_count() or 1
+
+# Warm start: closed bars loaded in one request when a stream has no snapshot
+WARMUP_BARS = 1000
+# Maximum klines per REST request when backfilling the bars missed since a snapshot
+BACKFILL_LIMIT = 1000
+# Indicator and position state of every stream is pickled here, one file per stream
+SNAPSHOT_DIRECTORY = "snapshots"
+SNAPSHOT_SECONDS = 60
+# Written ahead of every snapshot; bump it when StreamState, the ring buffer or the indicator
+# classes change layout, older snapshots are then ignored instead of restored
+SNAPSHOT_VERSION = 1
+# A failed warm start or backfill is retried after a random delay of up to a backoff doubling
+# from BACKFILL_RETRY_SECONDS to BACKFILL_MAX_RETRY_SECONDS, for as long as it keeps failing
+BACKFILL_RETRY_SECONDS = 1
+BACKFILL_MAX_RETRY_SECONDS = 60
+
+
+# Queued in place of an unclosed kline, the consumer reads the stream's latest tick instead
+_TICK = (None, None)
+
+
+def stream_name(symbol, interval):
+    """
+    Name of a kline stream in Binance combined streams (e.g. "btcusdt@kline_1m").
+    """
+    return f"{symbol.lower()}@kline_{interval}"
+
+
+def kline_to_bar(kline):
+    """
+    Convert a websocket kline payload ('k' of a kline event) into the bar dict IndicatorEngine expects.
+    """
+    return {
+        'time': kline['t'],
+        'open': float(kline['o']),
+        'high': float(kline['h']),
+        'low': float(kline['l']),
+        'close': float(kline['c']),
+        'volume': float(kline['v'])
+    }
+
+
+def snapshot_path(name, directory=SNAPSHOT_DIRECTORY):
+    return os.path.join(directory, f"{name}.pkl")
+
+
+class StreamState:
+    """
+    Compute state of one symbol/interval stream: its indicator engine, the ring buffer with its
+    most recent rows and its open positions. Only ever touched by one thread or worker process
+    at a time; the whole state is picklable, which is what snapshots are.
+    """
+    def __init__(self, symbol, interval, capacity, indicators=LIVE_INDICATORS):
+        self.symbol = symbol
+        self.interval = interval
+        self.engine = IndicatorEngine(indicators)
+        self.store = KlineRingBuffer(self.engine.columns, capacity)
+        self.positions = []
+        self.last_time = None  # open time of the last processed bar
+
+    def add_bar(self, bar, timings=None):
+        """
+        Run a bar through the indicators and store the resulting row.
+        Bars at or before the last processed one (overlapping backfill) are skipped.
+
+        Returns:
+        - False if the bar was skipped.
+        """
+        if self.last_time is not None and bar['time'] <= self.last_time:
+            return False
+        self.store.append(self.engine.update(bar, timings))
+        for position, column, value in self.engine.revisions:
+            self.store.update(position, column, value)
+        self.last_time = bar['time']
+        return True
+
+    def warm_up(self, klines):
+        """
+        Bring the indicators up to date with closed klines in bulk, without calling strategies.
+
+        Args:
+        - klines: kline_decoding.KLINE_DTYPE array, oldest first.
+
+        Returns:
+        - Open time of the last processed bar.
+        """
+        columns = [klines[column].tolist() for column in ('time', 'open', 'high', 'low', 'close', 'volume')]
+        for time_, open_, high, low, close, volume in zip(*columns):
+            self.add_bar({'time': time_, 'open': open_, 'high': high, 'low': low, 'close': close, 'volume': volume})
+        return self.last_time
+
+    def process(self, kline, on_kline=None):
+        """
+        Run a closed kline through the indicators, store the resulting row and call `on_kline`.
+
+        Returns:
+        - (what `on_kline` returned or None, {indicator name or 'strategy': seconds spent}),
+          timings are None when the kline was already processed.
+        """
+        timings = {}
+        if not self.add_bar(kline_to_bar(kline), timings):
+            return None, None
+        result = None
+        if on_kline is not None:
+            start = time.perf_counter()
+            result = on_kline(self)
+            timings['strategy'] = time.perf_counter() - start
+        return result, timings
+
+    def peek(self, kline, on_tick=None):
+        """
+        Evaluate an unclosed kline provisionally: its indicator values are computed from the
+        committed state (IndicatorEngine.peek) and handed to `on_tick` with the state, nothing
+        is stored. The kline is committed by process() once it closes.
+
+        Returns:
+        - (what `on_tick` returned or None, {indicator name or 'strategy': seconds spent}),
+          timings are None when the kline was already committed or does not follow the state.
+        """
+        bar = kline_to_bar(kline)
+        if self.last_time is not None and bar['time'] <= self.last_time:
+            return None, None
+        # A tick of a later bar (a stale marker read after newer ticks) would be evaluated on
+        # state missing the bars in between, it is left to the marker queued behind them
+        if self.last_time is not None and bar['time'] > bucket_ends([self.last_time], self.interval)[0]:
+            return None, None
+        timings = {}
+        row = self.engine.peek(bar, timings)
+        result = None
+        if on_tick is not None:
+            start = time.perf_counter()
+            result = on_tick(self, row)
+            timings['strategy'] = time.perf_counter() - start
+        return result, timings
+
+    def frame(self):
+        """
+        Zero-copy DataFrame of the retained rows, only valid until the next kline is processed.
+        """
+        return self.store.frame()
+
+    def save(self, path):
+        """
+        Snapshot the state to `path` (written to a temporary file first, then replaced).
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as snapshot_file:
+            pickle.dump(SNAPSHOT_VERSION, snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(self, snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """
+        Restore the state from a snapshot written by save().
+
+        Returns:
+        - Open time of the last bar in the snapshot, or None when there is no usable snapshot
+          (missing, unreadable, from another SNAPSHOT_VERSION, or taken with other indicators
+          or retention).
+        """
+        try:
+            with open(path, 'rb') as snapshot_file:
+                version = pickle.load(snapshot_file)
+                if version != SNAPSHOT_VERSION:
+                    # Also the case of snapshots from before versioning, which start with the state
+                    print(f"Ignoring snapshot {path}: not a version {SNAPSHOT_VERSION} snapshot")
+                    return None
+                snapshot = pickle.load(snapshot_file)
+        except FileNotFoundError:
+            return None
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError, IndexError, TypeError, ValueError) as error:
+            # Truncated or corrupt file, or classes that changed since it was written
+            print(f"Ignoring snapshot {path}: {error!r}")
+            return None
+        if not isinstance(snapshot, StreamState):
+            return None
+        if snapshot.engine.columns != self.engine.columns or snapshot.store.capacity != self.store.capacity:
+            return None
+        self.__dict__.update(snapshot.__dict__)
+        return self.last_time
+
+
+# Stream states owned by this worker process (COMPUTE_EXECUTOR = 'process')
+_worker_states = {}
+
+
+def call_in_worker(name, symbol, interval, capacity, indicators, method, args):
+    state = _worker_states.get(name)
+    if state is None:
+        state = _worker_states[name] = StreamState(symbol, interval, capacity, indicators)
+    return getattr(state, method)(*args)
+
+
+class StreamCompute:
+    """
+    Runs stream processing in executors so the event loop only does I/O and handoff.
+
+    With 'thread' the states live in this process and share one thread pool. With 'process'
+    every stream is pinned to one single-process pool that owns its state, so a stream's klines
+    are always processed in order by the same process and different streams run in parallel.
+    on_kline must then be a picklable (module-level) function.
+
+    Args:
+    - executor: 'thread' or 'process'.
+    - workers: Threads or worker processes.
+    """
+    def __init__(self, executor=COMPUTE_EXECUTOR, workers=COMPUTE_WORKERS):
+        if executor not in COMPUTE_EXECUTORS:
+            raise ValueError(f"executor must be one of {', '.join(COMPUTE_EXECUTORS)}")
+        self.executor = executor
+        self.workers = workers
+        if executor == 'thread':
+            self.pools = [ThreadPoolExecutor(max_workers=workers)]
+        else:
+            self.pools = [ProcessPoolExecutor(max_workers=1) for _ in range(workers)]
+        self.assigned = 0
+
+    def assign(self):
+        """
+        Worker for a new stream, round robin.
+        """
+        worker = self.assigned % len(self.pools)
+        self.assigned += 1
+        return worker
+
+    async def call(self, stream, method, *args):
+        """
+        Call a StreamState method of the stream where its state lives, one call per stream at a time.
+        """
+        loop = asyncio.get_running_loop()
+        pool = self.pools[stream.worker]
+        async with stream.lock:
+            if self.executor == 'thread':
+                return await loop.run_in_executor(pool, getattr(stream.state, method), *args)
+            return await loop.run_in_executor(
+                pool, call_in_worker, stream.name, stream.symbol, stream.interval,
+                stream.capacity, stream.indicators, method, args
+            )
+
+    async def process(self, stream, kline, on_kline):
+        return await self.call(stream, 'process', kline, on_kline)
+
+    async def peek(self, stream, kline, on_tick):
+        return await self.call(stream, 'peek', kline, on_tick)
+
+    def shutdown(self):
+        for pool in self.pools:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def closed_klines(klines, interval):
+    """
+    The klines of a REST response that have closed (the last one is usually still open).
+    """
+    return klines[bucket_ends(klines['time'], interval) <= int(time.time() * 1000)]
+
+
+async def fetch_closed_klines_since(fetch_klines, symbol, interval, last_time):
+    """
+    Yield the closed klines opened after `last_time` (epoch ms), BACKFILL_LIMIT per request.
+    """
+    while True:
+        klines = await fetch_klines(symbol, interval, BACKFILL_LIMIT, start_time=last_time + 1)
+        closed = closed_klines(klines, interval)
+        if len(closed):
+            yield closed
+            last_time = int(closed['time'][-1])
+        if len(klines) < BACKFILL_LIMIT or not len(closed):
+            return
+
+
+def array_to_klines(klines, symbol, interval):
+    """
+    Closed websocket kline payloads ('k' of a kline event) for a kline_decoding.KLINE_DTYPE array.
+    """
+    close_times = bucket_ends(klines['time'], interval) - 1
+    columns = [klines[column].tolist() for column in ('time', 'open', 'high', 'low', 'close', 'volume')]
+    for (open_time, open_, high, low, close, volume), close_time in zip(zip(*columns), close_times.tolist()):
+        yield {
+            't': open_time, 'T': close_time, 's': symbol, 'i': interval,
+            'o': repr(open_), 'h': repr(high), 'l': repr(low), 'c': repr(close), 'v': repr(volume),
+            'x': True
+        }
+
+
+def retry_delay(failures):
+    """
+    Random delay in seconds before retrying a REST fetch that failed `failures` times in a row.
+    """
+    return random.uniform(0, min(BACKFILL_MAX_RETRY_SECONDS, BACKFILL_RETRY_SECONDS * 2 ** (failures - 1)))
+
+
+def follows_gap(stream, kline):
+    """
+    Whether klines are missing between the stream's last closed kline and this closed kline.
+    """
+    if stream.last_closed is None:
+        return False
+    return kline['t'] > bucket_ends([stream.last_closed], stream.interval)[0]
+
+
+class StreamQueue(asyncio.Queue):
+    """
+    asyncio.Queue of a stream's closed klines and tick markers that can give up a tick marker.
+    """
+    def drop_tick(self):
+        """
+        Remove the oldest queued tick marker.
+
+        Returns:
+        - False if no tick marker was queued.
+        """
+        try:
+            self._queue.remove(_TICK)
+        except ValueError:
+            return False
+        self.task_done()
+        return True
+
+
+class KlineStream:
+    """
+    One symbol/interval stream as the event loop sees it: its bounded queue of closed klines,
+    backpressure metrics and where its state lives (`state` in this process, or `worker`).
+    """
+    def __init__(self, symbol, interval, capacity, indicators=LIVE_INDICATORS, queue_size=STREAM_QUEUE_SIZE,
+                 worker=0, local=True):
+        self.symbol = symbol
+        self.interval = interval
+        self.name = stream_name(symbol, interval)
+        self.capacity = capacity
+        self.indicators = indicators
+        self.worker = worker
+        self.state = StreamState(symbol, interval, capacity, indicators) if local else None
+        self.queue = StreamQueue(maxsize=queue_size)
+        self.lock = asyncio.Lock()  # serializes executor calls on the state
+        # Latest unclosed kline and whether a marker for it is waiting in the queue
+        self.tick = None
+        self.tick_queued = False
+        self.last_closed = None  # open time of the last closed kline routed (or warmed up)
+        # Closed klines held back, in arrival order, while `repair` fetches the klines missed before
+        # them (or warms the stream up, see StreamRouter.warm_start())
+        self.pending = []
+        self.repair = None
+        # Backpressure metrics
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0  # tick markers evicted by 'drop_oldest' to queue a closed kline
+        self.blocked = 0
+        self.blocked_seconds = 0.0
+        self.max_depth = 0
+        self.ticks = 0
+        self.ticks_coalesced = 0
+        self.ticks_dropped = 0
+        self.duplicates = 0
+        self.gaps = 0
+        self.backfilled = 0
+
+    def frame(self):
+        """
+        Zero-copy DataFrame of the retained rows (state kept in this process only).
+        """
+        if self.state is None:
+            raise RuntimeError(f"The state of {self.name} lives in a worker process, "
+                               f"use `await router.frame(name)` to get a copy of its rows")
+        return self.state.frame()
+
+    def metrics(self):
+        return {
+            'received': self.received,
+            'processed': self.processed,
+            'depth': self.queue.qsize(),
+            'max_depth': self.max_depth,
+            'dropped': self.dropped,
+            'blocked': self.blocked,
+            'blocked_seconds': round(self.blocked_seconds, 3),
+            'ticks': self.ticks,
+            'ticks_coalesced': self.ticks_coalesced,
+            'ticks_dropped': self.ticks_dropped,
+            'duplicates': self.duplicates,
+            'gaps': self.gaps,
+            'pending': len(self.pending),
+            'backfilled': self.backfilled
+        }
+
+
+class StreamRouter:
+    """
+    Routes closed klines from multiplexed websocket connections to per-stream state.
+
+    Each stream has its own bounded queue and consumer task, so a slow stream only delays
+    itself until its queue is full; what happens then is set by `overflow` (see QUEUE_FULL_POLICY).
+
+    With `on_tick`, unclosed klines are evaluated provisionally too. Only the latest one of a
+    stream matters, so at most one waits in its queue (later ticks replace it) and ticks are
+    dropped rather than waited for when the queue is full.
+
+    Args:
+    - capacity: Rows retained per stream (ring buffer capacity).
+    - indicators: Indicators computed for every stream.
+    - queue_size: Maximum closed klines waiting per stream.
+    - overflow: 'block' or 'drop_oldest' (see QUEUE_FULL_POLICY).
+    - on_kline: Optional callback called with the StreamState after each processed kline (strategies),
+      in the compute executor.
+    - compute: StreamCompute running the indicators and on_kline (a thread pool by default).
+    - metrics: Optional metrics.LatencyMetrics the per-stage latencies are recorded in.
+    - on_tick: Optional callback called with the StreamState and the provisional row of each
+      unclosed kline, in the compute executor. Unclosed klines are ignored without it.
+    - fetch_klines: Optional REST fetch function (see warm_start()) used to backfill missed klines,
+      after reconnects and whenever a closed kline does not follow the previous one.
+    """
+    def __init__(self, capacity, indicators=LIVE_INDICATORS, queue_size=STREAM_QUEUE_SIZE,
+                 overflow=QUEUE_FULL_POLICY, on_kline=None, compute=None, metrics=None, on_tick=None,
+                 fetch_klines=None):
+        if overflow not in QUEUE_FULL_POLICIES:
+            raise ValueError(f"overflow must be one of {', '.join(QUEUE_FULL_POLICIES)}")
+        self.capacity = capacity
+        self.indicators = indicators
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.on_kline = on_kline
+        self.on_tick = on_tick
+        self.fetch_klines = fetch_klines
+        self.compute = compute if compute is not None else StreamCompute()
+        self.latency = metrics
+        self.streams = {}  # stream name -> KlineStream
+
+    def add(self, symbol, interval):
+        name = stream_name(symbol, interval)
+        if name not in self.streams:
+            self.streams[name] = KlineStream(
+                symbol, interval, self.capacity, self.indicators, self.queue_size,
+                worker=self.compute.assign(), local=self.compute.executor == 'thread'
+            )
+        return self.streams[name]
+
+    async def route(self, name, kline, received=None):
+        """
+        Queue a kline for the stream called `name`; klines of unknown streams are ignored.
+        `received` is the epoch time (seconds) the message came off the websocket.
+        """
+        stream = self.streams.get(name)
+        if stream is None:
+            return
+        if not kline['x']:
+            # Provisional evaluation needs the committed state, which lags behind during a repair
+            if stream.repair is None:
+                self.route_tick(stream, kline, received)
+            return
+        if stream.repair is not None:
+            stream.pending.append((kline, received))
+            return
+        if follows_gap(stream, kline):
+            stream.gaps += 1
+            if self.fetch_klines is not None:
+                # A kline was missed (e.g. frames lost before a reconnect): hold this one until
+                # the missing klines are fetched and queued ahead of it
+                stream.pending.append((kline, received))
+                self.start_repair(stream)
+                return
+        await self.commit(stream, kline, received)
+
+    async def commit(self, stream, kline, received=None):
+        """
+        Queue a closed kline for processing, unless a kline with the same open time already was.
+        """
+        # A backfilled kline can arrive again from the websocket, and the other way round
+        if stream.last_closed is not None and kline['t'] <= stream.last_closed:
+            stream.duplicates += 1
+            return
+        stream.last_closed = kline['t']
+        stream.received += 1
+        queue = stream.queue
+        if queue.full():
+            if self.overflow == 'drop_oldest' and queue.drop_tick():
+                stream.tick_queued = False
+                stream.dropped += 1
+            else:
+                stream.blocked += 1
+                start = time.perf_counter()
+                await queue.put((kline, received))
+                stream.blocked_seconds += time.perf_counter() - start
+                self.requeue_tick(stream, kline)
+                return
+        queue.put_nowait((kline, received))
+        stream.max_depth = max(stream.max_depth, queue.qsize())
+        self.requeue_tick(stream, kline)
+
+    def requeue_tick(self, stream, kline):
+        # A marker queued ahead of the closed kline is evaluated before it is committed, so the
+        # latest tick of the next bar gets a fresh marker behind it
+        stream.tick_queued = False
+        if stream.tick is not None and stream.tick[0]['t'] == bucket_ends([kline['t']], stream.interval)[0]:
+            self.queue_tick(stream)
+
+    def route_tick(self, stream, kline, received):
+        if self.on_tick is None:
+            return
+        stream.ticks += 1
+        stream.tick = (kline, received)
+        if stream.tick_queued:
+            stream.ticks_coalesced += 1
+        else:
+            self.queue_tick(stream)
+
+    def queue_tick(self, stream):
+        if self.on_tick is None:
+            return
+        if stream.queue.full():
+            stream.ticks_dropped += 1
+        else:
+            stream.tick_queued = True
+            stream.queue.put_nowait(_TICK)
+
+    async def consume(self, stream):
+        while True:
+            kline, received = await stream.queue.get()
+            dequeued = time.time()
+            start = time.perf_counter()
+            # Awaiting the executor keeps the stream's klines in order without blocking the loop
+            try:
+                if kline is None:
+                    # Marker of the latest unclosed kline, read now so the newest tick is evaluated
+                    stream.tick_queued = False
+                    kline, received = stream.tick
+                    _, timings = await self.compute.peek(stream, kline, self.on_tick)
+                    if self.latency is not None and timings is not None and received is not None:
+                        self.latency.record('tick', time.time() - received, stream.name)
+                    continue
+                _, timings = await self.compute.process(stream, kline, self.on_kline)
+                stream.processed += 1
+            finally:
+                stream.queue.task_done()
+            if self.latency is not None and timings is not None:
+                self.record_latency(stream, kline, received, dequeued, time.perf_counter() - start, timings)
+
+    def record_latency(self, stream, kline, received, dequeued, compute_seconds, timings):
+        latency = self.latency
+        # Per symbol histograms are kept per stream (symbol and interval)
+        symbol = stream.name
+        # 'T' is the last millisecond of the kline, it closes one millisecond later
+        close_time = (kline['T'] + 1) / 1000 if 'T' in kline else None
+        if received is not None:
+            if close_time is not None:
+                latency.record('receive', received - close_time, symbol)
+            latency.record('queue', dequeued - received, symbol)
+        indicators = 0.0
+        for name, seconds in timings.items():
+            if name == 'strategy':
+                latency.record('strategy', seconds, symbol)
+            else:
+                # Per indicator overall only, per symbol their sum
+                latency.record(f'indicator:{name}', seconds)
+                indicators += seconds
+        latency.record('indicators', indicators, symbol)
+        latency.record('compute', compute_seconds, symbol)
+        if close_time is not None:
+            latency.record('total', time.time() - close_time, symbol)
+
+    async def warm_start(self, fetch_klines, directory=SNAPSHOT_DIRECTORY, bars=WARMUP_BARS):
+        """
+        Bring every stream up to date before it starts consuming: restore its snapshot and
+        backfill the bars missed since, or without a snapshot bulk-load the last `bars` closed
+        bars in one request. Indicators are computed once per bar either way. Failed REST
+        requests are retried until they succeed, a stream never starts without its history.
+        Closed klines routed meanwhile (the websocket is read during the warm start) are held
+        back and queued behind the warmed-up bars, after any kline missed in between.
+
+        Args:
+        - fetch_klines: async function (symbol, interval, limit, end_time=None, start_time=None)
+          returning a kline_decoding.KLINE_DTYPE array (kline_fetcher.fetch_historical_klines_array).
+        - directory: Snapshot directory.
+        - bars: Bars loaded for streams without a snapshot.
+
+        Returns:
+        - {stream name: (source ('snapshot' or 'history'), bars processed, seconds)}.
+        """
+        results = await asyncio.gather(*(
+            self.warm_start_stream(stream, fetch_klines, directory, bars) for stream in self.streams.values()
+        ))
+        return dict(zip(self.streams, results))
+
+    async def warm_start_stream(self, stream, fetch_klines, directory, bars):
+        start = time.perf_counter()
+        # Live klines routed meanwhile are held back like during a repair, until the warm-up is done
+        stream.repair = asyncio.current_task()
+        last_time = await self.compute.call(stream, 'load', snapshot_path(stream.name, directory))
+        source = 'history' if last_time is None else 'snapshot'
+        processed = 0
+        failures = 0
+        while True:
+            # Pages already processed are kept when a request fails, the retry goes on from there
+            try:
+                if last_time is None:
+                    closed = closed_klines(await fetch_klines(stream.symbol, stream.interval, bars), stream.interval)
+                    if len(closed):
+                        last_time = await self.compute.call(stream, 'warm_up', closed)
+                        processed += len(closed)
+                else:
+                    async for closed in fetch_closed_klines_since(fetch_klines, stream.symbol, stream.interval, last_time):
+                        last_time = await self.compute.call(stream, 'warm_up', closed)
+                        processed += len(closed)
+                break
+            except Exception as error:
+                # Starting without history would leave the indicators NaN, wait for the exchange
+                failures += 1
+                delay = retry_delay(failures)
+                print(f"Warm start of {stream.name} failed ({error!r}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+        if last_time is not None:
+            stream.last_closed = last_time
+        await self.release_warm_start(stream)
+        return source, processed, round(time.perf_counter() - start, 3)
+
+    async def release_warm_start(self, stream):
+        """
+        Queue the klines held back during a stream's warm start. A kline that closed between the
+        REST request and the subscription leaves a gap in front of them, it is fetched first.
+        """
+        while stream.pending:
+            kline, received = stream.pending[0]
+            if follows_gap(stream, kline):
+                stream.gaps += 1
+                if self.fetch_klines is not None:
+                    stream.repair = None
+                    self.start_repair(stream)
+                    return
+            stream.pending.pop(0)
+            await self.commit(stream, kline, received)
+        stream.repair = None
+
+    def backfill(self, names):
+        """
+        Fetch the klines the streams missed, e.g. while their websocket was reconnecting: every
+        kline closed after the last closed kline routed to a stream is fetched over REST and
+        queued in order. Live closed klines are held back meanwhile and queued after them, so
+        the caller can keep reading the websocket. Does nothing without `fetch_klines`.
+
+        Args:
+        - names: Stream names.
+
+        Returns:
+        - Number of streams being repaired.
+        """
+        repairing = 0
+        for name in names:
+            stream = self.streams.get(name)
+            if stream is not None and self.fetch_klines is not None and stream.last_closed is not None:
+                self.start_repair(stream)
+                repairing += 1
+        return repairing
+
+    def start_repair(self, stream):
+        if stream.repair is None:
+            stream.repair = asyncio.create_task(self.repair_stream(stream))
+
+    async def repair_stream(self, stream):
+        """
+        Queue the missed klines of a stream, then the klines held back meanwhile, in order.
+        Failed REST requests are retried with jittered backoff until they succeed, the stream
+        never moves past a hole it could not fill.
+        """
+        failures = 0
+        while True:
+            # Klines held before this backfill: a hole left in front of them after it is a hole
+            # on the exchange side (maintenance), later ones arrived after the request went out
+            held = len(stream.pending)
+            try:
+                stream.backfilled += await self.backfill_stream(stream)
+            except Exception as error:
+                failures += 1
+                delay = retry_delay(failures)
+                print(f"Backfill of {stream.name} failed ({error!r}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            failures = 0
+            while stream.pending:
+                kline, received = stream.pending[0]
+                if held <= 0 and follows_gap(stream, kline):
+                    break
+                stream.pending.pop(0)
+                held -= 1
+                await self.commit(stream, kline, received)
+            if not stream.pending:
+                stream.repair = None
+                return
+
+    async def backfill_stream(self, stream):
+        """
+        Queue the closed klines opened after the stream's last closed kline, fetched over REST
+        (one request per 1000 klines). REST failures are raised.
+
+        Returns:
+        - Klines queued.
+        """
+        queued = 0
+        async for closed in fetch_closed_klines_since(self.fetch_klines, stream.symbol, stream.interval, stream.last_closed):
+            for kline in array_to_klines(closed, stream.symbol, stream.interval):
+                await self.commit(stream, kline)
+                queued += 1
+        return queued
+
+    async def save_snapshots(self, directory=SNAPSHOT_DIRECTORY):
+        await asyncio.gather(*(
+            self.compute.call(stream, 'save', snapshot_path(stream.name, directory))
+            for stream in self.streams.values()
+        ))
+
+    async def snapshot_periodically(self, interval_seconds=SNAPSHOT_SECONDS, directory=SNAPSHOT_DIRECTORY):
+        while True:
+            await asyncio.sleep(interval_seconds)
+            await self.save_snapshots(directory)
+
+    async def frame(self, name):
+        """
+        DataFrame of the retained rows of a stream: zero-copy with the 'thread' executor (valid
+        until the stream's next kline), a copy made by the worker with 'process'.
+        """
+        stream = self.streams[name]
+        return await self.compute.call(stream, 'frame')
+
+    def start_consumers(self):
+        """
+        Start one consumer task per stream and return the tasks.
+        """
+        return [asyncio.create_task(self.consume(stream)) for stream in self.streams.values()]
+
+    def metrics(self):
+        return {name: stream.metrics() for name, stream in self.streams.items()}
+
+    async def report_metrics(self, interval_seconds):
+        """
+        Print the streams with queued, dropped or blocked klines every `interval_seconds`.
+        """
+        while True:
+            await asyncio.sleep(interval_seconds)
+            for name, metrics in self.metrics().items():
+                if metrics['depth'] or metrics['dropped'] or metrics['blocked']:
+                    print(f"{name}: {metrics}")
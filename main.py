@@ -1,119 +1,99 @@
 import asyncio
-import pandas as pd
-from kline_fetcher import fetch_klines, fetch_historical_klines
-from utils import datetime_to_milliseconds
-import datetime
+from functools import partial
+from kline_fetcher import fetch_historical_klines_array, fetch_multiplexed_klines, fetch_symbols
+from http_client import close_clients, BASE_URL, STREAM_URL
+from indicator_engine import LIVE_INDICATORS
+from live_streams import StreamRouter, StreamCompute, SNAPSHOT_DIRECTORY
+from metrics import LatencyMetrics, serve_metrics, dump_metrics_periodically, METRICS_PORT
 from positions.positions import calculate_positions
-import os
-from utils import add_date_column, calculate_5_ema, calculate_10_sma, calculate_rsi, calculate_macd, calculate_bollinger_bands, calculate_vwap, calculate_obv, calculate_stochastic_oscillator, calculate_atr, calculate_ad_line, calculate_pivot_points, calculate_cci, calculate_momentum, calculate_standard_deviation, calculate_fibonacci_retracement, calculate_roc
-
-# DataFrame to store kline data
-klines_df = pd.DataFrame(columns=['time', 'open', 'high', 'low', 'close', 'volume'])
-klines_df = klines_df.astype({
-    'time': 'float64',
-    'open': 'float64',
-    'high': 'float64',
-    'low': 'float64',
-    'close': 'float64',
-    'volume': 'float64'
-})
-
-# async def fetch_and_process_historical_klines(symbol, interval, limit=1000):
-#     global klines_df
-#     historical_klines = await fetch_historical_klines(symbol, interval, limit)  # Fetch historical data
-    
-#     # Process each kline
-#     for kline in historical_klines:
-#         # Example structure: [Open time, Open, High, Low, Close, Volume, Close time, ...]
-#         # Adjust the indices according to your API's response structure
-#         new_row_df = pd.DataFrame([{
-#             'time': kline[0],  # Open time
-#             'open': float(kline[1]),  # Open
-#             'high': float(kline[2]),  # High
-#             'low': float(kline[3]),  # Low
-#             'close': float(kline[4]),  # Close
-#             'volume': float(kline[5])  # Volume
-#         }])
-
-#         klines_df = pd.concat([klines_df, new_row_df], ignore_index=True)
-
-#         klines_df = add_date_column(klines_df)
-#         klines_df = calculate_5_ema(klines_df)
-#         klines_df = calculate_10_sma(klines_df)
-#         klines_df = calculate_rsi(klines_df)
-#         klines_df = calculate_macd(klines_df)
-#         klines_df = calculate_bollinger_bands(klines_df)
-#         klines_df = calculate_vwap(klines_df)
-#         klines_df = calculate_obv(klines_df)
-#         klines_df = calculate_stochastic_oscillator(klines_df)
-#         klines_df = calculate_atr(klines_df)
-#         klines_df = calculate_ad_line(klines_df)
-#         klines_df = calculate_cci(klines_df)
-#         klines_df = calculate_pivot_points(klines_df)
-#         klines_df = calculate_momentum(klines_df)
-#         klines_df = calculate_standard_deviation(klines_df)
-#         klines_df = calculate_fibonacci_retracement(klines_df)
-#         klines_df = calculate_roc(klines_df, period=14) 
-
-#         # calculate_positions(klines_df=klines_df)
-
-#     os.makedirs('./klines_data', exist_ok=True)
-#     file_path = os.path.join('./klines_data', f'{symbol}_{interval}_klines.csv')
-    
-#     # Save DataFrame to CSV
-#     klines_df.to_csv(file_path, index=False)
-#     print(f'Saved DataFrame to {file_path}')
-    
-
-async def process_kline_data(queue):
-    global klines_df, open_positions
-    while True:
-        kline = await queue.get()
-        # Append the new kline data
-        new_row_df = pd.DataFrame([{
-            'time': kline['t'],
-            'open': float(kline['o']),
-            'high': float(kline['h']),
-            'low': float(kline['l']),
-            'close': float(kline['c']),
-            'volume': float(kline['v'])
-        }])
-        
-        klines_df = pd.concat([klines_df, new_row_df], ignore_index=True)
-        
-        # Calculate indicators
-        klines_df = add_date_column(klines_df)
-        klines_df = calculate_5_ema(klines_df)
-        klines_df = calculate_10_sma(klines_df)
-        klines_df = calculate_rsi(klines_df)
-        klines_df = calculate_macd(klines_df)
-        klines_df = calculate_bollinger_bands(klines_df)
-        klines_df = calculate_vwap(klines_df)
-        klines_df = calculate_obv(klines_df)
-        klines_df = calculate_stochastic_oscillator(klines_df)
-        klines_df = calculate_atr(klines_df)
-        klines_df = calculate_ad_line(klines_df)
-        klines_df = calculate_cci(klines_df)
-        klines_df = calculate_pivot_points(klines_df)
-        klines_df = calculate_momentum(klines_df)
-        klines_df = calculate_standard_deviation(klines_df)
-        klines_df = calculate_fibonacci_retracement(klines_df)
-        klines_df = calculate_roc(klines_df, period=14) 
-
-        # calculate_positions(klines_df=klines_df)
-                
-        queue.task_done()
+
+# Exchange endpoints, point both at a local fake_exchange.py server for load and soak tests
+REST_URL = BASE_URL
+WEBSOCKET_URL = STREAM_URL
+
+# Symbols to watch, None watches every pair trading against QUOTE_ASSET
+SYMBOLS = None
+QUOTE_ASSET = 'USDT'
+INTERVALS = ['15m']
+
+# Longest lookback (in bars) strategies read from a stream's klines_df; indicator state lives in the engine
+KLINES_LOOKBACK = 400
+# Extra rows kept on top of the lookback
+KLINES_RETENTION_MARGIN = 100
+KLINES_HISTORY_LIMIT = KLINES_LOOKBACK + KLINES_RETENTION_MARGIN
+
+# Indicators and strategies run off the event loop: 'process' pins each stream to one of
+# COMPUTE_WORKERS processes so symbols compute in parallel, 'thread' keeps them in this process
+COMPUTE_EXECUTOR = 'process'
+COMPUTE_WORKERS = 4
+
+# Evaluate unclosed klines provisionally on every intrabar update instead of waiting for the close
+PROVISIONAL_EVALUATION = True
+
+# Warm start: bars loaded per stream without a snapshot, and how often snapshots are written
+WARMUP_BARS = 1000
+SNAPSHOT_SECONDS = 60
+
+# Seconds between reports of streams whose queues are backing up
+METRICS_REPORT_SECONDS = 60
+# Latency and backpressure metrics: served on localhost (None to disable) and dumped to a file
+METRICS_SERVER_PORT = METRICS_PORT
+METRICS_DUMP_SECONDS = 60
+
+def process_kline_data(state):
+    # Called in the compute executor after the stream's indicators were updated with a closed kline.
+    # Zero-copy view of the stream's retained rows, only valid until its next kline
+    klines_df = state.frame()
+
+    # Each stream trades its own positions, kept in its snapshots across restarts
+    calculate_positions(klines_df=klines_df, open_positions=state.positions)
+
+
+def process_kline_tick(state, row):
+    # Called in the compute executor for an unclosed kline: `row` holds its provisional indicator
+    # values, the committed rows (state.frame()) do not include it yet and must not be changed.
+    pass
 
 
 async def main():
-    symbol = 'BTCUSDT'
-    interval = '15m'  # 1 minute interval
-    
-    
-    queue = asyncio.Queue()
-    producer = asyncio.create_task(fetch_klines(symbol, interval, queue))
-    consumer = asyncio.create_task(process_kline_data(queue))
-    await asyncio.gather(producer, consumer)
+    symbols = SYMBOLS or await fetch_symbols(QUOTE_ASSET, REST_URL)
+
+    # One state (engine, ring buffer, bounded queue) per symbol/interval, all over a few connections
+    compute = StreamCompute(COMPUTE_EXECUTOR, COMPUTE_WORKERS)
+    latency = LatencyMetrics()
+    fetch_klines = partial(fetch_historical_klines_array, base_url=REST_URL)
+    router = StreamRouter(KLINES_HISTORY_LIMIT, LIVE_INDICATORS, on_kline=process_kline_data,
+                          compute=compute, metrics=latency,
+                          on_tick=process_kline_tick if PROVISIONAL_EVALUATION else None,
+                          fetch_klines=fetch_klines)
+    for symbol in symbols:
+        for interval in INTERVALS:
+            router.add(symbol, interval)
+
+    # Receiving starts first so no kline closing during the warm start is missed, it waits in the queues
+    producer = asyncio.create_task(fetch_multiplexed_klines(router.streams, router, stream_url=WEBSOCKET_URL))
+    warm_start = await router.warm_start(fetch_klines, SNAPSHOT_DIRECTORY, WARMUP_BARS)
+    for source in ('snapshot', 'history'):
+        started = [result for result in warm_start.values() if result[0] == source]
+        if started:
+            print(f"{len(started)} streams started from {source}, {sum(result[1] for result in started)} bars processed")
+    consumers = router.start_consumers()
+    snapshotter = asyncio.create_task(router.snapshot_periodically(SNAPSHOT_SECONDS, SNAPSHOT_DIRECTORY))
+    reporter = asyncio.create_task(router.report_metrics(METRICS_REPORT_SECONDS))
+
+    def collect_metrics():
+        return {'latency': latency.summary(), 'streams': router.metrics()}
+
+    metrics_server = await serve_metrics(collect_metrics, port=METRICS_SERVER_PORT) if METRICS_SERVER_PORT else None
+    dumper = asyncio.create_task(dump_metrics_periodically(collect_metrics, METRICS_DUMP_SECONDS))
+    try:
+        await asyncio.gather(producer, reporter, dumper, snapshotter, *consumers)
+    finally:
+        await router.save_snapshots(SNAPSHOT_DIRECTORY)
+        compute.shutdown()
+        if metrics_server is not None:
+            await metrics_server.cleanup()
+        await close_clients()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,163 @@
+import asyncio
+import json
+import math
+import os
+import time
+
+from aiohttp import web
+
+# Latency histogram buckets grow by 10% from 1 microsecond, so percentiles are within 10%
+HISTOGRAM_MIN_SECONDS = 1e-6
+HISTOGRAM_GROWTH = 1.1
+HISTOGRAM_BUCKETS = 250  # up to ~2 hours
+
+# Local metrics endpoint and periodic dump
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9100
+METRICS_DUMP_FILE = "metrics.json"
+
+# One in LOG_SAMPLE_RATE messages is logged
+LOG_SAMPLE_RATE = 1000
+
+
+class LatencyHistogram:
+    """
+    Fixed-size log-bucketed histogram of durations in seconds: constant memory and O(1) record.
+    """
+    def __init__(self):
+        self.counts = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        seconds = max(seconds, 0.0)
+        if seconds <= HISTOGRAM_MIN_SECONDS:
+            bucket = 0
+        else:
+            bucket = min(int(math.log(seconds / HISTOGRAM_MIN_SECONDS, HISTOGRAM_GROWTH)) + 1, HISTOGRAM_BUCKETS - 1)
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        """
+        Upper bound of the bucket holding the q-th percentile (0-100), capped at the maximum seen.
+        """
+        if not self.count:
+            return math.nan
+        rank = math.ceil(q / 100 * self.count)
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(HISTOGRAM_MIN_SECONDS * HISTOGRAM_GROWTH ** bucket, self.max)
+        return self.max
+
+    def summary(self):
+        """
+        Count, mean, p50, p99 and max in milliseconds.
+        """
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count * 1e3, 3),
+            'p50_ms': round(self.percentile(50) * 1e3, 3),
+            'p99_ms': round(self.percentile(99) * 1e3, 3),
+            'max_ms': round(self.max * 1e3, 3)
+        }
+
+
+class LatencyMetrics:
+    """
+    Latency histograms per pipeline stage, overall and per symbol.
+
+    Stages recorded by the live pipeline:
+    - 'receive': kline close time (exchange clock) to websocket receipt
+    - 'queue': receipt to dequeue by the stream's consumer
+    - 'indicator:<name>': one indicator's update (overall only)
+    - 'indicators': all indicator updates of a kline
+    - 'strategy': strategy evaluation (on_kline)
+    - 'compute': executor handoff, indicators and strategy
+    - 'total': kline close time to strategy decision
+    - 'tick': receipt of an unclosed kline to its provisional strategy decision
+    """
+    def __init__(self):
+        self.stages = {}  # stage -> LatencyHistogram
+        self.symbols = {}  # (stage, symbol) -> LatencyHistogram
+        self.started = time.time()
+
+    def record(self, stage, seconds, symbol=None):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = LatencyHistogram()
+        histogram.record(seconds)
+        if symbol is not None:
+            histogram = self.symbols.get((stage, symbol))
+            if histogram is None:
+                histogram = self.symbols[(stage, symbol)] = LatencyHistogram()
+            histogram.record(seconds)
+
+    def summary(self):
+        symbols = {}
+        for (stage, symbol), histogram in self.symbols.items():
+            symbols.setdefault(symbol, {})[stage] = histogram.summary()
+        return {
+            'uptime_seconds': round(time.time() - self.started, 1),
+            'stages': {stage: histogram.summary() for stage, histogram in self.stages.items()},
+            'symbols': symbols
+        }
+
+
+def dump_metrics(summary, path=METRICS_DUMP_FILE):
+    """
+    Write a metrics summary to a JSON file, replacing it atomically.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(summary, file, indent=2)
+    os.replace(tmp_path, path)
+
+
+async def dump_metrics_periodically(collect, interval_seconds, path=METRICS_DUMP_FILE):
+    """
+    Write `collect()` to `path` every `interval_seconds`.
+    """
+    while True:
+        await asyncio.sleep(interval_seconds)
+        dump_metrics(collect(), path)
+
+
+async def serve_metrics(collect, host=METRICS_HOST, port=METRICS_PORT):
+    """
+    Serve GET /metrics with the JSON returned by `collect()` on a local port.
+
+    Returns:
+    - The aiohttp AppRunner, call `await runner.cleanup()` to stop it.
+    """
+    async def handle(request):
+        return web.json_response(collect())
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Metrics available at http://{host}:{port}/metrics")
+    return runner
+
+
+class SampledLogger:
+    """
+    Prints one JSON line for one in `rate` events instead of every event.
+    """
+    def __init__(self, rate=LOG_SAMPLE_RATE):
+        self.rate = rate
+        self.seen = 0
+
+    def log(self, event, **fields):
+        self.seen += 1
+        if self.seen % self.rate == 1 or self.rate == 1:
+            print(json.dumps({'event': event, 'time': round(time.time(), 3), 'seen': self.seen, **fields}))
@@ -6,8 +6,8 @@ class Position:
 
 open_positions = []
 
-def calculate_positions(klines_df):
-    open_positions  
+def calculate_positions(klines_df, open_positions=open_positions):
+    # open_positions defaults to the module list, streams pass their own (kept in their snapshots)
 
     required_columns = ['close', '5_EMA', '10_SMA', 'RSI', 'MACD', 'MACD_Signal', 'Upper_BB', 'Lower_BB', 'VWAP', 'time']
     if not all(column in klines_df.columns for column in required_columns):
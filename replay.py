@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+from live_streams import stream_name
+from resample import bucket_ends
+from storage import iter_klines
+
+# Rows read from the dataset at a time
+REPLAY_CHUNK_ROWS = 50_000
+REPLAY_COLUMNS = ['time', 'open', 'high', 'low', 'close', 'volume']
+
+
+def iter_replay_klines(path, symbol, interval, start=None, end=None, chunk_rows=REPLAY_CHUNK_ROWS):
+    """
+    Read a stored klines dataset as the closed kline payloads the websocket sends ('k' of a
+    kline event), oldest first.
+
+    Args:
+    - path: Dataset path (csv, npy directory or parquet, see storage.py).
+    - symbol, interval: Written into the payloads, like the exchange does.
+    - start, end: Optional open time range (epoch ms, end excluded).
+    """
+    for chunk in iter_klines(path, chunk_rows, columns=REPLAY_COLUMNS):
+        times = chunk['time'].to_numpy().astype('int64')
+        if start is not None and (not len(times) or times[-1] < start):
+            continue
+        close_times = bucket_ends(times, interval) - 1
+        columns = [chunk[column].tolist() for column in ('open', 'high', 'low', 'close', 'volume')]
+        for open_time, close_time, open_, high, low, close, volume in zip(times.tolist(), close_times.tolist(), *columns):
+            if start is not None and open_time < start:
+                continue
+            if end is not None and open_time >= end:
+                return
+            yield {
+                't': open_time, 'T': close_time, 's': symbol, 'i': interval,
+                'o': repr(open_), 'h': repr(high), 'l': repr(low), 'c': repr(close), 'v': repr(volume),
+                'x': True
+            }
+
+
+async def replay_klines(sources, router, speed=None, report_seconds=10, start=None, end=None):
+    """
+    Feed stored klines into a live_streams.StreamRouter, like fetch_multiplexed_klines does with
+    the websocket, and wait until every stream has processed them.
+
+    Args:
+    - sources: {(symbol, interval): dataset path}; the streams must have been added to the router.
+    - router: The StreamRouter (its consumers must be running).
+    - speed: None to replay as fast as the pipeline goes, else how many times faster than the
+      klines happened (60 replays an hour of klines per minute).
+    - report_seconds: How often progress (klines/s) is printed, None to stay quiet.
+    - start, end: Optional open time range replayed (epoch ms, end excluded), e.g. a given day.
+
+    Returns:
+    - (klines replayed, seconds).
+    """
+    iterators = [
+        (stream_name(symbol, interval), iter_replay_klines(path, symbol, interval, start, end))
+        for (symbol, interval), path in sources.items()
+    ]
+    # Streams are merged by close time so they arrive in the order the exchange would send them
+    pending = []
+    for name, klines in iterators:
+        kline = next(klines, None)
+        if kline is not None:
+            pending.append([kline['T'], name, kline, klines])
+
+    started = time.perf_counter()
+    last_report = started
+    first_close = min((entry[0] for entry in pending), default=0)
+    replayed = 0
+    while pending:
+        entry = min(pending, key=lambda entry: entry[0])
+        close_time, name, kline, klines = entry
+        if speed is not None:
+            delay = (close_time - first_close) / 1000 / speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await router.route(name, kline, time.time())
+        replayed += 1
+        next_kline = next(klines, None)
+        if next_kline is None:
+            pending.remove(entry)
+        else:
+            entry[0], entry[2] = next_kline['T'], next_kline
+
+        now = time.perf_counter()
+        if report_seconds is not None and now - last_report >= report_seconds:
+            last_report = now
+            print(f"Replayed {replayed} klines, {replayed / (now - started):.0f} klines/s")
+
+    await asyncio.gather(*(stream.queue.join() for stream in router.streams.values()))
+    elapsed = time.perf_counter() - started
+    return replayed, elapsed
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+
+# Length of each kline interval in milliseconds. Months have no fixed length, see bucket_starts()
+INTERVAL_MILLISECONDS = {
+    '1s': 1_000,
+    '1m': 60_000, '3m': 180_000, '5m': 300_000, '15m': 900_000, '30m': 1_800_000,
+    '1h': 3_600_000, '2h': 7_200_000, '4h': 14_400_000, '6h': 21_600_000, '8h': 28_800_000, '12h': 43_200_000,
+    '1d': 86_400_000, '3d': 259_200_000, '1w': 604_800_000,
+}
+
+# Binance opens intraday and daily klines at multiples of the interval since the epoch (UTC),
+# weekly klines on Mondays (the epoch was a Thursday) and monthly klines on the 1st.
+# 3d klines are not anchored to the epoch and cannot be rebuilt reliably.
+BUCKET_OFFSETS = {'1w': 4 * 86_400_000}
+RESAMPLE_INTERVALS = [interval for interval in INTERVAL_MILLISECONDS if interval != '3d'] + ['1M']
+
+# What to do with the first and last bucket when the source does not cover them completely
+PARTIAL_BUCKETS = ('drop', 'keep')
+
+
+def bucket_starts(times, interval):
+    """
+    Open time of the `interval` kline containing each open time (epoch milliseconds, int64 array).
+    """
+    times = np.asarray(times, dtype=np.int64)
+    if interval == '1M':
+        months = times.astype('datetime64[ms]').astype('datetime64[M]')
+        return months.astype('datetime64[ms]').astype(np.int64)
+    interval_ms = INTERVAL_MILLISECONDS[interval]
+    offset = BUCKET_OFFSETS.get(interval, 0)
+    return (times - offset) // interval_ms * interval_ms + offset
+
+
+def bucket_ends(starts, interval):
+    """
+    Open time of the kline following each bucket start.
+    """
+    if interval == '1M':
+        months = np.asarray(starts, dtype=np.int64).astype('datetime64[ms]').astype('datetime64[M]')
+        return (months + 1).astype('datetime64[ms]').astype(np.int64)
+    return np.asarray(starts, dtype=np.int64) + INTERVAL_MILLISECONDS[interval]
+
+
+def resample_klines(df, interval, source_interval='1m', partial='drop'):
+    """
+    Build klines of a higher interval from lower interval klines, the way Binance aggregates them.
+
+    Args:
+    - df (pd.DataFrame): klines sorted by 'time', with 'open', 'high', 'low', 'close' and 'volume'.
+    - interval: target interval, one of RESAMPLE_INTERVALS.
+    - source_interval: interval of the input klines.
+    - partial: 'drop' removes the first and last bucket when the input starts after the first
+      bucket opens or ends before the last bucket closes (e.g. the kline still in progress);
+      'keep' aggregates them from the klines available, which matches Binance for a symbol's
+      first kline and gives the in-progress value for the last one.
+
+    Returns:
+    - pd.DataFrame with 'time' (bucket open time), first open, max high, min low, last close and
+      summed volume. Buckets without any input kline (exchange downtime) are absent, as on Binance.
+    """
+    if interval not in RESAMPLE_INTERVALS:
+        raise ValueError(f"Cannot resample to {interval}, expected one of {', '.join(RESAMPLE_INTERVALS)}")
+    if partial not in PARTIAL_BUCKETS:
+        raise ValueError(f"partial must be one of {', '.join(PARTIAL_BUCKETS)}")
+    columns = ['time', 'open', 'high', 'low', 'close', 'volume']
+    if df.empty:
+        return pd.DataFrame({column: df[column].to_numpy() for column in columns})
+
+    times = df['time'].to_numpy(dtype=np.int64)
+    starts = bucket_starts(times, interval)
+    first = np.flatnonzero(np.r_[True, starts[1:] != starts[:-1]])
+    last = np.r_[first[1:] - 1, len(times) - 1]
+
+    result = pd.DataFrame({
+        'time': starts[first],
+        'open': df['open'].to_numpy(dtype=np.float64)[first],
+        'high': np.maximum.reduceat(df['high'].to_numpy(dtype=np.float64), first),
+        'low': np.minimum.reduceat(df['low'].to_numpy(dtype=np.float64), first),
+        'close': df['close'].to_numpy(dtype=np.float64)[last],
+        'volume': np.add.reduceat(df['volume'].to_numpy(dtype=np.float64), first),
+    })
+
+    if partial == 'drop':
+        keep = np.ones(len(result), dtype=bool)
+        if times[0] > starts[0]:
+            keep[0] = False
+        if times[-1] + INTERVAL_MILLISECONDS[source_interval] < bucket_ends(starts[-1:], interval)[0]:
+            keep[-1] = False
+        result = result[keep].reset_index(drop=True)
+    return result
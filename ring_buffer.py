@@ -0,0 +1,100 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+
+class KlineRingBuffer:
+    """
+    Fixed-capacity, preallocated store of the most recent klines and their indicator values.
+
+    Every row is written twice, at slot i and i + capacity of arrays twice the capacity long,
+    so the most recent rows are always one contiguous slice: views of them never copy and the
+    memory used is fixed once the buffer is allocated, however long the process runs.
+
+    'time' is stored as int64, 'date' as datetime64[s] and every other column as float64.
+    """
+    def __init__(self, columns, capacity):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.columns = list(columns)
+        self.capacity = capacity
+        self.count = 0  # rows appended since the start, the next row's absolute position
+        self.float_columns = [column for column in self.columns if column not in ('time', 'date')]
+        self.float_index = {column: index for index, column in enumerate(self.float_columns)}
+        self.floats = np.full((2 * capacity, len(self.float_columns)), np.nan)
+        self.times = np.zeros(2 * capacity, dtype=np.int64)
+        self.dates = np.full(2 * capacity, np.datetime64('NaT'), dtype='datetime64[s]')
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def _write(self, slot, column, value):
+        if column == 'time':
+            self.times[slot] = self.times[slot + self.capacity] = value
+        elif column == 'date':
+            if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+                value = np.datetime64(value, 's')
+            self.dates[slot] = self.dates[slot + self.capacity] = value
+        else:
+            index = self.float_index[column]
+            self.floats[slot, index] = self.floats[slot + self.capacity, index] = value
+
+    def append(self, row):
+        """
+        Add a row (dict with a value for every column), dropping the oldest one when full.
+        """
+        slot = self.count % self.capacity
+        values = np.fromiter((row[column] for column in self.float_columns), dtype=np.float64,
+                             count=len(self.float_columns))
+        self.floats[slot] = values
+        self.floats[slot + self.capacity] = values
+        if 'time' in row:
+            self._write(slot, 'time', row['time'])
+        if 'date' in row:
+            self._write(slot, 'date', row['date'])
+        self.count += 1
+
+    def update(self, position, column, value):
+        """
+        Change a value of the row at absolute position `position` (e.g. an indicator revision).
+        Rows that have already been dropped are ignored.
+        """
+        if self.count - len(self) <= position < self.count:
+            self._write(position % self.capacity, column, value)
+
+    def _window(self, n):
+        n = len(self) if n is None else min(n, len(self))
+        end = self.count % self.capacity + self.capacity if self.count >= self.capacity else self.count
+        return end - n, end
+
+    def arrays(self, n=None):
+        """
+        Zero-copy views of the last n rows (all retained rows if None), oldest first.
+
+        Returns:
+        - {column: ndarray}. The views are only valid until the next append.
+        """
+        start, end = self._window(n)
+        arrays = {}
+        for column in self.columns:
+            if column == 'time':
+                arrays[column] = self.times[start:end]
+            elif column == 'date':
+                arrays[column] = self.dates[start:end]
+            else:
+                arrays[column] = self.floats[start:end, self.float_index[column]]
+        return arrays
+
+    def frame(self, n=None):
+        """
+        The last n rows as a DataFrame backed by the buffer's memory (no copy), oldest first.
+        Treat it as read-only and do not keep it across appends; use .copy() to keep a snapshot.
+        """
+        return pd.DataFrame(self.arrays(n), copy=False)
+
+    def last(self, column):
+        start, end = self._window(1)
+        if start == end:
+            raise IndexError("The ring buffer is empty")
+        return self.arrays(1)[column][0]
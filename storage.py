@@ -0,0 +1,499 @@
+import io
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet support is optional, the .npy store and CSV only need numpy/pandas
+    pa = None
+    pq = None
+
+# Formats, in the order find_dataset prefers them
+FORMAT_SUFFIXES = {'npy': '.npy', 'parquet': '.parquet', 'csv': '.csv'}
+
+PARQUET_COMPRESSION = 'zstd'
+PARQUET_ROW_GROUP_SIZE = 1_000_000
+
+NPY_META_FILE = 'meta.json'
+
+# Compact mode: traded prices and volumes always keep full precision, other float columns
+# are stored as float32 when that loses at most this much relative precision on every value
+COMPACT_FULL_PRECISION = ['open', 'high', 'low', 'close', 'volume']
+COMPACT_MAX_RELATIVE_ERROR = 1e-6
+
+
+def dataset_format(path):
+    """
+    Storage format of a dataset path, from its suffix: .csv, .parquet or .npy (a directory with
+    one .npy file per column).
+    """
+    for file_format, suffix in FORMAT_SUFFIXES.items():
+        if str(path).endswith(suffix):
+            return file_format
+    raise ValueError(f"Unknown dataset format for {path}, expected one of {', '.join(FORMAT_SUFFIXES.values())}")
+
+
+def dataset_path(stem, file_format):
+    return f"{stem}{FORMAT_SUFFIXES[file_format]}"
+
+
+def find_dataset(stem):
+    """
+    Path of the stored dataset `stem` (path without suffix), preferring the columnar formats over CSV.
+    """
+    for file_format in FORMAT_SUFFIXES:
+        path = dataset_path(stem, file_format)
+        if os.path.exists(path) and (file_format != 'parquet' or pq is not None):
+            return path
+    raise FileNotFoundError(f"No dataset found for {stem}")
+
+
+def _require_pyarrow():
+    if pq is None:
+        raise ImportError("Parquet storage needs pyarrow (pip install pyarrow); use the .npy or .csv format instead")
+
+
+def _date_to_days(dates):
+    return pd.to_datetime(dates).to_numpy().astype('datetime64[D]')
+
+
+def _column_arrays(df):
+    columns = {}
+    for column in df.columns:
+        if column == 'date':
+            columns[column] = _date_to_days(df[column])
+        elif column == 'time':
+            columns[column] = df[column].to_numpy(dtype=np.int64)
+        else:
+            columns[column] = df[column].to_numpy()
+    return columns
+
+
+def save_klines(df, path):
+    """
+    Save a klines/indicators DataFrame, in the format given by the path suffix.
+
+    Args:
+    - df (pd.DataFrame): 'time' is stored as int64, 'date' as a day-precision date and every
+      other column with its own dtype (float64 for prices, volumes and indicators).
+    - path: target .csv file, .parquet file or .npy directory. An existing dataset is replaced.
+    """
+    file_format = dataset_format(path)
+    parent = os.path.dirname(str(path))
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+
+    if file_format == 'csv':
+        df.to_csv(path, index=False)
+        return
+
+    columns = _column_arrays(df)
+
+    if file_format == 'parquet':
+        _require_pyarrow()
+        table = pa.table(columns)
+        pq.write_table(table, path, compression=PARQUET_COMPRESSION, row_group_size=PARQUET_ROW_GROUP_SIZE)
+        return
+
+    # .npy store: write to a temporary directory first so readers never see a half-written dataset
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for index, (column, values) in enumerate(columns.items()):
+        np.save(os.path.join(tmp_path, f"{index}.npy"), np.ascontiguousarray(values))
+    with open(os.path.join(tmp_path, NPY_META_FILE), 'w') as meta_file:
+        json.dump({'columns': list(columns), 'rows': len(df)}, meta_file)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+
+def _csv_row_offset(path, row):
+    """
+    Byte offset where data row `row` starts in a CSV file written by save_klines.
+    """
+    lines = row + 1  # header line
+    offset = 0
+    with open(path, 'rb') as csv_file:
+        while lines:
+            chunk = csv_file.read(1 << 24)
+            if not chunk:
+                raise ValueError(f"{path} has fewer than {row} rows")
+            count = chunk.count(b'\n')
+            if count < lines:
+                lines -= count
+                offset += len(chunk)
+                continue
+            position = -1
+            for _ in range(lines):
+                position = chunk.index(b'\n', position + 1)
+            return offset + position + 1
+    return offset
+
+
+def _rewrite_npy_tail(path, values, start):
+    """
+    Truncate a .npy file to `start` rows and append `values`, updating the header in place.
+    """
+    with open(path, 'r+b') as npy_file:
+        version = np.lib.format.read_magic(npy_file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(npy_file)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(npy_file)
+        header_length = npy_file.tell()
+        if start > shape[0]:
+            raise ValueError(f"{path} has fewer than {start} rows")
+        values = np.ascontiguousarray(values, dtype=dtype)
+
+        # numpy pads headers so the row count can grow without moving the data
+        header = io.BytesIO()
+        header_data = {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': fortran_order,
+                       'shape': (start + len(values),)}
+        if version == (1, 0):
+            np.lib.format.write_array_header_1_0(header, header_data)
+        else:
+            np.lib.format.write_array_header_2_0(header, header_data)
+        if len(header.getvalue()) != header_length:
+            return False
+
+        npy_file.seek(header_length + start * dtype.itemsize)
+        npy_file.truncate()
+        npy_file.write(values.tobytes())
+        npy_file.seek(0)
+        npy_file.write(header.getvalue())
+    return True
+
+
+def write_tail(df, path, start):
+    """
+    Replace the rows of a stored dataset from row `start` on with df, keeping rows [0, start).
+
+    CSV and the .npy store are truncated and appended to in place, so the cost only depends
+    on the number of rows written; Parquet files cannot be appended to and are rewritten.
+    A missing dataset is created when start is 0.
+
+    Args:
+    - df (pd.DataFrame): the new tail, with the dataset's columns in the same order.
+    - path: .csv file, .parquet file or .npy directory.
+    - start: number of existing rows to keep.
+    """
+    if not os.path.exists(path):
+        if start:
+            raise FileNotFoundError(f"No dataset at {path} to append to")
+        save_klines(df, path)
+        return
+
+    file_format = dataset_format(path)
+    if file_format == 'csv':
+        offset = _csv_row_offset(path, start)
+        with open(path, 'r+b') as csv_file:
+            csv_file.truncate(offset)
+        df.to_csv(path, mode='a', header=False, index=False)
+        return
+
+    if file_format == 'parquet':
+        _require_pyarrow()
+        head = load_klines(path, stop=start)
+        save_klines(pd.concat([head, df], ignore_index=True), path)
+        return
+
+    with open(os.path.join(path, NPY_META_FILE)) as meta_file:
+        meta = json.load(meta_file)
+    if list(df.columns) != meta['columns']:
+        raise ValueError(f"Columns do not match the dataset at {path}")
+    columns = _column_arrays(df)
+    for index, values in enumerate(columns.values()):
+        if not _rewrite_npy_tail(os.path.join(path, f"{index}.npy"), values, start):
+            # Header cannot grow in place (never happens below 10**21 rows): rewrite everything
+            head = load_klines(path, stop=start)
+            save_klines(pd.concat([head, df], ignore_index=True), path)
+            return
+    meta['rows'] = start + len(df)
+    with open(os.path.join(path, NPY_META_FILE), 'w') as meta_file:
+        json.dump(meta, meta_file)
+
+
+def append_klines(df, path):
+    """
+    Append rows to a stored dataset, creating it if needed.
+
+    CSV and the .npy store are appended to in place; Parquet files are rewritten.
+    """
+    if not os.path.exists(path):
+        save_klines(df, path)
+        return
+    file_format = dataset_format(path)
+    if file_format == 'csv':
+        df.to_csv(path, mode='a', header=False, index=False)
+    elif file_format == 'parquet':
+        _require_pyarrow()
+        write_tail(df, path, pq.ParquetFile(path).metadata.num_rows)
+    else:
+        with open(os.path.join(path, NPY_META_FILE)) as meta_file:
+            write_tail(df, path, json.load(meta_file)['rows'])
+
+
+class KlinesWriter:
+    """
+    Write a dataset block by block, without holding all of it in memory.
+
+    The blocks go to a temporary file or directory that replaces `path` on close(), so readers
+    never see a half-written dataset. The result is the same as save_klines() on all blocks
+    concatenated. Usable as a context manager; leaving the block with an exception discards
+    the partial output.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file_format = dataset_format(path)
+        self.tmp_path = f"{path}.tmp"
+        self.rows = 0
+        self.columns = None
+        self.parquet_writer = None
+        parent = os.path.dirname(str(path))
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        if os.path.isdir(self.tmp_path):
+            shutil.rmtree(self.tmp_path)
+        elif os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        if self.file_format == 'parquet':
+            _require_pyarrow()
+
+    def write(self, df):
+        if self.columns is None:
+            self.columns = list(df.columns)
+        elif list(df.columns) != self.columns:
+            raise ValueError("All blocks must have the same columns")
+
+        if self.file_format == 'csv':
+            df.to_csv(self.tmp_path, mode='a', header=self.rows == 0, index=False)
+        elif self.file_format == 'parquet':
+            table = pa.table(_column_arrays(df))
+            if self.parquet_writer is None:
+                self.parquet_writer = pq.ParquetWriter(self.tmp_path, table.schema, compression=PARQUET_COMPRESSION)
+            self.parquet_writer.write_table(table.cast(self.parquet_writer.schema),
+                                            row_group_size=PARQUET_ROW_GROUP_SIZE)
+        else:
+            columns = _column_arrays(df)
+            if self.rows == 0:
+                os.makedirs(self.tmp_path)
+            for index, values in enumerate(columns.values()):
+                file_path = os.path.join(self.tmp_path, f"{index}.npy")
+                if self.rows == 0:
+                    np.save(file_path, np.ascontiguousarray(values))
+                elif not _rewrite_npy_tail(file_path, values, self.rows):
+                    raise ValueError(f"Cannot grow {file_path} in place")
+        self.rows += len(df)
+
+    def close(self):
+        if self.columns is None:
+            raise ValueError(f"Nothing was written to {self.path}")
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+        if self.file_format == 'npy':
+            with open(os.path.join(self.tmp_path, NPY_META_FILE), 'w') as meta_file:
+                json.dump({'columns': self.columns, 'rows': self.rows}, meta_file)
+            shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self):
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+        if os.path.isdir(self.tmp_path):
+            shutil.rmtree(self.tmp_path)
+        elif os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def iter_klines(path, chunk_rows, columns=None):
+    """
+    Read a stored dataset in blocks of chunk_rows rows (the last one may be shorter).
+
+    Yields:
+    - pd.DataFrame per block, with the same columns and dtypes as load_klines() and a RangeIndex
+      continuing across blocks.
+    """
+    file_format = dataset_format(path)
+    if file_format == 'csv':
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunk_rows)
+        return
+
+    if file_format == 'parquet':
+        _require_pyarrow()
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+        start = 0
+        for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=columns):
+            df = batch.to_pandas(date_as_object=False)
+            if 'date' in df.columns:
+                df['date'] = df['date'].astype('datetime64[s]')
+            df.index = pd.RangeIndex(start, start + len(df))
+            start += len(df)
+            yield df
+        return
+
+    with open(os.path.join(path, NPY_META_FILE)) as meta_file:
+        rows = json.load(meta_file)['rows']
+    for start in range(0, rows, chunk_rows):
+        df = load_klines(path, columns=columns, start=start, stop=start + chunk_rows)
+        df.index = pd.RangeIndex(start, start + len(df))
+        yield df
+
+
+def dataset_size(path):
+    """
+    Bytes used on disk by a stored dataset.
+    """
+    if os.path.isdir(path):
+        return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+    return os.path.getsize(path)
+
+
+def dataset_columns(path):
+    """
+    Column names of a stored dataset, without loading it.
+    """
+    file_format = dataset_format(path)
+    if file_format == 'csv':
+        return list(pd.read_csv(path, nrows=0).columns)
+    if file_format == 'parquet':
+        _require_pyarrow()
+        return pq.read_schema(path).names
+    with open(os.path.join(path, NPY_META_FILE)) as meta_file:
+        return json.load(meta_file)['columns']
+
+
+def float32_error(values):
+    """
+    Measured error of storing a float64 array as float32.
+
+    Returns:
+    - (max absolute error, max relative error) over the finite values; both are inf if a value
+      overflows float32. NaN positions are preserved by the conversion and ignored.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(over='ignore'):
+        rounded = values.astype(np.float32).astype(np.float64)
+    finite = np.isfinite(values)
+    if not np.array_equal(np.isfinite(rounded), finite):
+        return np.inf, np.inf
+    if not finite.any():
+        return 0.0, 0.0
+    error = np.abs(rounded[finite] - values[finite])
+    scale = np.abs(values[finite])
+    relative = np.divide(error, scale, out=np.zeros_like(error), where=scale > 0)
+    return float(error.max()), float(relative.max())
+
+
+def compact_klines(df, max_relative_error=COMPACT_MAX_RELATIVE_ERROR):
+    """
+    Memory-compact copy of a klines/indicators DataFrame.
+
+    'time' becomes int64 epoch milliseconds, 'date' a categorical of day timestamps (2-byte
+    codes instead of one Python object or 8-byte datetime per row) and every float64 column
+    outside COMPACT_FULL_PRECISION becomes float32 if its measured relative error stays
+    within max_relative_error.
+
+    Returns:
+    - (compact DataFrame, {column: (max absolute error, max relative error)} of the
+      columns that were downcast).
+    """
+    compact = {}
+    errors = {}
+    for column in df.columns:
+        values = df[column]
+        if column == 'time':
+            values = values.to_numpy(dtype=np.int64)
+        elif column == 'date':
+            values = pd.Categorical(pd.to_datetime(values))
+        elif values.dtype == np.float64 and column not in COMPACT_FULL_PRECISION:
+            absolute_error, relative_error = float32_error(values.to_numpy())
+            if relative_error <= max_relative_error:
+                values = values.to_numpy(dtype=np.float32)
+                errors[column] = (absolute_error, relative_error)
+        compact[column] = values
+    return pd.DataFrame(compact, index=df.index), errors
+
+
+def bytes_per_row(df):
+    """
+    In-memory size of a DataFrame per row, Python objects included.
+    """
+    return df.memory_usage(index=True, deep=True).sum() / max(len(df), 1)
+
+
+def load_klines(path, columns=None, start=None, stop=None, compact=False):
+    """
+    Load a stored klines/indicators dataset.
+
+    Args:
+    - path: .csv file, .parquet file or .npy directory.
+    - columns: columns to read, all of them if None. Columnar formats only touch these columns on disk.
+    - start, stop: row range to read (like a slice), the whole dataset if None.
+    - compact: return the memory-compact representation of compact_klines (float32 indicators,
+      categorical date). The columns are then copies in memory, even from the .npy store.
+
+    Returns:
+    - pd.DataFrame with a fresh RangeIndex. From the .npy store the numeric columns are read-only
+      views of memory-mapped files, so only the pages actually used are ever read from disk.
+    """
+    if compact:
+        return compact_klines(load_klines(path, columns=columns, start=start, stop=stop))[0]
+
+    file_format = dataset_format(path)
+
+    if file_format == 'csv':
+        skiprows = range(1, start + 1) if start else None
+        nrows = None if stop is None else stop - (start or 0)
+        return pd.read_csv(path, usecols=columns, skiprows=skiprows, nrows=nrows)
+
+    if file_format == 'parquet':
+        _require_pyarrow()
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+        rows = parquet_file.metadata.num_rows
+        start, stop, _ = slice(start, stop).indices(rows)
+        # Read only the row groups overlapping [start, stop)
+        row_groups = []
+        first_row = offset = 0
+        for index in range(parquet_file.num_row_groups):
+            group_rows = parquet_file.metadata.row_group(index).num_rows
+            if offset + group_rows > start and offset < stop:
+                if not row_groups:
+                    first_row = offset
+                row_groups.append(index)
+            offset += group_rows
+        if row_groups:
+            table = parquet_file.read_row_groups(row_groups, columns=columns)
+            table = table.slice(start - first_row, max(stop - start, 0))
+        else:
+            table = parquet_file.schema_arrow.empty_table()
+            table = table.select(columns) if columns is not None else table
+        df = table.to_pandas(date_as_object=False)
+        if 'date' in df.columns:
+            df['date'] = df['date'].astype('datetime64[s]')
+        return df
+
+    with open(os.path.join(path, NPY_META_FILE)) as meta_file:
+        meta = json.load(meta_file)
+    selected = meta['columns'] if columns is None else columns
+    data = {}
+    for column in selected:
+        values = np.load(os.path.join(path, f"{meta['columns'].index(column)}.npy"), mmap_mode='r')[start:stop]
+        if column == 'date':
+            # pandas has no day-precision datetimes, this is the only column that gets copied
+            values = values.astype('datetime64[s]')
+        data[column] = values
+    return pd.DataFrame(data, copy=False)
@@ -0,0 +1,115 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from aiohttp import web
+
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent.parent / 'historical'))
+
+import http_client
+from fake_exchange import FakeMarket, FakeExchange
+from get_historical_klines import fetch_historical_klines_to_df, sync_klines, load_manifest
+from http_client import KlinesClient, close_clients, get_client
+from storage import find_dataset, load_klines
+
+MINUTE = 60_000
+DAY = 1440 * MINUTE
+ROWS = 400
+
+
+def make_market(hole=(150, 157), interval='1m'):
+    """
+    FakeMarket of one stream with every bar closed but the last, and a hole on the
+    exchange side (klines that were never traded) in the middle.
+    """
+    rng = np.random.default_rng(2)
+    close = np.round(np.cumsum(rng.normal(0, 10, ROWS)) + 20000, 2)
+    df = pd.DataFrame({
+        'time': np.arange(ROWS, dtype=np.int64) * (DAY if interval == '1d' else MINUTE),
+        'open': np.round(close + rng.normal(0, 3, ROWS), 2), 'high': close + 5, 'low': close - 5, 'close': close,
+        'volume': np.round(rng.random(ROWS) * 7, 5)
+    })
+    df = df.drop(index=range(*hole)).reset_index(drop=True)
+    return FakeMarket({('BTCUSDT', interval): df}, len(df) - 1)
+
+
+async def serve(exchange):
+    runner = web.AppRunner(exchange.application())
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    return runner, f"http://{host}:{port}"
+
+
+def expected_rows(market, first, last, interval='1m'):
+    stream = market.find('BTCUSDT', interval)
+    closed = market.closed_count(stream)
+    times = stream['time'][:closed]
+    selected = (times >= first) & (times <= last)
+    return pd.DataFrame({'time': times[selected],
+                         **{column: values[:closed][selected] for column, values in stream['values'].items()}})
+
+
+def test_paginated_download_matches_source_despite_faults(monkeypatch):
+    monkeypatch.setattr(http_client, 'RETRY_BACKOFF_SECONDS', 0.01)
+    market = make_market()
+    exchange = FakeExchange(market, rate_limit_probability=0.05, error_probability=0.2, seed=4)
+    times = market.find('BTCUSDT', '1m')['time']
+    # Starts mid-window and ends on the last closed kline, pages of 23 klines straddle the hole
+    first, last = int(times[3]) + 1, int(times[-2])
+
+    async def run():
+        runner, base_url = await serve(exchange)
+        client = KlinesClient(base_url, use_cache=False)
+        try:
+            return await fetch_historical_klines_to_df('BTCUSDT', '1m', first, last, limit=23, client=client)
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    df = asyncio.run(run())
+    assert exchange.stats['rate_limited'] > 0 and exchange.stats['errors'] > 0
+    expected = expected_rows(market, first, last)
+    assert list(df.columns) == list(expected.columns)
+    assert df['time'].tolist() == expected['time'].tolist()
+    for column in ('open', 'high', 'low', 'close', 'volume'):
+        assert np.array_equal(df[column].to_numpy(), expected[column].to_numpy()), column
+
+
+def test_sync_resumes_from_the_manifest_and_ends_on_the_last_closed_kline(tmp_path):
+    # Daily bars: the kline in progress cannot close while the test runs (short of midnight UTC)
+    market = make_market(interval='1d')
+    exchange = FakeExchange(market)
+    times = market.find('BTCUSDT', '1d')['time']
+    first = int(times[0])
+
+    async def run():
+        runner, base_url = await serve(exchange)
+        get_client(base_url).use_cache = False
+        try:
+            sync = lambda end_str=None: sync_klines('BTCUSDT', '1d', first, end_str, directory=tmp_path,
+                                                    output_format='npy', base_url=base_url, limit=50)
+            partial_added = await sync(int(times[100]))
+            added = await sync()
+            requests = exchange.stats['requests']
+            # Everything is covered now: nothing is requested or added again
+            assert await sync() == 0
+            assert exchange.stats['requests'] == requests
+            return partial_added, added
+        finally:
+            await close_clients()
+            await runner.cleanup()
+
+    partial_added, added = asyncio.run(run())
+    # The last kline is still in progress, the default end stops on the one before it
+    expected = expected_rows(market, first, int(times[-2]), '1d')
+    assert partial_added == 101
+    assert partial_added + added == len(expected)
+    df = load_klines(find_dataset(str(tmp_path / 'BTCUSDT_1d_klines')))
+    assert df['time'].tolist() == expected['time'].tolist()
+    assert np.array_equal(df['close'].to_numpy(), expected['close'].to_numpy())
+    assert load_manifest(tmp_path)['BTCUSDT_1d_klines'] == [[first, int(times[-2])]]
@@ -0,0 +1,41 @@
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from http_client import KlinesClient, KLINES_PATH
+
+DAY = 86_400_000
+THREE_DAYS = 3 * DAY
+
+
+def klines_body(open_times, interval_ms):
+    rows = [f'[{t},"1.0","2.0","0.5","1.5","10.0",{t + interval_ms - 1},"0",1,"0","0","0"]' for t in open_times]
+    return f"[{','.join(rows)}]".encode()
+
+
+def test_response_with_a_kline_still_forming_is_not_cached(tmp_path):
+    client = KlinesClient('http://exchange.test', cache_directory=tmp_path)
+    now = int(time.time() * 1000)
+    # The request ends in a 3d bucket closed on resample's grid, but the exchange's 3d kline
+    # returned for it opened later and is still forming
+    end_time = (now - THREE_DAYS) // THREE_DAYS * THREE_DAYS + 1
+    params = {'symbol': 'BTCUSDT', 'interval': '3d', 'startTime': end_time - 10 * THREE_DAYS, 'endTime': end_time}
+    assert client.cacheable(KLINES_PATH, params)
+    forming = klines_body([now - 2 * THREE_DAYS - DAY, now - THREE_DAYS - DAY, now - DAY], THREE_DAYS)
+    client.cache_store(KLINES_PATH, params, forming)
+    assert not os.path.exists(client.cache_path(KLINES_PATH, params))
+    assert client.cache_lookup(KLINES_PATH, params) is None
+
+    closed = klines_body([end_time - 1 - 2 * THREE_DAYS, end_time - 1 - THREE_DAYS], THREE_DAYS)
+    client.cache_store(KLINES_PATH, params, closed)
+    assert client.cache_lookup(KLINES_PATH, params) == closed
+
+
+def test_empty_response_of_a_closed_range_is_cached(tmp_path):
+    client = KlinesClient('http://exchange.test', cache_directory=tmp_path)
+    params = {'symbol': 'BTCUSDT', 'interval': '1d', 'startTime': 0, 'endTime': 10 * DAY}
+    client.cache_store(KLINES_PATH, params, b'[]')
+    assert client.cache_lookup(KLINES_PATH, params) == b'[]'
@@ -0,0 +1,103 @@
+import copy
+import math
+import pickle
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent.parent / 'historical'))
+
+from indicator_engine import IndicatorEngine, iter_bars
+from indicator_graph import compute_indicators, ALL_INDICATORS
+from storage import load_klines, save_klines
+from calculate_historical_klines import process_file, process_file_chunked, extend_file
+
+# Long enough for every indicator window to fill several times, short enough to stay fast
+ROWS = 3000
+
+
+@pytest.fixture(scope='module')
+def klines():
+    """
+    Seeded random-walk klines with the awkward cases the indicators special-case:
+    flat bars (high == low) and zero volume.
+    """
+    rng = np.random.default_rng(0)
+    close = np.round(np.cumsum(rng.normal(0, 20, ROWS)) + 40000, 2)
+    open_ = np.concatenate([[close[0]], close[:-1]])
+    high = np.maximum(open_, close) + np.round(rng.random(ROWS) * 15, 2)
+    low = np.minimum(open_, close) - np.round(rng.random(ROWS) * 15, 2)
+    flat = rng.random(ROWS) < 0.02
+    high[flat] = low[flat] = open_[flat] = close[flat]
+    volume = np.round(rng.random(ROWS) * 10, 4)
+    volume[rng.random(ROWS) < 0.01] = 0
+    times = 1_500_000_000_000 + np.arange(ROWS, dtype=np.int64) * 60_000
+    return pd.DataFrame({'time': times, 'open': open_, 'high': high, 'low': low, 'close': close, 'volume': volume})
+
+
+def assert_same_frame(actual, expected):
+    # Bit-exact: the streaming and chunked paths promise the batch values, not approximations
+    assert list(actual.columns) == list(expected.columns)
+    assert len(actual) == len(expected)
+    for column in expected.columns:
+        if column == 'date':
+            assert (actual[column].astype(str).to_numpy() == expected[column].astype(str).to_numpy()).all()
+        else:
+            assert np.array_equal(actual[column].to_numpy(dtype=np.float64), expected[column].to_numpy(dtype=np.float64),
+                                  equal_nan=True), column
+
+
+def same_value(a, b):
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return True
+    return a == b
+
+
+def test_streaming_engine_matches_batch(klines):
+    engine = IndicatorEngine(ALL_INDICATORS)
+    rows = []
+    for bar in iter_bars(klines):
+        rows.append(engine.update(bar))
+        for position, column, value in engine.revisions:
+            rows[position][column] = value
+    streamed = pd.DataFrame(rows, columns=engine.columns)
+    batch = compute_indicators(klines.copy(), ALL_INDICATORS)
+    assert_same_frame(streamed, batch[engine.columns])
+
+
+def test_chunked_matches_serial(klines, tmp_path):
+    source = tmp_path / 'BTCUSDT_1m_klines.npy'
+    save_klines(klines, source)
+    process_file(source, tmp_path / 'serial.npy')
+    # A chunk size that does not divide the rows, so look-ahead rows straddle chunk edges
+    process_file_chunked(source, tmp_path / 'chunked.npy', chunk_rows=701)
+    assert_same_frame(load_klines(tmp_path / 'chunked.npy'), load_klines(tmp_path / 'serial.npy'))
+
+
+def test_extend_matches_full_recompute(klines, tmp_path):
+    source = tmp_path / 'BTCUSDT_1m_klines.npy'
+    target = tmp_path / 'extended.npy'
+    # Seeded from a prefix, then extended twice as klines are appended to the source
+    for rows in (1000, 1700, ROWS):
+        save_klines(klines.iloc[:rows], source)
+        extend_file(source, target)
+    process_file(source, tmp_path / 'full.npy')
+    assert_same_frame(load_klines(target), load_klines(tmp_path / 'full.npy'))
+
+
+def test_peek_matches_update_without_changing_state(klines):
+    engine = IndicatorEngine(ALL_INDICATORS)
+    for index, bar in enumerate(iter_bars(klines)):
+        # Every bar early on (windows filling up), then a sample
+        if index < 100 or index % 37 == 0:
+            committed = pickle.dumps(engine)
+            peeked = engine.peek(bar)
+            assert pickle.dumps(engine) == committed
+            expected = copy.deepcopy(engine).update(bar)
+            assert list(peeked) == list(expected)
+            assert all(same_value(peeked[column], expected[column]) for column in expected), index
+        engine.update(bar)
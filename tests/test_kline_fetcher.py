@@ -0,0 +1,89 @@
+import asyncio
+import random
+import sys
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+from aiohttp import web
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+pytest.importorskip('binance')
+
+import kline_fetcher
+from fake_exchange import FakeMarket, FakeExchange
+from http_client import close_clients, get_client
+from kline_fetcher import fetch_multiplexed_klines, fetch_historical_klines_array
+from live_streams import StreamRouter, stream_name
+
+SECOND = 1000
+BARS = 2000
+
+
+def make_market(history=200):
+    """
+    FakeMarket of one 1s stream, `history` bars already closed.
+    """
+    rng = np.random.default_rng(1)
+    close = np.round(np.cumsum(rng.normal(0, 5, BARS)) + 30000, 2)
+    df = pd.DataFrame({
+        'time': np.arange(BARS, dtype=np.int64) * SECOND,
+        'open': close, 'high': close + 1, 'low': close - 1, 'close': close, 'volume': np.ones(BARS)
+    })
+    return FakeMarket({('BTCUSDT', '1s'): df}, history)
+
+
+async def serve(exchange):
+    runner = web.AppRunner(exchange.application())
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    return runner, f"http://{host}:{port}", f"ws://{host}:{port}"
+
+
+def test_disconnects_are_backfilled_without_holes(monkeypatch, tmp_path):
+    # Longest reconnect delay, so every disconnect misses at least one closed 1s bar
+    monkeypatch.setattr(random, 'uniform', lambda low, high: high)
+    market = make_market()
+    exchange = FakeExchange(market, frames_per_second=4, disconnect_probability=0.05, seed=2)
+    name = stream_name('BTCUSDT', '1s')
+
+    async def run():
+        runner, base_url, stream_url = await serve(exchange)
+        get_client(base_url).use_cache = False
+        fetch_klines = partial(fetch_historical_klines_array, base_url=base_url)
+        router = StreamRouter(1000, fetch_klines=fetch_klines)
+        router.add('BTCUSDT', '1s')
+        producer = asyncio.create_task(fetch_multiplexed_klines(router.streams, router, stream_url=stream_url))
+        try:
+            await router.warm_start(fetch_klines, tmp_path, bars=100)
+            consumers = router.start_consumers()
+            await asyncio.sleep(8)
+            # A malformed frame on every connection is skipped, the connection stays up
+            for _, _, queue in exchange.connections.values():
+                queue.put_nowait('not json')
+                queue.put_nowait('{"stream": "%s", "data": {}}' % name)
+            await asyncio.sleep(1)
+            exchange.disconnect_probability = 0
+            await asyncio.sleep(4)
+            assert not producer.done()
+            for consumer in consumers:
+                consumer.cancel()
+        finally:
+            producer.cancel()
+            await close_clients()
+            await runner.cleanup()
+            router.compute.shutdown()
+        return router.streams[name]
+
+    stream = asyncio.run(run())
+    assert exchange.stats['disconnects'] > 0
+    # The klines missed while reconnecting were fetched over REST, none is left waiting
+    assert stream.backfilled > 0
+    assert not stream.pending
+    times = stream.frame()['time'].to_numpy()
+    assert (np.diff(times) == SECOND).all()
@@ -0,0 +1,118 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from kline_decoding import KLINE_DTYPE
+from live_streams import StreamRouter, stream_name
+
+MINUTE = 60_000
+
+
+def make_kline(open_time, close, closed=True, symbol='BTCUSDT', interval='1m'):
+    """
+    Websocket kline payload ('k' of a kline event) of a 1m bar.
+    """
+    return {
+        't': open_time, 'T': open_time + MINUTE - 1, 's': symbol, 'i': interval,
+        'o': repr(close), 'h': repr(close + 1), 'l': repr(close - 1), 'c': repr(close), 'v': '1.0',
+        'x': closed
+    }
+
+
+async def drain(router):
+    """
+    Run the consumers until every routed kline has been processed.
+    """
+    consumers = router.start_consumers()
+    try:
+        await asyncio.gather(*(stream.queue.join() for stream in router.streams.values()))
+    finally:
+        for consumer in consumers:
+            consumer.cancel()
+        router.compute.shutdown()
+
+
+def test_tick_is_never_evaluated_on_state_missing_the_previous_bar():
+    evaluated = []
+
+    def on_tick(state, row):
+        evaluated.append((state.last_time, row['time']))
+
+    async def run():
+        router = StreamRouter(50, on_tick=on_tick)
+        router.add('BTCUSDT', '1m')
+        name = stream_name('BTCUSDT', '1m')
+        # The marker of bar 1's tick is queued ahead of bar 1's close, and by the time it is
+        # read the latest tick belongs to bar 2
+        await router.route(name, make_kline(0, 100.0))
+        await router.route(name, make_kline(MINUTE, 101.0, closed=False))
+        await router.route(name, make_kline(MINUTE, 102.0))
+        await router.route(name, make_kline(2 * MINUTE, 103.0, closed=False))
+        await drain(router)
+
+    asyncio.run(run())
+    # Bar 2's tick is evaluated once, after bar 1 was committed
+    assert evaluated == [(MINUTE, 2 * MINUTE)]
+
+
+def test_drop_oldest_never_drops_a_closed_kline():
+    committed = []
+
+    def on_kline(state):
+        committed.append(state.last_time)
+
+    async def run():
+        router = StreamRouter(50, queue_size=2, overflow='drop_oldest', on_kline=on_kline,
+                              on_tick=lambda state, row: None)
+        router.add('BTCUSDT', '1m')
+        name = stream_name('BTCUSDT', '1m')
+        stream = router.streams[name]
+        await router.route(name, make_kline(0, 100.0))
+        await router.route(name, make_kline(0, 100.5, closed=False))
+        # The queue is full: the tick marker makes room for the closed kline
+        await router.route(name, make_kline(MINUTE, 101.0))
+        assert stream.dropped == 1
+        # Only closed klines are queued now, so the next one waits for the consumer
+        consumers = router.start_consumers()
+        await router.route(name, make_kline(2 * MINUTE, 102.0))
+        assert stream.blocked == 1
+        for consumer in consumers:
+            consumer.cancel()
+        await drain(router)
+
+    asyncio.run(run())
+    assert committed == [0, MINUTE, 2 * MINUTE]
+
+
+def test_kline_closed_during_warm_start_is_backfilled(tmp_path):
+    history = np.zeros(12, dtype=KLINE_DTYPE)
+    history['time'] = np.arange(12) * MINUTE
+    history['close'] = 100.0 + np.arange(12)
+
+    async def run():
+        name = stream_name('BTCUSDT', '1m')
+
+        async def fetch_klines(symbol, interval, limit, end_time=None, start_time=None):
+            if start_time is None:
+                # Bar 10 closes after the warm-up request, bar 11 is the first one the websocket sees
+                await router.route(name, make_kline(11 * MINUTE, 111.0))
+                return history[:10]
+            return history[history['time'] >= start_time][:limit]
+
+        router = StreamRouter(50, fetch_klines=fetch_klines)
+        router.add('BTCUSDT', '1m')
+        await router.warm_start(fetch_klines, tmp_path, bars=10)
+        stream = router.streams[name]
+        if stream.repair is not None:
+            await stream.repair
+        await drain(router)
+        return stream
+
+    stream = asyncio.run(run())
+    assert stream.gaps == 1
+    assert stream.backfilled == 2
+    assert stream.frame()['time'].tolist() == history['time'].tolist()
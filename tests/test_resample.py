@@ -0,0 +1,52 @@
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from resample import bucket_starts, bucket_ends, INTERVAL_MILLISECONDS
+
+DAY = 86_400_000
+
+
+def ms(*args):
+    return int(datetime(*args, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+@pytest.mark.parametrize('interval, time, start, end', [
+    # Fixed length intervals: an open time starts its own bucket, a millisecond earlier is in the one before
+    ('1m', ms(2024, 1, 3, 15, 7), ms(2024, 1, 3, 15, 7), ms(2024, 1, 3, 15, 8)),
+    ('1m', ms(2024, 1, 3, 15, 7) - 1, ms(2024, 1, 3, 15, 6), ms(2024, 1, 3, 15, 7)),
+    ('4h', ms(2024, 1, 3, 15, 7), ms(2024, 1, 3, 12), ms(2024, 1, 3, 16)),
+    ('1d', ms(2024, 1, 3, 23, 59, 59), ms(2024, 1, 3), ms(2024, 1, 4)),
+    # 3 days from the epoch: 2023-12-31 is 19722 days in, a multiple of 3
+    ('3d', ms(2024, 1, 2, 23), ms(2023, 12, 31), ms(2024, 1, 3)),
+    ('3d', ms(2024, 1, 3), ms(2024, 1, 3), ms(2024, 1, 6)),
+    # Weeks open on Monday, not on the Thursday the epoch fell on
+    ('1w', ms(2024, 1, 3, 15), ms(2024, 1, 1), ms(2024, 1, 8)),
+    ('1w', ms(2024, 1, 1), ms(2024, 1, 1), ms(2024, 1, 8)),
+    ('1w', ms(2024, 1, 7, 23, 59, 59), ms(2024, 1, 1), ms(2024, 1, 8)),
+    # Calendar months, leap February and the turn of the year included
+    ('1M', ms(2024, 2, 29, 12), ms(2024, 2, 1), ms(2024, 3, 1)),
+    ('1M', ms(2023, 12, 31, 23, 59), ms(2023, 12, 1), ms(2024, 1, 1)),
+    ('1M', ms(2024, 1, 1), ms(2024, 1, 1), ms(2024, 2, 1)),
+])
+def test_bucket_grid(interval, time, start, end):
+    starts = bucket_starts([time], interval)
+    assert starts.dtype == np.int64
+    assert starts.tolist() == [start]
+    assert bucket_ends(starts, interval).tolist() == [end]
+
+
+def test_bucket_starts_of_consecutive_klines_tile_the_time_line():
+    times = np.arange(ms(2023, 11, 20), ms(2024, 3, 10), 3_600_000, dtype=np.int64)
+    for interval in ('1h', '1d', '3d', '1w', '1M'):
+        starts = np.unique(bucket_starts(times, interval))
+        # Every bucket ends where the next one starts
+        assert (bucket_ends(starts[:-1], interval) == starts[1:]).all(), interval
+        if interval in INTERVAL_MILLISECONDS:
+            assert (np.diff(starts) == INTERVAL_MILLISECONDS[interval]).all(), interval
+    assert (bucket_starts(times, '3d') % (3 * DAY) == 0).all()
@@ -1,9 +1,60 @@
+import numpy as np
 import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Number of windows materialized at once by the sliding-window kernels, bounds their temporary memory
+WINDOW_KERNEL_CHUNK_SIZE = 65536
 
 # Function to convert a datetime object to milliseconds since epoch
 def datetime_to_milliseconds(dt_obj):
     return int(dt_obj.timestamp() * 1000)
 
+def rolling_mean_abs_deviation(values, window):
+    """
+    Mean absolute deviation of each full window around its own mean, on a raw float64 array.
+
+    Equivalent to rolling(window).apply(lambda x: (x - x.mean()).abs().mean()), but evaluated
+    in bulk over sliding-window views instead of calling Python once per window.
+    Rows before the first full window, and windows containing NaN, are NaN.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    result = np.full(len(values), np.nan)
+    if len(values) < window:
+        return result
+
+    windows = sliding_window_view(values, window)
+    for start in range(0, len(windows), WINDOW_KERNEL_CHUNK_SIZE):
+        block = windows[start:start + WINDOW_KERNEL_CHUNK_SIZE]
+        deviation = np.abs(block - block.mean(axis=1, keepdims=True)).mean(axis=1)
+        result[start + window - 1:start + window - 1 + len(block)] = deviation
+    return result
+
+def rolling_centered_extremum(values, window, find_max=True):
+    """
+    Mark the rows that are the extremum of the centered window around them, on a raw float64 array.
+
+    Equivalent to rolling(window, center=True).apply(lambda x: x.max() if x.argmax() == window // 2 else np.nan, raw=True)
+    (or the argmin/min variant): a row keeps its value only when it is the first occurrence of the
+    window's max/min, every other row is NaN, as are incomplete windows and windows containing NaN.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    result = np.full(len(values), np.nan)
+    if len(values) < window:
+        return result
+
+    middle = window // 2
+    nan_counts = np.concatenate(([0], np.cumsum(np.isnan(values))))
+    windows = sliding_window_view(values, window)
+    for start in range(0, len(windows), WINDOW_KERNEL_CHUNK_SIZE):
+        block = windows[start:start + WINDOW_KERNEL_CHUNK_SIZE]
+        positions = block.argmax(axis=1) if find_max else block.argmin(axis=1)
+        first = np.arange(start, start + len(block))
+        has_nan = nan_counts[first + window] != nan_counts[first]
+        is_extremum = (positions == middle) & ~has_nan
+        centers = first[is_extremum] + middle
+        result[centers] = values[centers]
+    return result
+
 def add_date_column(df):
     """
     Add a 'date' column to the DataFrame, derived from the 'time' column.
@@ -75,19 +126,16 @@ def calculate_obv(df):
     """
     Calculate On-Balance Volume (OBV) for the DataFrame, ensuring 'OBV' is treated as float.
     """
-    # Initialize OBV column as float to ensure compatibility with volume data
-    df['OBV'] = 0.0  # Ensures OBV is float from the start
-    
-    for i in range(1, len(df)):
-        if df.loc[i, 'close'] > df.loc[i-1, 'close']:
-            df.loc[i, 'OBV'] = df.loc[i-1, 'OBV'] + df.loc[i, 'volume']
-        elif df.loc[i, 'close'] < df.loc[i-1, 'close']:
-            df.loc[i, 'OBV'] = df.loc[i-1, 'OBV'] - df.loc[i, 'volume']
-        else:
-            df.loc[i, 'OBV'] = df.loc[i-1, 'OBV']
-    
-    # Ensure the 'OBV' column is explicitly treated as a float to avoid dtype issues
-    df['OBV'] = df['OBV'].astype(float)
+    close = df['close'].to_numpy(dtype=float)
+    volume = df['volume'].to_numpy(dtype=float)
+
+    # Volume is added on up closes, subtracted on down closes and ignored when unchanged
+    signed_volume = np.zeros(len(df))
+    signed_volume[1:] = np.where(close[1:] > close[:-1], volume[1:],
+                                 np.where(close[1:] < close[:-1], -volume[1:], 0.0))
+
+    # OBV starts at 0 and is the running total of the signed volume
+    df['OBV'] = np.cumsum(signed_volume)
     
     return df
 
@@ -128,12 +176,20 @@ def calculate_ad_line(df):
     """
     Calculate the Accumulation/Distribution Line for the given DataFrame.
     """
-    # Initialize A/D Line with 0s
-    df['AD_Line'] = 0.0
-    
-    for i in range(1, len(df)):
-        clv = ((df.loc[i, 'close'] - df.loc[i, 'low']) - (df.loc[i, 'high'] - df.loc[i, 'close'])) / (df.loc[i, 'high'] - df.loc[i, 'low']) if (df.loc[i, 'high'] - df.loc[i, 'low']) != 0 else 0
-        df.loc[i, 'AD_Line'] = df.loc[i-1, 'AD_Line'] + (clv * df.loc[i, 'volume'])
+    high = df['high'].to_numpy(dtype=float)
+    low = df['low'].to_numpy(dtype=float)
+    close = df['close'].to_numpy(dtype=float)
+    volume = df['volume'].to_numpy(dtype=float)
+
+    # Close Location Value, 0 for bars without a range
+    price_range = high - low
+    clv = np.zeros(len(df))
+    np.divide((close - low) - (high - close), price_range, out=clv, where=price_range != 0)
+
+    # A/D Line starts at 0 on the first row and accumulates CLV-weighted volume from there
+    money_flow_volume = clv * volume
+    money_flow_volume[:1] = 0.0
+    df['AD_Line'] = np.cumsum(money_flow_volume)
     
     return df
 
@@ -149,7 +205,7 @@ def calculate_cci(df, period=20):
 
     # Calculate Mean Deviation without using lambda
     # The mean absolute deviation around the rolling mean (not around 0)
-    df['MD'] = df['TP'].rolling(window=period).apply(lambda x: (x - x.mean()).abs().mean(), raw=False)
+    df['MD'] = rolling_mean_abs_deviation(df['TP'].to_numpy(dtype=float), period)
 
     # Calculate CCI
     df['CCI'] = (df['TP'] - df['TP_SMA']) / (0.015 * df['MD'])
@@ -229,8 +285,6 @@ def calculate_roc(df, period=14):
     df['ROC'] = ((df['close'] - df['close'].shift(period)) / df['close'].shift(period)) * 100
     return df
 
-import numpy as np
-
 def calculate_support_resistance(df, window=14):
     """
     Calculate potential support and resistance levels.
@@ -243,10 +297,10 @@ def calculate_support_resistance(df, window=14):
     - df (pd.DataFrame): The DataFrame with added 'Support' and 'Resistance' columns.
     """
     # Identify local maxima as potential resistance
-    df['Resistance'] = df['high'].rolling(window=window, center=True).apply(lambda x: x.max() if x.argmax() == window // 2 else np.nan, raw=True)
+    df['Resistance'] = rolling_centered_extremum(df['high'].to_numpy(dtype=float), window, find_max=True)
     
     # Identify local minima as potential support
-    df['Support'] = df['low'].rolling(window=window, center=True).apply(lambda x: x.min() if x.argmin() == window // 2 else np.nan, raw=True)
+    df['Support'] = rolling_centered_extremum(df['low'].to_numpy(dtype=float), window, find_max=False)
     
     # Optional: Fill NaN values with the nearest non-NaN values for visualization purposes
     df['Support'] = df['Support'].ffill()
@@ -342,16 +396,20 @@ def add_heikin_ashi_columns(df):
     """
     # Initialize Heikin-Ashi columns to avoid NaN for the first row
     df['ha_close'] = (df['open'] + df['high'] + df['low'] + df['close']) / 4
-    df['ha_open'] = ((df['open'] + df['close']) / 2).shift(1)
-    df['ha_open'][0] = df['open'][0]  # Set the first Heikin-Ashi open to be the first open price
-    
-    # Calculate Heikin-Ashi high and low
-    df['ha_high'] = df[['high', 'ha_open', 'ha_close']].max(axis=1)
-    df['ha_low'] = df[['low', 'ha_open', 'ha_close']].min(axis=1)
-    
-    # Recalculate Heikin-Ashi open with a loop to use previous Heikin-Ashi open and close
-    for i in range(1, len(df)):
-        df.loc[i, 'ha_open'] = (df.loc[i-1, 'ha_open'] + df.loc[i-1, 'ha_close']) / 2
+    ha_open = ((df['open'] + df['close']) / 2).shift(1)
+    ha_open.iloc[:1] = df['open'].iloc[:1]  # Set the first Heikin-Ashi open to be the first open price
+    df['ha_open'] = ha_open
+    
+    # Calculate Heikin-Ashi high and low (fmax/fmin skip NaN like DataFrame.max/min do)
+    df['ha_high'] = np.fmax(np.fmax(df['high'], df['ha_open']), df['ha_close'])
+    df['ha_low'] = np.fmin(np.fmin(df['low'], df['ha_open']), df['ha_close'])
+    
+    # Recalculate Heikin-Ashi open from the previous Heikin-Ashi open and close:
+    # ha_open[i] = (ha_open[i-1] + ha_close[i-1]) / 2 is an EWM with alpha=0.5 over the
+    # previous ha_close, seeded with the first open, so pandas runs the recursion natively
+    previous_ha_close = df['ha_close'].shift(1)
+    previous_ha_close.iloc[:1] = df['open'].iloc[:1]
+    df['ha_open'] = previous_ha_close.ewm(alpha=0.5, adjust=False).mean()
     
     return df
 